@@ -1,13 +1,13 @@
-import pandas as pd
+import time
+
+import numpy as np
 import streamlit as st
-import math
-import re
-from rapidfuzz import process, fuzz
-import os
-import sys
 
-# For Excel reading (now directly integrated)
-import openpyxl
+from autobake_engine import (
+    CSV_FILE, SNAPSHOT_FILE, TIER2_NEAREST_K, CompositeMatchResult, MatchEngine, MatchInputError, catalog_memory_report, catalog_source,
+    generate_display_dataframe, summarize_capacity_sweep, sync_catalog_if_changed,
+)
+from autobake_metrics import PyinstrumentProfiler, metrics, profile_call, span
 
 # --- Streamlit Page Configuration and Custom CSS (MUST BE FIRST) ---
 st.set_page_config(layout="wide", page_title="Autobake Machine Match")
@@ -244,499 +244,174 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-# --- Excel to CSV Sync Function (Integrated) ---
-def excel_to_csv_sync(excel_file_path, csv_file_path):
-    # These messages will now go to the terminal/console, not the app UI.
-    print(f"🔄 Running Excel to CSV sync from '{excel_file_path}' to '{csv_file_path}'...")
-    try:
-        if not os.path.exists(excel_file_path):
-            print(f"ERROR: Source Excel file '{excel_file_path}' not found for sync.")
-            st.error(f"❌ Error: Source Excel file '{excel_file_path}' not found.")
-            st.stop()
-
-        # Read the Excel file, specifying the sheet name and reading all as strings initially
-        df = pd.read_excel(excel_file_path, sheet_name="Raw Data", dtype=str)
-
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                df[col] = df[col].fillna('').astype(str).str.strip()
-
-        df.to_csv(csv_file_path, index=False, encoding="utf-8")
-        print(f"✅ Sync completed: '{excel_file_path}' synced to '{csv_file_path}'.")
-        return True
-    except Exception as e:
-        print(f"❌ ERROR during Excel to CSV sync: {e}")
-        st.error(f"❌ Error during Excel to CSV sync. Details in terminal/console: {e}")
-        st.error("Please ensure 'Autobake_Machines_Data.xlsx' is correct and accessible, and that the sheet name ('Raw Data') is accurate.")
-        return False
-
 # --- Data Sync and Loading ---
-EXCEL_FILE = "Autobake_Machines_Data.xlsx"
-CSV_FILE = "Raw_Data.csv"
-
-if excel_to_csv_sync(EXCEL_FILE, CSV_FILE):
-    try:
-        df_raw = pd.read_csv(CSV_FILE, encoding="utf-8")
-
-        # Create numeric columns for calculations, keeping original string columns for display
-        df_raw["_Numeric_Dough Min (g)"] = pd.to_numeric(df_raw["Dough Min (g)"], errors="coerce")
-        df_raw["_Numeric_Dough Max (g)"] = pd.to_numeric(df_raw["Dough Max (g)"], errors="coerce")
-        df_raw["_Numeric_Production Capacity (pcs/hr)"] = pd.to_numeric(df_raw["Production Capacity (pcs/hr)"], errors="coerce")
-
-    except FileNotFoundError:
-        print(f"ERROR: '{CSV_FILE}' not found AFTER sync, or could not be loaded by pandas.")
-        st.error(f"❌ Error: '{CSV_FILE}' not found AFTER sync. This indicates an issue with the sync script or file permissions.")
-        st.stop()
-    except Exception as e:
-        print(f"ERROR: Exception loading '{CSV_FILE}' into DataFrame: {e}")
-        st.error(f"❌ Error loading '{CSV_FILE}' into DataFrame: {e}")
-        st.stop()
-else:
-    print("DEBUG: excel_to_csv_sync returned False. Stopping app.")
+# Mapped once per process and catalog version; reruns with an unchanged workbook reuse the same engine
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_match_engine(snapshot_path, catalog_version, _previous_engine=None):
+    # _previous_engine is not hashed; it only lets a new catalog version reuse unchanged line plans
+    return MatchEngine.from_snapshot(snapshot_path, catalog_version, previous=_previous_engine)
+
+@st.cache_resource(show_spinner=False)
+def last_loaded_engine():
+    return {}
+
+CATALOG_SOURCE = catalog_source() # The catalog directory when present, else the single workbook
+try:
+    catalog_version = sync_catalog_if_changed(CATALOG_SOURCE, CSV_FILE, SNAPSHOT_FILE)
+except FileNotFoundError as e:
+    st.error(f"❌ Error: {e}")
+    st.stop()
+except Exception as e:
+    st.error(f"❌ Error during Excel to CSV sync. Details in terminal/console: {e}")
+    st.error("Please ensure 'Autobake_Machines_Data.xlsx' is correct and accessible, and that the sheet name ('Raw Data') is accurate.")
     st.stop()
 
-# --- Preprocess Raw Data ---
-if "Products" not in df_raw.columns:
-    st.warning("⚠️ Warning: 'Products' column not found in `Raw_Data.csv`. Please ensure your Excel data has a column named 'Products' (case-sensitive) for proper matching.", icon="⚠️")
-    df_raw["Products"] = ""
-df_raw.dropna(subset=["Products"], inplace=True)
-df_raw["Products"] = df_raw["Products"].astype(str).str.lower()
-
-df_combined = df_raw.copy()
-df_combined.drop_duplicates(inplace=True)
-
-# --- Product normalization dictionary ---
-product_normalization = {
-    "bread": "bread", "bred": "bread", "brown bred": "brown bread", "brown bread": "brown bread",
-    "white bread": "white bread", "sour dough bread": "sourdough bread", "sourdough bread": "sourdough bread",
-    "bun": "bun", "buns": "bun", "roll": "roll", "rolls": "roll",
-    "doughnut": "donut", "doughnuts": "donut", "donut": "donut", "donuts": "donut",
-    "hotdog": "hot dog", "hot dog": "hot dog",
-    "cake": "cake", "cakes": "cake", "cupcake": "cup cake", "cupcakes": "cup cake",
-    "pastry": "pastry", "pastries": "pastry",
-    "pizza base": "pizza base", "pizza bases": "pizza base",
-    "naan": "naan", "naans": "naan",
-    "chapati": "chapati", "chapatis": "chapati",
-    "biscuit": "biscuit", "biscuits": "biscuit",
-    "cookie": "cookie", "cookies": "cookie", "cooky": "cookie",
-    "rusk": "rusk", "rusks": "rusk",
-    "muffin": "muffin", "muffins": "muffin",
-    "croissant": "croissant", "croissants": "croissant",
-    "toast": "toast", "toasts": "toast",
-    "puff": "puff pastry", "puffs": "puff pastry",
-    "baguette": "baguette", "baguettes": "baguette",
-    "brioche": "brioche", "brioches": "brioche",
-    "kulcha": "kulcha", "kulchas": "kulcha",
-    "swiss roll": "swiss roll", "swiss rolls": "swiss roll",
-    "eclair": "eclair", "eclairs": "eclair",
-    "macaron": "macaron", "macarons": "macaron",
-    "creme roll": "cream roll", "cream roll": "cream roll", # Consistent spelling
-    "pizza": "pizza base" # Alias for "pizza base"
-}
-
-def normalize_product(product_str):
-    p = str(product_str).strip().lower()
-    normalized = product_normalization.get(p, None)
-    if normalized:
-        return normalized
-    if p.endswith("s") and not p.endswith("ss"):
-        return p.rstrip("s")
-    return p
-
-def extract_and_normalize_products_from_df(product_series):
-    all_products = set()
-    for entry in product_series:
-        for p in str(entry).split(","):
-            normalized = normalize_product(p)
-            if normalized and normalized not in ["nan", "n/a", ""]:
-                all_products.add(normalized)
-    return sorted(list(all_products))
-
-product_set = extract_and_normalize_products_from_df(df_combined["Products"])
-
-# --- Define Mappings for Production Line Logic ---
-machine_stage_mapping = {
-    "Spiral Mixer": "Mixing", "Reinforced Spiral Mixer with Fixed Bowl": "Mixing",
-    "Hydraulic Bowl Lifter": "Mixing", "Spiral Mixer (Fixed Bowl)": "Mixing",
-    "Spiral Mixer with Hydraulic Lifter": "Mixing", "Mixer": "Mixing",
-    "Planetary Mixer": "Mixing", "Dough Mixer": "Mixing",
-
-    "Automatic divider & rounder": "Dividing", "Automatic Divider and Moulder": "Dividing",
-    "Dough Divider": "Dividing", "Dough Rounder": "Dividing",
-
-    "Automatic Cream Roll Forming": "Forming", "Cookie Dropping Machine": "Forming",
-    "Wire Cut Cookie Machine": "Forming", "Rotary Moulder": "Forming",
-    "Dough Moulder": "Forming", "Sheeter": "Forming", "Laminator": "Forming",
-    "Depositor": "Depositing", "Dough Former": "Forming", "Extruder": "Forming",
-
-    "Confectionery depositor": "Depositing", "Automatic Confectionery Depositer": "Depositing",
-    "Inline Depositing & Decorating": "Depositing",
-
-    "Depositing & Icing": "Finishing", "Depositing Injecting & Icing": "Finishing",
-    "Depositing & Injecting": "Filling", "Filling": "Filling", # Corrected typo in key to match value
-
-    "Convection oven": "Baking", "Fryer": "Baking",
-    "Cyclothermic Deck Oven": "Baking", "Rotary Rack Oven": "Baking",
-    "Rotary Convection Oven": "Baking", "Electric Deck Oven": "Baking",
-    "Tunnel Oven": "Baking", "Industrial Oven": "Baking",
-
-    "Vacuum Cooler": "Cooling", "Cooling Conveyor": "Cooling", "Cooling Tunnel": "Cooling",
-
-    "Slicing": "Slicing", "Slicing & Packing Line": "Slicing",
-    "Bread Slicer": "Slicing", "Automatic Commercial Bread Slicer": "Slicing",
-    "Automatic Bread Slicer": "Slicing", "Cake Slicer": "Slicing",
-
-    "Sourdough Fermenter": "Fermentation", "Proofer": "Proofing",
-    "Intermediate Proofer": "Proofing",
-
-    "Packing Machine": "Packing", "Flow Wrap Machine": "Packing",
-    "Vertical Form Fill Seal Machine": "Packing", "Horizontal Flow Wrapper": "Packing",
-    "Packaging Machine": "Packing",
-
-    "Syrup Spraying": "Finishing", "Glazer": "Finishing",
-    "Decorating Machine": "Finishing", "Enrober": "Finishing",
-
-    "Automatic Cake Line": "Complete Line", "Integrated Bread Line": "Complete Line",
-    "Integrated Bun Line": "Complete Line", "Integrated Cookie Line": "Complete Line",
-    "Integrated Donut Line": "Complete Line", "Integrated Pastry Line": "Complete Line",
-    "General Purpose": "General Processing", "Industrial Line": "Complete Line"
-}
-
-
-# Helper function for fuzzy matching categories
-def get_stage_from_category(category_name, mapping=machine_stage_mapping, threshold=85):
-    if pd.isna(category_name) or not isinstance(category_name, str):
-        return "N/A"
-    best_match = process.extractOne(category_name, mapping.keys(), scorer=fuzz.token_sort_ratio)
-    if best_match and best_match[1] >= threshold:
-        return mapping[best_match[0]]
-    return "N/A"
-
-product_to_group_mapping = {
-    "bun": "Bun & Pav Line", "long bun": "Bun & Pav Line", "ladi pav": "Bun & Pav Line",
-    "fruit bun": "Bun & Pav Line", "hamburger bun": "Bun & Pav Line",
-    "dinner roll": "Bun & Pav Line", "hot dog": "Bun & Pav Line",
-    "burger bun": "Bun & Pav Line", "pav": "Bun & Pav Line",
-
-    "bread loaf": "Bread Line", "white bread": "Bread Line",
-    "tin bread": "Bread Line", "brown bread": "Bread Line",
-    "sandwich bread": "Bread Line",
-
-    "atta cookie": "Cookie Line", "butter cookie": "Cookie Line",
-    "choco-filled cookie": "Cookie Line", "checkered cookie": "Cookie Line",
-    "coconut biscuit": "Cookie Line", "danish cookie": "Cookie Line",
-    "drop cookie": "Cookie Line", "date bar cookie": "Cookie Line",
-    "long drop cookie": "Cookie Line", "rotary cookie": "Cookie Line",
-    "shortbread cookie": "Cookie Line", "neapolitan cookie": "Cookie Line",
-    "viennese whirl": "Cookie Line", "wirecut cookie": "Cookie Line",
-    "jeera butter": "Biscuit & Snack Line",
-
-    "banana cake": "Cake Line", "barni cake": "Cake Line",
-    "battenberg cake": "Cake Line", "carrot cake": "Cake Line",
-    "cup cake": "Cake Line", "muffin": "Cake Line",
-    "rainbow muffin": "Cake Line", "plum cake": "Cake Line",
-    "slice cake": "Cake Line", "sponge cake": "Cake Line",
-    "sponge sheet": "Cake Line", "finger cake": "Cake Line",
-    "pound cake": "Cake Line", "bar cake": "Cake Line",
-
-    "cream filled muffin": "Confectionery & Filled Line",
-    "swiss roll": "Confectionery & Filled Line",
-    "swiss roll sheet": "Confectionery & Filled Line",
-    "jam roll": "Confectionery & Filled Line",
-
-    "croissant": "Puff & Croissant Line", "puff pastry": "Puff & Croissant Line",
-    "khari": "Puff & Croissant Line", "danish pastry": "Puff & Croissant Line",
-
-    "fruit rusk": "Rusk & Toast Line", "jeera rusk": "Rusk & Toast Line",
-    "rusk": "Rusk & Toast Line", "toast": "Rusk & Toast Line",
-    "milk rusk": "Rusk & Toast Line",
-
-    "sour dough": "Specialty Bread Line", "sourdough bread": "Specialty Bread Line",
-    "brioche": "Specialty Bread Line", "baguette": "baguette", # Corrected typo "Baguelte"
-    "kulcha": "General Products", # Assigning to General Products as no specific group found
-    "focaccia": "Specialty Bread Line", "ciabatta": "Specialty Bread Line",
-
-    "cream roll": "Confectionery & Filled Line",
-    "eclair": "Confectionery & Filled Line",
-
-    "pizza base": "Pizza Base Line",
-    "macaron": "Macaron Line",
-    "donut": "Donut Line",
-    "doughnut": "Donut Line",
-
-    "biscuit": "Biscuit & Snack Line",
-    "cracker": "Biscuit & Snack Line",
-    "namkeen": "Biscuit & Snack Line",
-    "wafer": "Biscuit & Snack Line",
-    "cookies": "Cookie Line",
-}
-
-for p in product_set:
-    if p not in product_to_group_mapping:
-        product_to_group_mapping[p] = "General Products"
-
-group_wise_production_lines = {
-    "Bun & Pav Line": [
-        "Mixing", "Dividing", "Forming", "Proofing", "Baking", "Cooling", "Slicing", "Packing"
-    ],
-    "Bread Line": [
-        "Mixing", "Dividing", "Forming", "Fermentation", "Baking", "Cooling", "Slicing", "Packing"
-    ],
-    "Cookie Line": [
-        "Mixing", "Forming", "Depositing", "Baking", "Cooling", "Packing"
-    ],
-    "Cake Line": [
-        "Mixing", "Depositing", "Baking", "Cooling", "Finishing", "Packing"
-    ],
-    "Puff & Croissant Line": [
-        "Mixing", "Sheeting", "Forming", "Proofing", "Baking", "Cooling", "Packing"
-    ],
-    "Rusk & Toast Line": [
-        "Mixing", "Dividing", "Forming", "Baking", "Cooling", "Slicing", "Re-Baking", "Packing"
-    ],
-    "Specialty Bread Line": [
-        "Mixing", "Fermentation", "Dividing", "Forming", "Proofing", "Baking", "Cooling", "Packing"
-    ],
-    "Confectionery & Filled Line": [
-        "Mixing", "Depositing", "Forming", "Baking", "Cooling", "Filling", "Finishing", "Packing"
-    ],
-    "Pizza Base Line": [
-        "Mixing", "Dividing", "Forming", "Proofing", "Baking", "Cooling", "Packing"
-    ],
-    "Biscuit & Snack Line": [
-        "Mixing", "Forming", "Baking", "Cooling", "Packing"
-    ],
-    "Macaron Line": [
-        "Mixing", "Depositing", "Baking", "Cooling", "Packing"
-    ],
-    "Donut Line": [
-        "Mixing", "Forming", "Proofing", "Baking", "Finishing", "Slicing"
-    ],
-    "General Products": [
-        "Mixing", "General Processing", "Packing"
-    ]
-}
-
-# --- Parse user prompt ---
-def parse_input(prompt_text):
-    prompt_text = prompt_text.lower()
-
-    capacity_match = re.search(r"(\d{2,6})\s*(pcs|pieces|per hour|/hr|units)?", prompt_text)
-    capacity = int(capacity_match.group(1)) if capacity_match else None
-
-    dough_match = re.search(r"(dough\s*weight\s*(of)?\s*)?(\d{1,4})\s*(g|grams|gram)\b", prompt_text)
-    dough_weight = float(dough_match.group(3)) if dough_match else None
-
-    words = prompt_text.split()
-    candidates = []
-    for i in range(len(words)):
-        for j in range(1, 4):
-            phrase = " ".join(words[i:i + j])
-            if len(phrase.split()) == j:
-                candidates.append(phrase)
-
-    best_match = None
-    best_score = 0
-    candidates.append(prompt_text)
-
-    non_product_terms = ["line", "per hour", "capacity", "dough", "weight", "needed", "make", "produce", "for", "machine"]
-    filtered_candidates = [c for c in candidates if not any(term in c for term in non_product_terms)]
-    if not filtered_candidates:
-        filtered_candidates = candidates
-
-    for phrase in filtered_candidates:
-        normalized_phrase = normalize_product(phrase)
-        match_result = process.extractOne(normalized_phrase, product_set, scorer=fuzz.token_sort_ratio)
-        if match_result and match_result[1] > best_score:
-            best_match = match_result[0]
-            best_score = match_result[1]
-
-    product = best_match if best_score >= 80 else None
-
-    return product, dough_weight, capacity
-
-# --- Helper to display values (preserving original strings for non-numeric data) ---
-def get_display_value(value):
-    """
-    Returns the string representation of a value, handling NaN or empty strings.
-    If truly empty or NaN, returns a dash. Otherwise, returns the exact string.
-    """
-    s_value = str(value).strip()
-    if s_value.lower() in ["nan", "n/a", ""]:
-        return "-"
-    return s_value
-
-# --- Helper to generate DataFrame for display with 1-indexed S. No. ---
-def generate_display_dataframe(df_machines, min_capacity_provided):
-    # Add 'S. No.' column
-    df_machines_copy = df_machines.copy() # Work on a copy to avoid SettingWithCopyWarning
-    df_machines_copy.insert(0, 'S. No.', range(1, 1 + len(df_machines_copy)))
-
-    table_headers = ["S. No.", "Machine Name", "Company", "Capacity (pcs/hr)", "Dough (g)", "Key Features"]
-    if isinstance(min_capacity_provided, (int, float)):
-        # Adjusting insertion points for "Units Req." and "Total Cap." based on your desired order
-        table_headers.insert(4, "Units Req.") # Insert after "Capacity (pcs/hr)"
-        table_headers.insert(5, "Total Cap.") # Insert after "Units Req."
-
-    table_rows = []
-    for _, machine_row in df_machines_copy.iterrows(): # Iterate over the copy with S. No.
-        s_no = str(machine_row.get("S. No.", "N/A"))
-        machine_name = get_display_value(machine_row.get("Machine Name", "N/A"))
-        company = get_display_value(machine_row.get("Company Name", "N/A"))
-
-        # Display original string for Production Capacity
-        prod_capacity = get_display_value(machine_row.get("Production Capacity (pcs/hr)", "N/A"))
-
-        # Display original strings for Dough Min/Max
-        dough_min_str = get_display_value(machine_row.get("Dough Min (g)", "N/A"))
-        dough_max_str = get_display_value(machine_row.get("Dough Max (g)", "N/A"))
-
-        dough_info = "-"
-        if dough_min_str != "-" and dough_max_str != "-":
-            dough_info = f"{dough_min_str}-{dough_max_str}g"
-        elif dough_min_str != "-":
-            dough_info = f"Min {dough_min_str}g"
-        elif dough_max_str != "-":
-            dough_info = f"Max {dough_max_str}g"
-
-        key_features = get_display_value(machine_row.get("Key Features / Notes", "N/A"))
-        # Replace newlines with spaces for better table display
-        key_features = key_features.replace('\n', ' ').strip()
-
-
-        row_data = [
-            s_no,
-            machine_name,
-            company,
-            prod_capacity,
-            dough_info,
-            key_features
-        ]
-
-        if isinstance(min_capacity_provided, (int, float)):
-            units_required = machine_row.get("Calculated Units Required", None)
-            total_capacity_val = machine_row.get("Calculated Total Capacity", None)
-
-            units_req_str = "-"
-            total_cap_str = "-"
-
-            if pd.notna(units_required) and units_required != float('inf'):
-                units_req_str = str(int(units_required))
-            elif units_required == float('inf'):
-                units_req_str = "N/A (Cap. 0)"
-
-            if pd.notna(total_capacity_val):
-                total_cap_str = str(int(total_capacity_val))
-
-            row_data.insert(4, units_req_str) # Insert at position 4 (after Capacity)
-            row_data.insert(5, total_cap_str) # Insert at position 5 (after Units Req)
-
-        table_rows.append(row_data)
-
-    if not table_rows:
-        return pd.DataFrame()
-
-    display_df = pd.DataFrame(table_rows, columns=table_headers)
-    return display_df
+try:
+    loaded = last_loaded_engine()
+    matcher = load_match_engine(SNAPSHOT_FILE, catalog_version, loaded.get("engine"))
+    loaded["engine"] = matcher
+except FileNotFoundError:
+    print(f"ERROR: '{SNAPSHOT_FILE}' not found AFTER sync, or could not be memory-mapped.")
+    st.error(f"❌ Error: '{SNAPSHOT_FILE}' not found AFTER sync. This indicates an issue with the sync script or file permissions.")
+    st.stop()
+except Exception as e:
+    print(f"ERROR: Exception loading '{SNAPSHOT_FILE}' into DataFrame: {e}")
+    st.error(f"❌ Error loading '{SNAPSHOT_FILE}' into DataFrame: {e}")
+    st.stop()
 
+product_set = matcher.product_set
 
 # --- Main matching function ---
-def match_from_inputs(prompt, selected_product, dough_weight_input, capacity_input):
-    product, dough_weight, min_capacity = None, None, None
-
-    # Determine input source
-    if prompt.strip():
-        product, dough_weight, min_capacity = parse_input(prompt)
-    else:
-        product = normalize_product(selected_product) if selected_product else None
-        try:
-            dough_weight = None if dough_weight_input in ("", "-", None) else float(dough_weight_input)
-        except ValueError:
-            st.error("Invalid Dough Weight. Please enter a number or '-'")
-            return
-        try:
-            min_capacity = None if capacity_input in ("", "-", None) else int(capacity_input)
-        except ValueError:
-            st.error("Invalid Capacity. Please enter a whole number or '-'")
-            return
+TABLE_PAGE_ROWS = 50 # Rows per page of a stage's machine table
 
-    if not product:
-        st.error("❌ Couldn't identify a valid product from your input or selection. Please refine your input.")
+def match_from_inputs(prompt, selected_product, dough_weight_input, capacity_input, features_input="", shared_products_input="",
+                      tier2_k=None, profiler=None):
+    started = time.perf_counter()
+    try:
+        product, dough_weight, capacity, features = matcher.resolve_inputs(
+            prompt, selected_product, dough_weight_input, capacity_input, features_input
+        )
+        line_products = matcher.resolve_line_products(prompt, product, capacity, shared_products_input)
+        if len(line_products) > 1:
+            match, match_args = matcher.match_composite, (line_products, dough_weight, features)
+            ignored = matcher.unresolved_products(prompt if prompt and prompt.strip() else shared_products_input or "")
+            if ignored:
+                st.warning(f"⚠️ Not on the shared line (no matching product): {', '.join(repr(segment) for segment in ignored)}")
+        else:
+            match, match_args = matcher.match, (product, dough_weight, capacity, features)
+        if profiler:
+            # Bypass the result cache so the profile shows the real matching work
+            result, st.session_state["last_profile"] = profile_call(match, *match_args, use_cache=False, tier2_k=tier2_k, profiler=profiler)
+            stage_results = ((stage, result.stage_results.get(stage)) for stage in result.stages)
+        elif len(line_products) > 1:
+            # Shared lines are tiered in one pass over all products' rows, then rendered stage by stage
+            result = match(*match_args, tier2_k=tier2_k)
+            stage_results = ((stage, result.stage_results.get(stage)) for stage in result.stages)
+        else:
+            # Each stage is tiered as the previous one is rendered, so the first table shows up early
+            stage_results = matcher.iter_match(*match_args, tier2_k=tier2_k)
+            result = next(stage_results)
+    except MatchInputError as e:
+        st.error(str(e))
         return
+    with span("render_results"):
+        render_match_result(result, stage_results, started)
 
-    product_group = product_to_group_mapping.get(product, "General Products")
-    production_line_stages = group_wise_production_lines.get(product_group, ["General Processing"])
-
-    st.markdown(f"## 📦 **Product:** `{product.title()}`")
-    st.markdown(f"## 🔄 **Production Line:** `{ ' → '.join(production_line_stages) }`")
+def render_match_result(result, stage_results, started):
+    if isinstance(result, CompositeMatchResult):
+        products_text = ", ".join(
+            f"{product.title()} ({capacity} pcs/hr)" if capacity is not None else product.title() for product, capacity in result.products
+        )
+        st.markdown(f"## 📦 **Shared line for:** `{products_text}`")
+    else:
+        st.markdown(f"## 📦 **Product:** `{result.product.title()}`")
+    st.markdown(f"## 🔄 **Production Line:** `{ ' → '.join(result.stages) }`")
+    if result.features:
+        st.markdown(f"🔎 **Features:** `{', '.join(result.features)}` (matching machines ranked first)")
+    if result.from_cache:
+        st.caption("⚡ Served from the result cache for this catalog version.")
+    timing_placeholder = st.empty()
     st.markdown("---")
 
-    eligible_df_product_filtered = df_combined[
-        df_combined["Products"].apply(lambda x: product in [normalize_product(p) for p in str(x).split(",")])
-    ].copy()
-
-    if eligible_df_product_filtered.empty:
-        st.warning(f"❌ No machines found in the database that are specified for **{product.title()}**.")
+    if not result.candidate_count:
+        st.warning(f"❌ No machines found in the database that are specified for **{result.product.title()}**.")
         return
 
-    for stage in production_line_stages:
-        st.markdown(f"### **Stage: {stage}**")
-
-        stage_eligible_machines = eligible_df_product_filtered[
-            eligible_df_product_filtered["Category"].apply(
-                lambda x: get_stage_from_category(str(x)) == stage
-            )
-        ].copy()
-
-        if stage_eligible_machines.empty:
-            st.info("    _No specific machines found for this stage matching the product._")
-            continue
-
-        # Use the numeric columns for calculations
-        dough_match_mask = pd.Series(True, index=stage_eligible_machines.index)
-        capacity_match_mask = pd.Series(True, index=stage_eligible_machines.index)
-
-        if isinstance(dough_weight, (int, float)):
-            dough_match_mask = (stage_eligible_machines["_Numeric_Dough Min (g)"].isna() | (stage_eligible_machines["_Numeric_Dough Min (g)"] <= dough_weight)) & \
-                               (stage_eligible_machines["_Numeric_Dough Max (g)"].isna() | (stage_eligible_machines["_Numeric_Dough Max (g)"] >= dough_weight))
-
-        if isinstance(min_capacity, (int, float)):
-            stage_eligible_machines["Calculated Units Required"] = stage_eligible_machines["_Numeric_Production Capacity (pcs/hr)"].apply(
-                lambda x: math.ceil(min_capacity / x) if pd.notna(x) and x > 0 else (None if pd.isna(x) or x == 0 else float('inf'))
-            )
-            stage_eligible_machines["Calculated Total Capacity"] = stage_eligible_machines.apply(
-                lambda row: row["Calculated Units Required"] * row["_Numeric_Production Capacity (pcs/hr)"]
-                if pd.notna(row["Calculated Units Required"]) and pd.notna(row["_Numeric_Production Capacity (pcs/hr)"])
-                and row["Calculated Units Required"] != float('inf') # Exclude inf units from total capacity calculation
-                else None, axis=1
-            )
-            capacity_match_mask = (stage_eligible_machines["_Numeric_Production Capacity (pcs/hr)"].notna()) & \
-                                  (stage_eligible_machines["_Numeric_Production Capacity (pcs/hr)"] > 0) & \
-                                  (stage_eligible_machines["Calculated Total Capacity"].fillna(0) >= min_capacity) # Fillna 0 for comparison
-
-        else:
-            stage_eligible_machines["Calculated Units Required"] = None
-            stage_eligible_machines["Calculated Total Capacity"] = None
-
-
-        tier1_machines = stage_eligible_machines[dough_match_mask & capacity_match_mask].sort_values(by="Company Name").copy()
-        tier2_machines = stage_eligible_machines[~(dough_match_mask & capacity_match_mask)].sort_values(by="Company Name").copy()
-
-        if not tier1_machines.empty:
-            st.markdown("#### ✅ Machines meeting all criteria:")
-            st.dataframe(generate_display_dataframe(tier1_machines, min_capacity), hide_index=True) # hide_index hides pandas default 0-index
-        elif tier2_machines.empty:
-            st.info("    _No machines perfectly meet all specified criteria for this stage, and no other relevant machines were found._")
-
-
-        if not tier2_machines.empty:
-            st.markdown("#### ℹ️ Other relevant machines (may not meet all numeric criteria or have missing data):")
-            st.dataframe(generate_display_dataframe(tier2_machines, min_capacity), hide_index=True) # hide_index hides pandas default 0-index
-        elif tier1_machines.empty:
-            st.info("    _No other relevant machines found for this stage._")
-
+    # One slot per stage in line order, filled as soon as that stage's machines are ready
+    stage_placeholders = {stage: st.empty() for stage in result.stages}
+    for stage, placeholder in stage_placeholders.items():
+        placeholder.caption(f"⏳ Matching machines for {stage}…")
+    first_result_seconds = None
+    for stage, stage_result in stage_results:
+        with span("render_stage", stage=stage):
+            with stage_placeholders[stage].container():
+                render_stage(result, stage, stage_result)
+        if first_result_seconds is None:
+            first_result_seconds = time.perf_counter() - started
+            metrics.observe("time_to_first_result", first_result_seconds)
+    total_seconds = time.perf_counter() - started
+    metrics.observe("time_to_all_results", total_seconds)
+    timing_placeholder.caption(
+        f"⏱️ First stage in {(first_result_seconds or total_seconds) * 1000:.0f} ms · "
+        f"all {len(result.stages)} stages in {total_seconds * 1000:.0f} ms"
+    )
+
+def render_machine_table(df_machines, capacity, key):
+    # Long tables are sent one page at a time; S. No. keeps counting across pages
+    if len(df_machines) <= TABLE_PAGE_ROWS:
+        st.dataframe(generate_display_dataframe(df_machines, capacity), hide_index=True) # hide_index hides pandas default 0-index
+        return
+    n_pages = -(-len(df_machines) // TABLE_PAGE_ROWS)
+    page = st.number_input(
+        f"Page (of {n_pages}, {len(df_machines)} machines)", min_value=1, max_value=n_pages, value=1,
+        key=f"page_{st.session_state.get('search_id', 0)}_{key}",
+    )
+    start = (int(page) - 1) * TABLE_PAGE_ROWS
+    st.dataframe(
+        generate_display_dataframe(df_machines.iloc[start:start + TABLE_PAGE_ROWS], capacity, first_row=start + 1), hide_index=True
+    )
+
+def render_stage(result, stage, stage_result):
+    st.markdown(f"### **Stage: {stage}**")
+
+    if stage_result is None:
+        st.info("    _No specific machines found for this stage matching the product._")
+        return
 
-        st.markdown("\n")
+    tier1_machines = stage_result.tier1
+    tier2_machines = stage_result.tier2
+    capacity = result.capacity
+    if isinstance(result, CompositeMatchResult):
+        # Units and totals are against the combined capacity of the products needing this stage
+        capacity = stage_result.combined_capacity
+        details = [f"For: {', '.join(product.title() for product in stage_result.products)}"]
+        if capacity is not None:
+            details.append(f"combined capacity {capacity:,.0f} pcs/hr")
+        if stage_result.units_required is not None:
+            details.append(f"fewest units needed {stage_result.units_required:.0f}")
+        if len(stage_result.products) > 1:
+            details.append(f"{stage_result.shared_count} machine(s) listed for all of them, shown first" if stage_result.shared_count else "no machine listed for all of them")
+        st.caption(" · ".join(details))
+    if result.features and not stage_result.feature_matched:
+        st.caption("No machine in this stage mentions the requested features; showing all of them.")
+
+    if not tier1_machines.empty:
+        st.markdown("#### ✅ Machines meeting all criteria:")
+        render_machine_table(tier1_machines, capacity, f"{stage}_tier1")
+    elif tier2_machines.empty:
+        st.info("    _No machines perfectly meet all specified criteria for this stage, and no other relevant machines were found._")
+
+
+    if not tier2_machines.empty:
+        st.markdown("#### ℹ️ Other relevant machines (may not meet all numeric criteria or have missing data):")
+        if result.tier2_k is not None:
+            st.caption(f"Up to {result.tier2_k} machines closest to the requested dough weight and capacity, nearest first (Distance 0 = on spec).")
+        render_machine_table(tier2_machines, capacity, f"{stage}_tier2")
+    elif tier1_machines.empty:
+        st.info("    _No other relevant machines found for this stage._")
+
+
+    st.markdown("\n")
 
 # --- Streamlit UI Elements ---
 # Using markdown to create the custom title with specific colors and line break
@@ -758,6 +433,11 @@ results_placeholder = st.empty()
 # Move the form to the sidebar
 with st.sidebar: # This places the content in the sidebar
     st.header("Search Criteria")
+    # Outside the form so the product list reorders as soon as a search is entered
+    product_query = st.text_input("🔤 Find a product (typos are fine)", placeholder="e.g., crosant, swis rol")
+    suggested_products = [suggestion["product"] for suggestion in matcher.suggest_products(product_query)] if product_query.strip() else []
+    if product_query.strip() and not suggested_products:
+        st.caption("No similar products found.")
     with st.form("machine_matcher_form_sidebar"): # Give it a unique key for the sidebar
         prompt_input = st.text_area(
             "🧠 Describe your requirement (optional)",
@@ -766,8 +446,9 @@ with st.sidebar: # This places the content in the sidebar
         )
         selected_product = st.selectbox(
             "📦 Select Product (optional, overrides prompt if present)",
-            options=[""] + product_set,
-            index=0
+            # Suggestions first (best one preselected), then the remaining products
+            options=[""] + suggested_products + [p for p in product_set if p not in suggested_products],
+            index=1 if suggested_products else 0
         )
 
         dough_weight_input = st.text_input(
@@ -780,15 +461,136 @@ with st.sidebar: # This places the content in the sidebar
             placeholder="e.g., 10000 or -",
             value="-"
         )
+        shared_products_input = st.text_input(
+            "🧩 Also on this line (optional, product and capacity)",
+            placeholder="e.g., bread loaf 2000, rusk 1500",
+            value=""
+        )
+        features_input = st.text_input(
+            "🔎 Required Features (optional)",
+            placeholder="e.g., stainless steel, PLC control",
+            value=""
+        )
+
+        tier2_choice = st.radio(
+            "ℹ️ Other relevant machines per stage",
+            [f"Nearest {TIER2_NEAREST_K} to the specs", "All, by company"],
+            horizontal=True
+        )
 
         submitted = st.form_submit_button("Find Machines")
 
+    # Collapsed by default; timings cover this server process (all sessions)
+    with st.expander("⏱️ Performance (debug)"):
+        profiler_options = ["Off", "cProfile"] + (["pyinstrument"] if PyinstrumentProfiler is not None else [])
+        profile_choice = st.radio("Profile the next search", profiler_options, horizontal=True)
+        performance_placeholder = st.empty()
+
 # Display results in the main area
 if submitted:
+    # Kept for later reruns (table pages, other forms), which re-render it from the result cache
+    st.session_state["last_search"] = (
+        prompt_input, selected_product, dough_weight_input, capacity_input, features_input, shared_products_input,
+        TIER2_NEAREST_K if tier2_choice.startswith("Nearest") else None,
+    )
+    st.session_state["search_id"] = st.session_state.get("search_id", 0) + 1 # New search -> every table back on page 1
+if st.session_state.get("last_search"):
     results_placeholder.empty()
     with results_placeholder.container(): # Use the placeholder to display dynamic content
-        with st.spinner("Searching for machines..."):
-            match_from_inputs(prompt_input, selected_product, dough_weight_input, capacity_input)
+        *search_inputs, search_tier2_k = st.session_state["last_search"]
+        match_from_inputs(
+            *search_inputs, tier2_k=search_tier2_k,
+            profiler=None if not submitted or profile_choice == "Off" else profile_choice.lower(),
+        )
+
+# Filled after the search so the table includes its spans
+with performance_placeholder.container():
+    span_rows = [
+        {"Span": name + "".join(f" [{value}]" for value in labels.values()), **summary}
+        for name, labels, summary in metrics.snapshot()
+    ]
+    if span_rows:
+        st.dataframe(span_rows, hide_index=True)
+        st.download_button("Prometheus metrics", metrics.to_prometheus(), file_name="autobake_metrics.prom")
+        st.download_button("JSON metrics", metrics.to_json(indent=2), file_name="autobake_metrics.json")
+    else:
+        st.caption("No spans recorded yet.")
+    if st.session_state.get("last_profile"):
+        st.markdown("**Last profiled search**")
+        st.code(st.session_state["last_profile"], language="text")
+    # Shared by every session of this process, so its size is what scales with the catalog
+    if st.checkbox("Show catalog memory per column"):
+        memory_report = catalog_memory_report(matcher.catalog)
+        total = memory_report.loc["Total"]
+        private_bytes = memory_report.loc[~memory_report["mapped"].astype(bool), "bytes_after"].drop("Total", errors="ignore").sum()
+        st.caption(
+            f"Catalog: {total['bytes_after'] / 1e6:.2f} MB ({total['bytes_before'] / 1e6:.2f} MB before dictionary encoding), "
+            f"of which {private_bytes / 1e6:.2f} MB is private to this process; the rest is mapped from the shared snapshot."
+        )
+        st.dataframe(memory_report)
+
+# Capacity what-if sweep for scale-up planning
+with st.expander("📊 Capacity what-if sweep (scale-up planning)"):
+    with st.form("capacity_sweep_form"):
+        sweep_product = st.selectbox("📦 Product", options=product_set, key="sweep_product")
+        sweep_dough_input = st.text_input("⚖️ Dough Weight (grams, optional — use '-' to skip)", value="-", key="sweep_dough")
+        sweep_from_col, sweep_to_col, sweep_points_col = st.columns(3)
+        sweep_from = sweep_from_col.number_input("From (pcs/hr)", min_value=1, value=2000, step=500)
+        sweep_to = sweep_to_col.number_input("To (pcs/hr)", min_value=1, value=50000, step=500)
+        sweep_points = sweep_points_col.number_input("Points", min_value=2, max_value=1000, value=25)
+        sweep_submitted = st.form_submit_button("Run Sweep")
+
+    if sweep_submitted:
+        try:
+            sweep_dough = None if sweep_dough_input in ("", "-", None) else float(sweep_dough_input)
+            sweep_df = matcher.sweep_capacity(
+                sweep_product, np.linspace(min(sweep_from, sweep_to), max(sweep_from, sweep_to), int(sweep_points)).round(), sweep_dough
+            )
+        except ValueError as e:
+            st.error(f"Invalid sweep input: {e}")
+        else:
+            st.markdown("#### Fewest units per stage (machines meeting all criteria)")
+            st.line_chart(summarize_capacity_sweep(sweep_df))
+            st.dataframe(sweep_df, hide_index=True)
+            st.download_button("Download sweep (CSV)", sweep_df.to_csv(index=False), file_name=f"capacity_sweep_{sweep_product}.csv")
+
+# Balanced line configurator: one machine per stage, fewest units first
+with st.expander("🧮 Balanced line configurator"):
+    with st.form("line_configurator_form"):
+        configure_product = st.selectbox("📦 Product", options=product_set, key="configure_product")
+        configure_capacity_col, configure_dough_col, configure_k_col = st.columns(3)
+        configure_capacity = configure_capacity_col.number_input("Target (pcs/hr)", min_value=1, value=5000, step=500)
+        configure_dough_input = configure_dough_col.text_input("⚖️ Dough Weight (g, '-' to skip)", value="-", key="configure_dough")
+        configure_k = configure_k_col.number_input("Configurations", min_value=1, max_value=50, value=5)
+        configure_submitted = st.form_submit_button("Configure Line")
+
+    if configure_submitted:
+        try:
+            configure_dough = None if configure_dough_input in ("", "-", None) else float(configure_dough_input)
+            configuration_result = matcher.configure_line(configure_product, int(configure_capacity), configure_dough, k=int(configure_k))
+        except ValueError as e:
+            st.error(f"Invalid configurator input: {e}")
+        else:
+            if configuration_result.uncovered_stages:
+                st.caption(f"No machine meets all criteria for: {', '.join(configuration_result.uncovered_stages)} (left out of the configurations).")
+            if not configuration_result.configurations:
+                st.info("    _No stage has machines meeting all criteria for this target._")
+            for rank, configuration in enumerate(configuration_result.configurations, start=1):
+                st.markdown(
+                    f"#### #{rank}: {configuration.total_units} units · overshoot {configuration.overshoot:,.0f} pcs/hr · "
+                    f"bottleneck {configuration.bottleneck_stage} ({configuration.bottleneck_capacity:,.0f} pcs/hr)"
+                )
+                st.dataframe(
+                    [
+                        {
+                            "Stage": machine["stage"], "Machine Name": machine["machine_name"], "Company": machine["company"],
+                            "Capacity (pcs/hr)": machine["capacity_pcs_hr"], "Units Req.": machine["units_required"],
+                            "Total Cap.": machine["total_capacity"],
+                        }
+                        for machine in configuration.machines
+                    ],
+                    hide_index=True,
+                )
 
 # --- Copyright Footer ---
 st.markdown(
@@ -0,0 +1,145 @@
+"""
+Batch matching CLI for bulk RFQ files.
+
+Reads a CSV of customer requirements and streams one match result per requirement as JSONL
+(default) or CSV. Each input row needs either a `prompt` column (natural language) or
+`product` plus optional `dough_weight` / `capacity` columns; a non-empty prompt wins, as in the app.
+An optional `features` column (e.g. "stainless steel, PLC") narrows and ranks each stage's machines.
+An optional `shared_products` column (e.g. "bread loaf 2000, rusk 1500") matches one shared line for
+the product and those products, as does a prompt naming several products.
+
+    python autobake_batch.py requirements.csv -o results.jsonl --workers 4
+    python autobake_batch.py requirements.csv --format csv > results.csv
+
+Workers memory-map the same catalog snapshot, so the pool shares one copy of the catalog.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from itertools import islice
+
+from autobake_engine import (
+    CSV_FILE, MACHINE_RECORD_COLUMNS, SNAPSHOT_FILE, MatchEngine, MatchInputError, catalog_source,
+    sync_catalog_if_changed,
+)
+
+INPUT_COLUMNS = ["prompt", "product", "dough_weight", "capacity", "features", "shared_products"]
+CSV_OUTPUT_COLUMNS = ["row", "product", "product_group", "stage", "tier"] + list(MACHINE_RECORD_COLUMNS) + ["error"]
+
+_worker_engine = None
+
+def _init_worker(snapshot_path, catalog_version):
+    global _worker_engine
+    _worker_engine = MatchEngine.from_snapshot(snapshot_path, catalog_version)
+
+def match_requirement(engine, row_number, requirement):
+    record = {"row": row_number, "input": requirement}
+    try:
+        result = engine.match_from_inputs(
+            requirement.get("prompt") or "",
+            requirement.get("product") or "",
+            (requirement.get("dough_weight") or "-").strip(),
+            (requirement.get("capacity") or "-").strip(),
+            requirement.get("features") or "",
+            requirement.get("shared_products") or "",
+        )
+    except MatchInputError as e:
+        record["error"] = str(e)
+        return record
+    record.update(result.to_dict())
+    return record
+
+def _match_chunk(chunk):
+    return [match_requirement(_worker_engine, row_number, requirement) for row_number, requirement in chunk]
+
+def read_requirements(input_file):
+    reader = csv.DictReader(input_file)
+    columns = {(name or "").strip().lower(): name for name in reader.fieldnames or []}
+    if "prompt" not in columns and "product" not in columns:
+        raise ValueError("Input CSV needs a 'prompt' or a 'product' column.")
+    for row_number, row in enumerate(reader, start=1):
+        yield row_number, {col: row.get(columns[col]) for col in INPUT_COLUMNS if col in columns}
+
+def iter_chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
+
+def match_requirements(requirements, snapshot_path, catalog_version, workers, chunk_size):
+    """
+    Yields result records in input order. Chunks are submitted to the pool with a bounded
+    number in flight, so arbitrarily large input files stream through in constant memory.
+    """
+    if workers <= 1:
+        _init_worker(snapshot_path, catalog_version)
+        for chunk in iter_chunks(requirements, chunk_size):
+            yield from _match_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(snapshot_path, catalog_version)) as pool:
+        in_flight = []
+        for chunk in iter_chunks(requirements, chunk_size):
+            in_flight.append(pool.submit(_match_chunk, chunk))
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.pop(0).result()
+        for future in in_flight:
+            yield from future.result()
+
+def write_jsonl(records, output_file):
+    for record in records:
+        output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def write_csv(records, output_file):
+    # One row per (requirement, stage, tier, machine); requirements without machines still get a row
+    writer = csv.DictWriter(output_file, fieldnames=CSV_OUTPUT_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    for record in records:
+        base = {"row": record["row"], "product": record.get("product"), "product_group": record.get("product_group"), "error": record.get("error")}
+        wrote_machine = False
+        for stage_result in record.get("stages", []):
+            for tier in ("tier1", "tier2"):
+                for machine in stage_result[tier]:
+                    writer.writerow({**base, "stage": stage_result["stage"], "tier": tier[-1], **machine})
+                    wrote_machine = True
+        if not wrote_machine:
+            writer.writerow(base)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Match a CSV of bakery requirements against the Autobake machine catalog.")
+    parser.add_argument("input", help="CSV with a 'prompt' column or 'product' (+ 'dough_weight', 'capacity') columns; '-' for stdin")
+    parser.add_argument("-o", "--output", default="-", help="Output file (default: stdout)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default=None, help="Output format (default: from the output extension, else jsonl)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Requirements per worker task")
+    parser.add_argument("--excel", default=catalog_source(), help="Source workbook or catalog directory of workbooks")
+    parser.add_argument("--csv", default=CSV_FILE, help="Synced CSV path")
+    parser.add_argument("--snapshot", default=SNAPSHOT_FILE, help="Catalog snapshot path")
+    args = parser.parse_args(argv)
+
+    output_format = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+
+    # Sync once in the parent; workers only map the resulting snapshot. Sync progress goes to stderr.
+    with redirect_stdout(sys.stderr):
+        catalog_version = sync_catalog_if_changed(args.excel, args.csv, args.snapshot)
+
+    input_file = sys.stdin if args.input == "-" else open(args.input, newline="", encoding="utf-8-sig")
+    output_file = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    try:
+        records = match_requirements(
+            read_requirements(input_file), args.snapshot, catalog_version, args.workers, max(args.chunk_size, 1)
+        )
+        (write_csv if output_format == "csv" else write_jsonl)(records, output_file)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2460 @@
+"""
+UI-free Autobake matching engine: catalog sync, loading, indexes, prompt parsing and
+per-stage machine matching. The Streamlit app, the batch CLI and any other tool share it.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import re
+from rapidfuzz import process, fuzz
+import os
+import json
+import hashlib
+import threading
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from openpyxl import load_workbook
+from pandas.io.parsers import TextParser
+
+from autobake_metrics import span, timed
+
+try:
+    import fcntl  # POSIX advisory file locks
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+EXCEL_FILE = "Autobake_Machines_Data.xlsx"
+CSV_FILE = "Raw_Data.csv"
+
+class MatchInputError(ValueError):
+    """Raised when a requirement cannot be matched (invalid numbers or no recognizable product)."""
+
+# --- Streaming Workbook Ingestion ---
+# The sheet is read in openpyxl read-only mode and cleaned/written SYNC_CHUNK_ROWS rows at a time,
+# so peak memory during a sync depends on the chunk size, not on the size of the vendor workbook.
+SHEET_NAME = "Raw Data"
+SYNC_CHUNK_ROWS = 10000
+SYNC_FORMAT_VERSION = 2 # Bump when the Excel -> CSV cleaning changes to force a reconversion
+
+def _excel_cell_value(value):
+    # Same conversion pd.read_excel applies: blank -> "", whole-number floats -> int
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _clean_sheet_chunk(header, rows):
+    # TextParser is what pd.read_excel uses, so NA markers ("N/A", "#N/A", ...) and duplicate
+    # headers are treated exactly as before; every cell ends up as stripped text ("" = missing)
+    df_chunk = TextParser([header] + rows, header=0, dtype=str).read()
+    for col in df_chunk.columns:
+        df_chunk[col] = df_chunk[col].fillna("").astype(str).str.strip()
+    return df_chunk
+
+def iter_sheet_chunks(excel_file_path, sheet_name=SHEET_NAME, chunk_rows=SYNC_CHUNK_ROWS):
+    """
+    Yields the sheet as DataFrames of cleaned text, chunk_rows rows at a time (at least one,
+    possibly empty, chunk). Cells beyond the header's last column are ignored, and trailing
+    blank rows are dropped as pd.read_excel does.
+    """
+    workbook = load_workbook(excel_file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = [_excel_cell_value(value) for value in next(rows, ())]
+        while header and header[-1] == "":
+            header.pop()
+        width = len(header)
+
+        chunk, blank_rows, yielded = [], 0, False
+        for row in rows:
+            values = [_excel_cell_value(value) for value in row[:width]]
+            if all(value == "" for value in values):
+                blank_rows += 1 # Kept only if a non-blank row follows
+                continue
+            chunk.extend([[""] * width for _ in range(blank_rows)])
+            blank_rows = 0
+            chunk.append(values + [""] * (width - len(values)))
+            if len(chunk) >= chunk_rows:
+                yield _clean_sheet_chunk(header, chunk)
+                chunk, yielded = [], True
+        if chunk or not yielded:
+            yield _clean_sheet_chunk(header, chunk)
+    finally:
+        workbook.close()
+
+# --- Excel to CSV Sync Function ---
+@timed("excel_to_csv_sync")
+def excel_to_csv_sync(excel_file_path, csv_file_path):
+    # These messages go to the terminal/console; callers decide how to surface failures.
+    print(f"🔄 Running Excel to CSV sync from '{excel_file_path}' to '{csv_file_path}'...")
+    if not os.path.exists(excel_file_path):
+        print(f"ERROR: Source Excel file '{excel_file_path}' not found for sync.")
+        raise FileNotFoundError(f"Source Excel file '{excel_file_path}' not found.")
+
+    try:
+        # Stream the sheet into a temp file and swap it in so other processes never read a half-written CSV
+        tmp_csv_path = f"{csv_file_path}.tmp"
+        n_rows = 0
+        with open(tmp_csv_path, "w", encoding="utf-8", newline="") as csv_file:
+            for chunk_number, df_chunk in enumerate(iter_sheet_chunks(excel_file_path)):
+                df_chunk.to_csv(csv_file, index=False, header=chunk_number == 0)
+                n_rows += len(df_chunk)
+        os.replace(tmp_csv_path, csv_file_path)
+    except Exception as e:
+        print(f"❌ ERROR during Excel to CSV sync: {e}")
+        raise
+    print(f"✅ Sync completed: '{excel_file_path}' synced to '{csv_file_path}' ({n_rows} rows).")
+    return True
+
+# --- Columnar Catalog Snapshot ---
+# The sync step also writes the preprocessed, deduplicated catalog as an Arrow IPC file.
+# Every process memory-maps that one file read-only, so replicas share the same pages
+# instead of each re-parsing the CSV and holding private copies.
+SNAPSHOT_FILE = "Raw_Data.arrow"
+SNAPSHOT_FORMAT_VERSION = 4 # Bump when the snapshot columns/preprocessing change to force a rebuild
+
+# float32 holds every integer up to 16.7M exactly, which covers capacities and dough weights
+NUMERIC_DTYPE = "float32"
+NUMERIC_SOURCE_COLUMNS = {
+    "_Numeric_Dough Min (g)": "Dough Min (g)",
+    "_Numeric_Dough Max (g)": "Dough Max (g)",
+    "_Numeric_Production Capacity (pcs/hr)": "Production Capacity (pcs/hr)",
+}
+
+def prepare_catalog_chunk(df_raw):
+    # Create numeric columns for calculations, keeping original string columns for display
+    for numeric_col, source_col in NUMERIC_SOURCE_COLUMNS.items():
+        df_raw[numeric_col] = pd.to_numeric(df_raw[source_col], errors="coerce").astype(NUMERIC_DTYPE)
+
+    # --- Preprocess Raw Data ---
+    if "Products" not in df_raw.columns:
+        print("⚠️ WARNING: 'Products' column not found in the synced catalog. Please ensure your Excel data has a column named 'Products' (case-sensitive) for proper matching.")
+        df_raw["Products"] = ""
+    df_raw.dropna(subset=["Products"], inplace=True)
+    df_raw["Products"] = df_raw["Products"].astype(str).str.lower()
+    # Display strings are stored in the snapshot too, so no process has to build its own copy
+    return add_display_columns(df_raw)
+
+def first_occurrences(df_chunk, seen_hashes):
+    """
+    Vectorized chunk-wise drop_duplicates: returns (mask of rows not seen before, updated sorted
+    array of 64-bit row hashes). Carry the array from chunk to chunk.
+    """
+    row_hashes = pd.util.hash_pandas_object(df_chunk, index=False).to_numpy()
+    seen_before = np.zeros(len(row_hashes), dtype=bool)
+    if len(seen_hashes):
+        positions = np.searchsorted(seen_hashes, row_hashes).clip(max=len(seen_hashes) - 1)
+        seen_before = seen_hashes[positions] == row_hashes
+    keep = ~seen_before & ~pd.Index(row_hashes).duplicated()
+    return keep, np.union1d(seen_hashes, row_hashes[keep])
+
+# Company, Category, provenance and most display strings repeat across machines. Such columns are
+# dictionary-encoded with one sorted dictionary per column for the whole file, so each row costs an
+# int32 code, every distinct string is stored once, and all processes map the same codes and strings.
+CATEGORY_MAX_UNIQUE_RATIO = 0.5 # Text columns with more distinct values per machine than this stay plain strings
+
+def snapshot_text_columns(df_chunk):
+    return [col for col in df_chunk.columns if col not in NUMERIC_SOURCE_COLUMNS and col != "Products"]
+
+def snapshot_text(column):
+    # Missing text is stored as "" (shown as "-" by get_display_values), so readers never see nulls
+    return column.fillna("").astype(str)
+
+def catalog_column_arrays(df_catalog, dictionaries=None):
+    columns = {}
+    for col in df_catalog.columns:
+        if col in NUMERIC_SOURCE_COLUMNS:
+            # Keep NaN as a float value (no validity bitmap) so readers get a zero-copy float32 view
+            columns[col] = pa.array(df_catalog[col].to_numpy(dtype=NUMERIC_DTYPE), type=pa.float32(), from_pandas=False)
+        else:
+            columns[col] = pa.array(snapshot_text(df_catalog[col]).tolist(), type=pa.string())
+            if dictionaries and col in dictionaries:
+                columns[col] = pa.DictionaryArray.from_arrays(pc.index_in(columns[col], value_set=dictionaries[col]), dictionaries[col])
+    return columns
+
+# --- Normalized Machine / Product-link Schema ---
+# The workbook lists a machine once per product. The snapshot stores one row per physical machine
+# (every column except Products and provenance identifies it) plus, per machine, the integer codes
+# of the normalized products it is linked to (PRODUCT_CODES_COLUMN; names in the schema metadata).
+PRODUCT_CODES_COLUMN = "_Product Codes"
+
+def csr_gather(starts, lengths):
+    # Positions of the slices [start, start + length) laid end to end: one CSR gather, no Python loop
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+
+def machine_key_hashes(df_chunk):
+    key_columns = [col for col in df_chunk.columns if col != "Products" and col not in PROVENANCE_COLUMNS]
+    return pd.util.hash_pandas_object(df_chunk[key_columns], index=False).to_numpy()
+
+class MachineIdRegistry:
+    """Dense machine ids in first-seen order, keyed by 64-bit machine key hashes (sorted arrays, no dict)."""
+    def __init__(self):
+        self.sorted_hashes = np.empty(0, dtype="uint64")
+        self.sorted_ids = np.empty(0, dtype=np.int64)
+        self.count = 0
+
+    def assign(self, key_hashes):
+        machine_ids = np.full(len(key_hashes), -1, dtype=np.int64)
+        if self.count:
+            positions = np.searchsorted(self.sorted_hashes, key_hashes).clip(max=self.count - 1)
+            known = self.sorted_hashes[positions] == key_hashes
+            machine_ids[known] = self.sorted_ids[positions[known]]
+        new = machine_ids < 0
+        if new.any():
+            new_codes, new_hashes = pd.factorize(key_hashes[new]) # First-appearance order
+            machine_ids[new] = self.count + new_codes
+            all_hashes = np.concatenate([self.sorted_hashes, new_hashes])
+            all_ids = np.concatenate([self.sorted_ids, self.count + np.arange(len(new_hashes))])
+            order = np.argsort(all_hashes, kind="stable")
+            self.sorted_hashes, self.sorted_ids = all_hashes[order], all_ids[order]
+            self.count += len(new_hashes)
+        return machine_ids
+
+def read_catalog_chunks(csv_file_path):
+    for df_chunk in pd.read_csv(csv_file_path, encoding="utf-8", dtype=str, chunksize=SYNC_CHUNK_ROWS):
+        yield prepare_catalog_chunk(df_chunk).reset_index(drop=True)
+
+def build_product_links(csv_file_path):
+    """
+    First snapshot pass: assigns machine ids, collects the (machine, product) links and the distinct
+    values of every text column. Returns (registry, sorted vocabulary, indptr, codes, text values)
+    with machine m's product codes at codes[indptr[m]:indptr[m + 1]] (sorted, unique).
+    """
+    registry = MachineIdRegistry()
+    vocabulary_ids = {} # Normalized product -> provisional code
+    link_machines, link_codes = [], []
+    text_values = {}
+    for df_chunk in read_catalog_chunks(csv_file_path):
+        for col in snapshot_text_columns(df_chunk):
+            text_values.setdefault(col, set()).update(snapshot_text(df_chunk[col]).unique())
+        machine_ids = registry.assign(machine_key_hashes(df_chunk))
+        exploded = df_chunk["Products"].astype(str).str.split(",").explode()
+        raw_codes, raw_tokens = pd.factorize(exploded.to_numpy(dtype=object))
+        # Normalize each distinct token once per chunk
+        token_ids = np.array([vocabulary_ids.setdefault(normalize_product(token), len(vocabulary_ids)) for token in raw_tokens], dtype=np.int64)
+        link_machines.append(machine_ids[exploded.index.to_numpy(dtype=np.int64)])
+        link_codes.append(token_ids[raw_codes] if len(raw_codes) else np.empty(0, dtype=np.int64))
+
+    vocabulary = sorted(vocabulary_ids)
+    rank = np.empty(len(vocabulary_ids), dtype=np.int64)
+    rank[[vocabulary_ids[product] for product in vocabulary]] = np.arange(len(vocabulary))
+    n_codes = max(len(vocabulary), 1)
+    links = np.unique(
+        np.concatenate(link_machines + [np.empty(0, dtype=np.int64)]) * n_codes +
+        rank[np.concatenate(link_codes + [np.empty(0, dtype=np.int64)])]
+    )
+    indptr = np.zeros(registry.count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(links // n_codes, minlength=registry.count), out=indptr[1:])
+    return registry, vocabulary, indptr, links % n_codes, text_values
+
+def write_catalog_snapshot(csv_file_path, snapshot_path, catalog_version):
+    """
+    Writes the normalized machine table in two streaming passes over the CSV: build_product_links,
+    then each chunk's first-seen machines are appended column by column (so row m is machine id m)
+    and the table is written as one record batch, which readers map without concatenating chunks.
+    Memory grows with the machine table (an int32 code per dictionary-encoded cell, every distinct
+    string once) and the links, not with rows.
+    """
+    registry, vocabulary, indptr, link_codes, text_values = build_product_links(csv_file_path)
+    dictionaries = {
+        col: pa.array(sorted(values), type=pa.string())
+        for col, values in text_values.items() if len(values) <= CATEGORY_MAX_UNIQUE_RATIO * max(registry.count, 1)
+    }
+    metadata = {
+        "catalog_version": catalog_version,
+        "snapshot_format": str(SNAPSHOT_FORMAT_VERSION),
+        "product_vocabulary": json.dumps(vocabulary),
+    }
+    written = np.zeros(registry.count, dtype=bool)
+    column_parts = {}
+    for df_chunk in read_catalog_chunks(csv_file_path):
+        machine_ids = registry.assign(machine_key_hashes(df_chunk))
+        first_seen = ~written[machine_ids] & ~pd.Index(machine_ids).duplicated()
+        written[machine_ids[first_seen]] = True
+        for col, array in catalog_column_arrays(df_chunk[first_seen].drop(columns="Products"), dictionaries).items():
+            column_parts.setdefault(col, []).append(array)
+    if not column_parts:
+        # Header-only CSV: still write an (empty) snapshot with the catalog's columns
+        df_empty = prepare_catalog_chunk(pd.read_csv(csv_file_path, encoding="utf-8", dtype=str)).drop(columns="Products")
+        column_parts = {col: [array] for col, array in catalog_column_arrays(df_empty).items()}
+
+    # Parts of one column share its dictionary, so concatenating only appends the codes
+    columns = {col: pa.concat_arrays(parts) for col, parts in column_parts.items()}
+    columns[PRODUCT_CODES_COLUMN] = pa.ListArray.from_arrays(pa.array(indptr, type=pa.int32()), pa.array(link_codes, type=pa.int32()))
+    batch = pa.RecordBatch.from_pydict(columns)
+    tmp_snapshot_path = f"{snapshot_path}.tmp"
+    with pa.OSFile(tmp_snapshot_path, "wb") as sink:
+        with pa.ipc.new_file(sink, batch.schema.with_metadata(metadata)) as writer:
+            writer.write_batch(batch)
+    os.replace(tmp_snapshot_path, snapshot_path) # Readers holding the old mapping keep the old inode
+    print(f"✅ Snapshot written: {registry.count} machines, {len(link_codes)} product links to '{snapshot_path}'.")
+
+def open_catalog_snapshot(snapshot_path):
+    """Returns (machine table, ProductIndex over its rows)."""
+    # memory_map + IPC file format = no parsing, no copies; pages are shared via the OS page cache
+    table = pa.ipc.open_file(pa.memory_map(snapshot_path, "r")).read_all()
+    metadata = table.schema.metadata or {}
+
+    product_codes = table.column(PRODUCT_CODES_COLUMN)
+    product_index = ProductIndex.from_links(
+        json.loads(metadata.get(b"product_vocabulary", b"[]")),
+        pc.list_flatten(product_codes).to_numpy().astype(np.int64),
+        np.repeat(np.arange(table.num_rows, dtype=np.int64), pc.list_value_length(product_codes).to_numpy()),
+    )
+    df_catalog = table.drop_columns([PRODUCT_CODES_COLUMN]).to_pandas(
+        split_blocks=True, # Avoid consolidating float columns into a new (copied) block
+        types_mapper=snapshot_pandas_dtype,
+    )
+    df_catalog.attrs["catalog_version"] = metadata.get(b"catalog_version", b"").decode() or None
+    return df_catalog, product_index
+
+def snapshot_pandas_dtype(arrow_type):
+    # ArrowDtype keeps text columns as views of the memory-mapped buffers; pandas' own string dtype
+    # would cast each one to large_string, a private copy per process
+    if pa.types.is_dictionary(arrow_type) or arrow_type == pa.string():
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+def column_strings(column):
+    # Object array of a text column; Arrow-backed columns decode in Arrow, several times faster than pandas' own conversion
+    if isinstance(column.dtype, pd.ArrowDtype):
+        return pc.cast(pa.array(column.array), pa.string()).to_numpy(zero_copy_only=False)
+    return column.to_numpy(dtype=object)
+
+# --- Change-detected Sync Layer ---
+# The workbook is only converted when its mtime/size/content hash differs from the manifest
+# written by the last successful sync. Reruns with an unchanged workbook cost a single os.stat().
+SYNC_MANIFEST_FILE = ".catalog_sync_manifest.json"
+SYNC_LOCK_FILE = ".catalog_sync.lock"
+
+_sync_thread_lock = threading.Lock() # Streamlit sessions are threads; file locks only guard other processes
+
+def file_fingerprint(file_path):
+    stat = os.stat(file_path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+def file_content_hash(file_path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_json_file(json_path):
+    try:
+        with open(json_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_json_file(data, json_path):
+    tmp_json_path = f"{json_path}.tmp"
+    with open(tmp_json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_json_path, json_path)
+
+@contextmanager
+def sync_lock(lock_path=SYNC_LOCK_FILE):
+    """
+    Exclusive lock held while the workbook is converted, so concurrent reruns
+    (threads) and replicas (processes) run the conversion once per change.
+    """
+    with _sync_thread_lock:
+        with open(lock_path, "a+") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _manifest_matches(manifest, excel_file_path, csv_file_path):
+    return (
+        manifest.get("excel_file") == os.path.abspath(excel_file_path)
+        and manifest.get("csv_file") == os.path.abspath(csv_file_path)
+        and manifest.get("sync_format") == SYNC_FORMAT_VERSION
+        and os.path.exists(csv_file_path)
+    )
+
+def _snapshot_matches(manifest, snapshot_path):
+    return (
+        manifest.get("snapshot_file") == os.path.abspath(snapshot_path)
+        and manifest.get("snapshot_format") == SNAPSHOT_FORMAT_VERSION
+        and os.path.exists(snapshot_path)
+    )
+
+@timed("catalog_sync")
+def sync_catalog_if_changed(excel_file_path, csv_file_path, snapshot_path=SNAPSHOT_FILE, manifest_path=SYNC_MANIFEST_FILE):
+    """
+    Runs excel_to_csv_sync (and rebuilds the snapshot) only when the workbook changed since the last sync.
+    Returns the workbook content hash, used as the catalog version. Sync failures propagate.
+    A directory path is synced as a catalog directory (see sync_catalog_dir_if_changed).
+    """
+    if os.path.isdir(excel_file_path):
+        return sync_catalog_dir_if_changed(excel_file_path, csv_file_path, snapshot_path, manifest_path)
+    if not os.path.exists(excel_file_path):
+        excel_to_csv_sync(excel_file_path, csv_file_path) # Reports and raises FileNotFoundError
+
+    # Fast path: mtime and size unchanged, no need to hash or take the lock
+    fingerprint = file_fingerprint(excel_file_path)
+    manifest = read_json_file(manifest_path)
+    if _manifest_matches(manifest, excel_file_path, csv_file_path) and _snapshot_matches(manifest, snapshot_path) and \
+            manifest.get("mtime_ns") == fingerprint["mtime_ns"] and manifest.get("size") == fingerprint["size"]:
+        result_cache.set_catalog_version(manifest["sha256"]) # No-op unless another process synced a new version
+        return manifest["sha256"]
+
+    with sync_lock():
+        # Another process or session may have finished the sync while we waited for the lock
+        fingerprint = file_fingerprint(excel_file_path)
+        content_hash = file_content_hash(excel_file_path)
+        manifest = read_json_file(manifest_path)
+
+        csv_is_current = _manifest_matches(manifest, excel_file_path, csv_file_path) and manifest.get("sha256") == content_hash
+        if not csv_is_current:
+            excel_to_csv_sync(excel_file_path, csv_file_path)
+        else:
+            print(f"⏭️ '{excel_file_path}' content unchanged (touched only), skipping sync.")
+
+        if not (csv_is_current and _snapshot_matches(manifest, snapshot_path)):
+            try:
+                write_catalog_snapshot(csv_file_path, snapshot_path, content_hash)
+            except Exception as e:
+                print(f"❌ ERROR writing catalog snapshot '{snapshot_path}': {e}")
+                raise
+
+        write_json_file({
+            "excel_file": os.path.abspath(excel_file_path),
+            "csv_file": os.path.abspath(csv_file_path),
+            "sync_format": SYNC_FORMAT_VERSION,
+            "snapshot_file": os.path.abspath(snapshot_path),
+            "snapshot_format": SNAPSHOT_FORMAT_VERSION,
+            "mtime_ns": fingerprint["mtime_ns"],
+            "size": fingerprint["size"],
+            "sha256": content_hash,
+        }, manifest_path)
+        result_cache.set_catalog_version(content_hash) # Drops cached results of the previous catalog
+        return content_hash
+
+# --- Multi-workbook Catalog Directory ---
+# A directory of vendor workbooks (one or more catalog sheets each) can replace the single workbook.
+# Each workbook is converted on its own into a part CSV keyed by its content hash, changed workbooks
+# in parallel, and only the merge step sees all of them. Unchanged workbooks are never re-read.
+CATALOG_SOURCE_DIR = "catalog_sources"
+CATALOG_PARTS_DIR = ".catalog_parts"
+CATALOG_COLUMNS = [
+    "Company Name", "Machine Name", "Category", "Production Capacity (pcs/hr)",
+    "Dough Min (g)", "Dough Max (g)", "Products", "Key Features / Notes",
+]
+PROVENANCE_COLUMNS = ["Source File", "Source Sheet"]
+REQUIRED_SHEET_COLUMNS = ("Machine Name", "Products") # Sheets without these (notes, pivots) are skipped
+
+def catalog_source(excel_file_path=EXCEL_FILE, source_dir=CATALOG_SOURCE_DIR):
+    # The directory wins when it exists, so creating it switches every entry point over
+    return source_dir if os.path.isdir(source_dir) else excel_file_path
+
+def list_catalog_workbooks(source_dir):
+    return sorted(
+        name for name in os.listdir(source_dir)
+        if name.lower().endswith((".xlsx", ".xlsm")) and not name.startswith("~$") # ~$ = Excel lock files
+    )
+
+def workbook_catalog_sheets(excel_file_path):
+    workbook = load_workbook(excel_file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheets = []
+        for sheet in workbook.worksheets:
+            header = {str(value).strip() for value in next(sheet.iter_rows(max_row=1, values_only=True), ()) if value is not None}
+            if all(col in header for col in REQUIRED_SHEET_COLUMNS):
+                sheets.append(sheet.title)
+        return sheets
+    finally:
+        workbook.close()
+
+def ingest_catalog_workbook(excel_file_path, part_path, source_name):
+    """
+    Streams every catalog sheet of one workbook into part_path (CATALOG_COLUMNS + provenance).
+    Missing columns are left blank and extra columns dropped. Runs in a worker process.
+    Returns (rows, sheet names).
+    """
+    sheets = workbook_catalog_sheets(excel_file_path)
+    n_rows = 0
+    tmp_part_path = f"{part_path}.tmp"
+    with open(tmp_part_path, "w", encoding="utf-8", newline="") as part_file:
+        pd.DataFrame(columns=CATALOG_COLUMNS + PROVENANCE_COLUMNS).to_csv(part_file, index=False)
+        for sheet_name in sheets:
+            for df_chunk in iter_sheet_chunks(excel_file_path, sheet_name):
+                df_chunk.columns = [str(col).strip() for col in df_chunk.columns]
+                df_chunk = df_chunk.reindex(columns=CATALOG_COLUMNS, fill_value="")
+                df_chunk["Source File"] = source_name
+                df_chunk["Source Sheet"] = sheet_name
+                df_chunk.to_csv(part_file, index=False, header=False)
+                n_rows += len(df_chunk)
+    os.replace(tmp_part_path, part_path)
+    return n_rows, sheets
+
+def ingest_catalog_workbooks(jobs, workers=None):
+    """Runs ingest_catalog_workbook for each (path, part, name) job, in a process pool when several changed."""
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        return [ingest_catalog_workbook(*job) for job in jobs]
+    # spawn: the app and the service call this from multi-threaded processes, where fork is unsafe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(ingest_catalog_workbook, *zip(*jobs)))
+
+def merge_catalog_parts(part_paths, csv_file_path):
+    """
+    Concatenates the part CSVs, in order, into csv_file_path. A row whose catalog columns already
+    appeared (in any earlier part) is dropped, so a machine listed by several files is kept once,
+    with the provenance of the first file. Returns (rows written, duplicates dropped).
+    """
+    seen_hashes = np.empty(0, dtype="uint64")
+    n_rows = n_duplicates = 0
+    tmp_csv_path = f"{csv_file_path}.tmp"
+    with open(tmp_csv_path, "w", encoding="utf-8", newline="") as csv_file:
+        pd.DataFrame(columns=CATALOG_COLUMNS + PROVENANCE_COLUMNS).to_csv(csv_file, index=False)
+        for part_path in part_paths:
+            for df_chunk in pd.read_csv(part_path, encoding="utf-8", dtype=str, keep_default_na=False, chunksize=SYNC_CHUNK_ROWS):
+                keep, seen_hashes = first_occurrences(df_chunk[CATALOG_COLUMNS], seen_hashes)
+                df_chunk[keep].to_csv(csv_file, index=False, header=False)
+                n_rows += int(keep.sum())
+                n_duplicates += int((~keep).sum())
+    os.replace(tmp_csv_path, csv_file_path)
+    return n_rows, n_duplicates
+
+def _dir_manifest_matches(manifest, source_dir, csv_file_path):
+    return (
+        manifest.get("source_dir") == os.path.abspath(source_dir)
+        and manifest.get("csv_file") == os.path.abspath(csv_file_path)
+        and manifest.get("sync_format") == SYNC_FORMAT_VERSION
+        and os.path.exists(csv_file_path)
+    )
+
+def sync_catalog_dir_if_changed(source_dir, csv_file_path, snapshot_path=SNAPSHOT_FILE, manifest_path=SYNC_MANIFEST_FILE,
+                                parts_dir=CATALOG_PARTS_DIR, workers=None):
+    """
+    Directory counterpart of sync_catalog_if_changed. Each workbook has its own fingerprint in the
+    manifest; only new or changed workbooks are ingested, then all parts are merged and the snapshot
+    rebuilt. Returns the catalog version: a hash over the (file name, content hash) pairs.
+    """
+    workbooks = list_catalog_workbooks(source_dir)
+    if not workbooks:
+        print(f"ERROR: No workbooks found in catalog directory '{source_dir}'.")
+        raise FileNotFoundError(f"No workbooks (.xlsx) found in catalog directory '{source_dir}'.")
+
+    # Fast path: same set of files, each with an unchanged mtime and size
+    fingerprints = {name: file_fingerprint(os.path.join(source_dir, name)) for name in workbooks}
+    manifest = read_json_file(manifest_path)
+    known_sources = manifest.get("sources", {})
+    if _dir_manifest_matches(manifest, source_dir, csv_file_path) and _snapshot_matches(manifest, snapshot_path) and \
+            {name: {"mtime_ns": s.get("mtime_ns"), "size": s.get("size")} for name, s in known_sources.items()} == fingerprints:
+        result_cache.set_catalog_version(manifest["sha256"])
+        return manifest["sha256"]
+
+    with sync_lock():
+        manifest = read_json_file(manifest_path)
+        known_sources = manifest.get("sources", {}) if _dir_manifest_matches(manifest, source_dir, csv_file_path) else {}
+        os.makedirs(parts_dir, exist_ok=True)
+
+        sources, jobs = {}, []
+        for name in workbooks:
+            excel_file_path = os.path.join(source_dir, name)
+            fingerprint = file_fingerprint(excel_file_path)
+            known = known_sources.get(name, {})
+            if known.get("mtime_ns") == fingerprint["mtime_ns"] and known.get("size") == fingerprint["size"] and \
+                    os.path.exists(known.get("part", "")):
+                sources[name] = known
+                continue
+            content_hash = file_content_hash(excel_file_path)
+            part_path = os.path.join(parts_dir, f"{name}.{content_hash[:16]}.csv")
+            sources[name] = {**known, **fingerprint, "sha256": content_hash, "part": part_path}
+            if known.get("sha256") == content_hash and os.path.exists(part_path):
+                print(f"⏭️ '{name}' content unchanged (touched only), skipping.")
+                continue
+            jobs.append((excel_file_path, part_path, name))
+
+        if jobs:
+            print(f"🔄 Ingesting {len(jobs)} of {len(workbooks)} workbook(s) from '{source_dir}'...")
+            try:
+                results = ingest_catalog_workbooks(jobs, workers)
+            except Exception as e:
+                print(f"❌ ERROR during catalog directory ingestion: {e}")
+                raise
+            for (_, _, name), (n_rows, sheets) in zip(jobs, results):
+                sources[name].update({"rows": n_rows, "sheets": sheets})
+                if not sheets:
+                    print(f"⚠️ WARNING: '{name}' has no sheet with {' and '.join(REQUIRED_SHEET_COLUMNS)} columns.")
+                print(f"✅ Ingested '{name}': {n_rows} rows from {len(sheets)} sheet(s).")
+
+        catalog_version = hashlib.sha256(
+            json.dumps([[name, sources[name]["sha256"]] for name in workbooks]).encode("utf-8")
+        ).hexdigest()
+        csv_is_current = _dir_manifest_matches(manifest, source_dir, csv_file_path) and manifest.get("sha256") == catalog_version
+        if not csv_is_current:
+            n_rows, n_duplicates = merge_catalog_parts([sources[name]["part"] for name in workbooks], csv_file_path)
+            print(f"✅ Merged {len(workbooks)} workbook(s) into '{csv_file_path}': {n_rows} rows, {n_duplicates} duplicates dropped.")
+        if not (csv_is_current and _snapshot_matches(manifest, snapshot_path)):
+            try:
+                write_catalog_snapshot(csv_file_path, snapshot_path, catalog_version)
+            except Exception as e:
+                print(f"❌ ERROR writing catalog snapshot '{snapshot_path}': {e}")
+                raise
+
+        # Parts of removed or replaced workbooks are no longer referenced
+        live_parts = {os.path.abspath(source["part"]) for source in sources.values()}
+        for file_name in os.listdir(parts_dir):
+            part_path = os.path.join(parts_dir, file_name)
+            if file_name.endswith(".csv") and os.path.abspath(part_path) not in live_parts:
+                os.remove(part_path)
+
+        write_json_file({
+            "source_dir": os.path.abspath(source_dir),
+            "csv_file": os.path.abspath(csv_file_path),
+            "sync_format": SYNC_FORMAT_VERSION,
+            "snapshot_file": os.path.abspath(snapshot_path),
+            "snapshot_format": SNAPSHOT_FORMAT_VERSION,
+            "sources": sources,
+            "sha256": catalog_version,
+        }, manifest_path)
+        result_cache.set_catalog_version(catalog_version)
+        return catalog_version
+
+# --- Versioned Result Cache ---
+RESULT_CACHE_MAX_ENTRIES = 512
+RESULT_CACHE_TTL_SECONDS = 3600
+
+class ResultCache:
+    """
+    Thread-safe LRU + TTL cache of MatchResults keyed on (product, dough weight, capacity).
+    Entries belong to one catalog version: seeing a different version (from the sync layer or
+    an engine) drops every entry. Cached results are shared, so callers must not mutate them.
+    """
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl_seconds=RESULT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.catalog_version = None
+        self._entries = OrderedDict() # key -> (expires_at, result), least recently used first
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def _adopt_version(self, catalog_version):
+        # Caller holds the lock
+        if catalog_version != self.catalog_version:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+            self.catalog_version = catalog_version
+
+    def set_catalog_version(self, catalog_version):
+        with self._lock:
+            self._adopt_version(catalog_version)
+
+    def get(self, key, catalog_version):
+        with self._lock:
+            self._adopt_version(catalog_version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, catalog_version, result):
+        with self._lock:
+            self._adopt_version(catalog_version)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "catalog_version": self.catalog_version,
+            }
+
+# One cache per process, shared by every engine/session
+result_cache = ResultCache()
+
+# --- Product normalization dictionary ---
+product_normalization = {
+    "bread": "bread", "bred": "bread", "brown bred": "brown bread", "brown bread": "brown bread",
+    "white bread": "white bread", "sour dough bread": "sourdough bread", "sourdough bread": "sourdough bread",
+    "bun": "bun", "buns": "bun", "roll": "roll", "rolls": "roll",
+    "doughnut": "donut", "doughnuts": "donut", "donut": "donut", "donuts": "donut",
+    "hotdog": "hot dog", "hot dog": "hot dog",
+    "cake": "cake", "cakes": "cake", "cupcake": "cup cake", "cupcakes": "cup cake",
+    "pastry": "pastry", "pastries": "pastry",
+    "pizza base": "pizza base", "pizza bases": "pizza base",
+    "naan": "naan", "naans": "naan",
+    "chapati": "chapati", "chapatis": "chapati",
+    "biscuit": "biscuit", "biscuits": "biscuit",
+    "cookie": "cookie", "cookies": "cookie", "cooky": "cookie",
+    "rusk": "rusk", "rusks": "rusk",
+    "muffin": "muffin", "muffins": "muffin",
+    "croissant": "croissant", "croissants": "croissant",
+    "toast": "toast", "toasts": "toast",
+    "puff": "puff pastry", "puffs": "puff pastry",
+    "baguette": "baguette", "baguettes": "baguette",
+    "brioche": "brioche", "brioches": "brioche",
+    "kulcha": "kulcha", "kulchas": "kulcha",
+    "swiss roll": "swiss roll", "swiss rolls": "swiss roll",
+    "eclair": "eclair", "eclairs": "eclair",
+    "macaron": "macaron", "macarons": "macaron",
+    "creme roll": "cream roll", "cream roll": "cream roll", # Consistent spelling
+    "pizza": "pizza base" # Alias for "pizza base"
+}
+
+def normalize_product(product_str):
+    p = str(product_str).strip().lower()
+    normalized = product_normalization.get(p, None)
+    if normalized:
+        return normalized
+    if p.endswith("s") and not p.endswith("ss"):
+        return p.rstrip("s")
+    return p
+
+# --- Product Inverted Index ---
+class ProductIndex:
+    """
+    CSR-style posting lists mapping each normalized product to the catalog rows that list it:
+    row_ids[indptr[code]:indptr[code + 1]] are the (sorted) row positions for vocabulary[code].
+    """
+    def __init__(self, product_series):
+        exploded = product_series.reset_index(drop=True).astype(str).str.split(",").explode()
+        row_positions = exploded.index.to_numpy(dtype=np.int64)
+
+        # Normalize each distinct raw token once instead of once per row
+        raw_codes, raw_tokens = pd.factorize(exploded.to_numpy(dtype=object))
+        normalized_tokens = [normalize_product(token) for token in raw_tokens]
+        token_codes, vocabulary = pd.factorize(pd.Index(normalized_tokens, dtype=object), sort=True)
+        self._set_postings(list(vocabulary), token_codes[raw_codes], row_positions)
+
+    @classmethod
+    def from_links(cls, vocabulary, product_codes, row_ids):
+        # From a product-link table (e.g. the snapshot's machine -> product codes)
+        index = cls.__new__(cls)
+        index._set_postings(list(vocabulary), np.asarray(product_codes), np.asarray(row_ids))
+        return index
+
+    def _set_postings(self, vocabulary, codes, row_positions):
+        # One (product, row) posting per pair, sorted by product then row
+        n_rows = int(row_positions.max()) + 1 if len(row_positions) else 1
+        postings = np.unique(codes.astype(np.int64) * n_rows + row_positions)
+        posting_codes = postings // n_rows
+
+        self.vocabulary = vocabulary
+        self.row_ids = postings % n_rows
+        self.indptr = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_codes, minlength=len(self.vocabulary)), out=self.indptr[1:])
+        self._code_of = {product: code for code, product in enumerate(self.vocabulary)}
+
+    def rows_for(self, product):
+        code = self._code_of.get(product)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        return self.row_ids[self.indptr[code]:self.indptr[code + 1]]
+
+    def products(self):
+        # Product choices for the UI and the prompt parser (placeholder tokens removed)
+        return [p for p in self.vocabulary if p and p not in ["nan", "n/a", ""]]
+
+# --- Typo-tolerant Product Autocomplete ---
+SUGGEST_SHORTLIST = 50 # Names rescored with rapidfuzz per query, picked by trigram overlap
+
+def name_trigrams(text):
+    # Per-word padded trigrams ("  bun " -> "  b", " bu", "bun", "un "), so word order does not matter
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class ProductSuggester:
+    """
+    Trigram index over the catalog's products plus the product_normalization aliases that point
+    to them. Posting lists map each trigram to name ids, so a query only touches names sharing a
+    trigram with it; the best-overlapping shortlist is then ranked with rapidfuzz.
+    Names [0, n_products) are the products in the given order, aliases follow.
+    """
+    def __init__(self, products, aliases=product_normalization):
+        products = list(products)
+        catalog_products = set(products)
+        alias_names = sorted(alias for alias, product in aliases.items() if product in catalog_products and alias not in catalog_products)
+        self.names = products + alias_names
+        self.targets = products + [aliases[alias] for alias in alias_names]
+        self.n_products = len(products)
+
+        gram_ids = {}
+        pair_grams, pair_names = [], []
+        self.gram_counts = np.zeros(len(self.names), dtype=np.int64)
+        for name_id, name in enumerate(self.names):
+            grams = name_trigrams(name)
+            self.gram_counts[name_id] = len(grams)
+            for gram in grams:
+                pair_grams.append(gram_ids.setdefault(gram, len(gram_ids)))
+                pair_names.append(name_id)
+        pair_grams = np.asarray(pair_grams, dtype=np.int64)
+        self.name_ids = np.asarray(pair_names, dtype=np.int64)[np.argsort(pair_grams, kind="stable")]
+        self.indptr = np.zeros(len(gram_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_grams, minlength=len(gram_ids)), out=self.indptr[1:])
+        self._gram_id = gram_ids
+
+    def shortlist(self, query, size=SUGGEST_SHORTLIST):
+        """Name ids with the highest trigram Jaccard similarity to the query, best first."""
+        query_grams = name_trigrams(query)
+        gram_codes = np.array([code for code in map(self._gram_id.get, query_grams) if code is not None], dtype=np.int64)
+        if not len(gram_codes):
+            return np.empty(0, dtype=np.int64)
+        # Gather the matched posting lists at once and count shared trigrams per name
+        starts, lengths = self.indptr[gram_codes], self.indptr[gram_codes + 1] - self.indptr[gram_codes]
+        postings = self.name_ids[csr_gather(starts, lengths)]
+        overlap = np.bincount(postings, minlength=len(self.names))
+        candidates = np.flatnonzero(overlap)
+        similarity = overlap[candidates] / (len(query_grams) + self.gram_counts[candidates] - overlap[candidates])
+        if len(candidates) > size:
+            top = np.argpartition(-similarity, size)[:size]
+            candidates, similarity = candidates[top], similarity[top]
+        return candidates[np.argsort(-similarity, kind="stable")]
+
+    def suggest(self, query, k=10):
+        """
+        Top-k suggestions for a partial or misspelled product name, as dicts with the catalog
+        product, its score (0-100) and the name or alias that matched. Prefix matches come first.
+        """
+        query = str(query).strip().lower()
+        candidates = self.shortlist(query, max(SUGGEST_SHORTLIST, 4 * k)) if query else []
+        if not len(candidates):
+            return []
+        names = [self.names[name_id] for name_id in candidates]
+        scores = process.cdist([query], names, scorer=fuzz.WRatio, dtype=np.float64)[0]
+        is_prefix = np.array([name.startswith(query) for name in names])
+        suggestions, seen = [], set()
+        for i in np.lexsort((-scores, ~is_prefix)):
+            product = self.targets[candidates[i]]
+            if product not in seen:
+                seen.add(product)
+                suggestions.append({"product": product, "score": round(float(scores[i]), 1), "matched": names[i]})
+                if len(suggestions) == k:
+                    break
+        return suggestions
+
+# --- Dough Weight Interval Index ---
+class DoughRangeIndex:
+    """
+    Centered interval tree over [Dough Min, Dough Max] ranges. A missing (NaN) bound is open-ended,
+    matching the dough filter: NaN min covers every lighter weight and NaN max every heavier one.
+    covering() answers "which machines accept this weight" in O(log n + matches);
+    nearest() returns the k closest misses, ranked by how many grams the weight falls outside the range.
+    """
+    def __init__(self, row_ids, dough_min, dough_max, groups=None):
+        # groups (one int per range, e.g. a stage code) lets nearest() answer for a subset of machines
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        groups = np.zeros(len(row_ids), dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+        lows = np.where(np.isnan(dough_min), -np.inf, dough_min).astype("float64")
+        highs = np.where(np.isnan(dough_max), np.inf, dough_max).astype("float64")
+        # An inverted range (min > max) accepts no weight, as in the dough filter, so it is left out of the tree
+        valid = lows <= highs
+        self.row_ids, self.groups = row_ids[valid], groups[valid]
+        self.lows, self.highs = lows[valid], highs[valid]
+        # Inverted ranges miss on both sides at once, so nearest() checks their (few) gaps directly
+        self._inverted = (row_ids[~valid], lows[~valid], highs[~valid], groups[~valid])
+
+        self._endpoint_orders = None # Built by the first nearest() call; covering() never needs them
+
+        # Flat node table: (center, ids sorted by low, lows sorted, ids sorted by high, highs sorted, left, right)
+        self._nodes = []
+        self._root = self._build(np.arange(len(self.row_ids)))
+
+    def _build_endpoint_orders(self):
+        # By group first: within a group, misses above the weight are ranked by low and misses below it by high
+        low_order = self._group_order(np.argsort(self.lows, kind="stable"))
+        high_order = self._group_order(np.argsort(self.highs, kind="stable"))
+        sorted_groups = self.groups[low_order]
+        group_values = np.unique(np.concatenate([self.groups, self._inverted[3]])) # Including groups with inverted ranges only
+        group_span = dict(zip(group_values.tolist(), zip(
+            np.searchsorted(sorted_groups, group_values, side="left").tolist(), np.searchsorted(sorted_groups, group_values, side="right").tolist()
+        )))
+        return low_order, self.lows[low_order], high_order, self.highs[high_order], group_span
+
+    def _group_order(self, order):
+        # Stable regroup of an endpoint order; few distinct groups, so small ints take numpy's radix sort
+        groups = self.groups[order]
+        if len(groups) and groups.min() >= np.iinfo(np.int16).min and groups.max() <= np.iinfo(np.int16).max:
+            groups = groups.astype(np.int16)
+        return order[np.argsort(groups, kind="stable")]
+
+    def _build(self, ids):
+        if len(ids) == 0:
+            return -1
+        endpoints = np.concatenate([self.lows[ids], self.highs[ids]])
+        endpoints = endpoints[np.isfinite(endpoints)]
+        center = float(np.median(endpoints)) if len(endpoints) else 0.0
+
+        lows, highs = self.lows[ids], self.highs[ids]
+        # Each range goes to exactly one place: spanning the center, left of it, or right of it
+        in_here = (lows <= center) & (highs >= center)
+        in_left = highs < center
+        here = ids[in_here]
+        by_low = here[np.argsort(self.lows[here], kind="stable")]
+        by_high = here[np.argsort(self.highs[here], kind="stable")]
+
+        node_id = len(self._nodes)
+        self._nodes.append(None)
+        left = self._build(ids[in_left])
+        right = self._build(ids[~in_here & ~in_left])
+        self._nodes[node_id] = (center, by_low, self.lows[by_low], by_high, self.highs[by_high], left, right)
+        return node_id
+
+    def covering(self, weight):
+        matches = []
+        node_id = self._root
+        while node_id != -1:
+            center, by_low, lows, by_high, highs, left, right = self._nodes[node_id]
+            if weight < center:
+                # Every range here reaches the center, so only the low end can exclude the weight
+                matches.append(by_low[:np.searchsorted(lows, weight, side="right")])
+                node_id = left
+            elif weight > center:
+                matches.append(by_high[np.searchsorted(highs, weight, side="left"):])
+                node_id = right
+            else:
+                matches.append(by_low)
+                break
+        if not matches:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(self.row_ids[np.concatenate(matches)])
+
+    def nearest(self, weight, k, groups=None):
+        """
+        Returns (row_ids, gaps) for the k ranges in `groups` (all when None) closest to `weight` that
+        do not cover it, nearest first, plus any tied with the k-th; the gap is the grams the weight
+        falls outside the range. A valid range misses either above the weight (ranked by low) or
+        below it (ranked by high), so each group contributes the k ranges on either side of the
+        weight's position in its endpoint orders: O(groups * (log n + k)).
+        """
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        if self._endpoint_orders is None:
+            self._endpoint_orders = self._build_endpoint_orders()
+        low_order, sorted_lows, high_order, sorted_highs, group_span = self._endpoint_orders
+        groups = list(group_span) if groups is None else [g for g in groups if g in group_span]
+        spans = [group_span[g] for g in groups]
+        # Positions of the weight in each group's run of both orders
+        above = [start + np.searchsorted(sorted_lows[start:end], weight, side="right") for start, end in spans]
+        below = [start + np.searchsorted(sorted_highs[start:end], weight, side="left") for start, end in spans]
+
+        inverted_rows, inverted_lows, inverted_highs, inverted_groups = self._inverted
+        in_groups = np.isin(inverted_groups, groups)
+        inverted_rows = inverted_rows[in_groups]
+        inverted_gaps = np.maximum(inverted_lows[in_groups] - weight, weight - inverted_highs[in_groups])
+
+        def misses(above_ends, below_starts):
+            ids_above = np.concatenate([low_order[a:e] for a, e in zip(above, above_ends)] or [np.empty(0, dtype=np.int64)])
+            ids_below = np.concatenate([high_order[s:b] for s, b in zip(below_starts, below)] or [np.empty(0, dtype=np.int64)])
+            rows = np.concatenate([self.row_ids[ids_above], self.row_ids[ids_below], inverted_rows])
+            gaps = np.concatenate([self.lows[ids_above] - weight, weight - self.highs[ids_below], inverted_gaps])
+            return rows, gaps
+
+        # The k nearest overall are among each group's k nearest on either side
+        rows, gaps = misses([min(a + k, end) for a, (_, end) in zip(above, spans)], [max(b - k, start) for b, (start, _) in zip(below, spans)])
+        if k <= len(gaps):
+            kth = np.partition(gaps, k - 1)[k - 1]
+            # Widen each run to every range tied with the k-th (nextafter: weight + kth may round down)
+            reach_above, reach_below = np.nextafter(weight + kth, np.inf), np.nextafter(weight - kth, -np.inf)
+            rows, gaps = misses(
+                [start + np.searchsorted(sorted_lows[start:end], reach_above, side="right") for start, end in spans],
+                [start + np.searchsorted(sorted_highs[start:end], reach_below, side="left") for start, end in spans],
+            )
+            rows, gaps = rows[gaps <= kth], gaps[gaps <= kth]
+        order = np.lexsort((rows, gaps))
+        return rows[order], gaps[order]
+
+def build_dough_indexes(df_catalog, index, groups=None):
+    # groups: one int per catalog row, passed on to each product's DoughRangeIndex
+    dough_min = df_catalog["_Numeric_Dough Min (g)"].to_numpy(dtype="float64")
+    dough_max = df_catalog["_Numeric_Dough Max (g)"].to_numpy(dtype="float64")
+    dough_indexes = {}
+    for product in index.products():
+        rows = index.rows_for(product)
+        dough_indexes[product] = DoughRangeIndex(rows, dough_min[rows], dough_max[rows], None if groups is None else groups[rows])
+    return dough_indexes
+
+# --- Key Features Full-text Index ---
+FEATURE_SOURCE_COLUMNS = ["Machine Name", "Key Features / Notes"]
+FEATURE_TOKEN_PATTERN = re.compile(r"\b[a-z]+\b") # Words only; model numbers and specs ("1400mm") are not features
+FEATURE_SPLIT_PATTERN = r"[^a-z0-9]+"
+FEATURE_STOPWORDS = frozenset([
+    "a", "an", "and", "or", "the", "of", "to", "in", "on", "for", "with", "by", "at", "as", "is", "are", "up", "per", "its",
+])
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+@lru_cache(maxsize=65536)
+def feature_stem(token):
+    # Light suffix stripping so "controlled"/"control" and "lidding"/"lids"/"lid" share a term
+    for suffix in ("ing", "ed", "s"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3 and not token.endswith(("eed", "ss")):
+            token = token[:-len(suffix)]
+            if token[-1] == token[-2] and (token[-1] not in "lsz" or len(token) > 4):
+                token = token[:-1]
+            break
+    return token
+
+def feature_terms(text):
+    return [feature_stem(token) for token in FEATURE_TOKEN_PATTERN.findall(str(text).lower()) if token not in FEATURE_STOPWORDS]
+
+class FeatureIndex:
+    """
+    BM25 inverted index over each machine's Machine Name and Key Features / Notes.
+    Postings are CSR like ProductIndex: row_ids[indptr[code]:indptr[code + 1]] are the rows
+    containing vocabulary[code] and weights[...] their precomputed BM25 term impact, so a query
+    is a few slice scatters into one score array.
+    """
+    def __init__(self, df_catalog, columns=FEATURE_SOURCE_COLUMNS, k1=BM25_K1, b=BM25_B):
+        self.n_rows = len(df_catalog)
+        vocabulary_ids = {}
+        pair_rows, pair_terms = [], []
+        for col in columns:
+            if col not in df_catalog.columns:
+                continue
+            # Tokenize each distinct text once; rows sharing a text share its terms
+            text_codes, texts = pd.factorize(df_catalog[col])
+            # Split in Arrow, then stem each distinct token once (stopwords and tokens with digits -> -1)
+            token_lists = pc.split_pattern_regex(pc.utf8_lower(pa.array(np.asarray(texts, dtype=object), type=pa.string())), FEATURE_SPLIT_PATTERN)
+            tokens = pc.dictionary_encode(pc.list_flatten(token_lists))
+            token_terms = np.array([
+                -1 if not FEATURE_TOKEN_PATTERN.fullmatch(token) or token in FEATURE_STOPWORDS
+                else vocabulary_ids.setdefault(feature_stem(token), len(vocabulary_ids))
+                for token in tokens.dictionary.to_pylist()
+            ] + [-1], dtype=np.int64)[tokens.indices.to_numpy(zero_copy_only=False)]
+            link_texts = pc.list_parent_indices(token_lists).to_numpy().astype(np.int64)[token_terms >= 0]
+            link_terms = token_terms[token_terms >= 0]
+            rows_by_text = np.argsort(text_codes, kind="stable")[np.count_nonzero(text_codes < 0):]
+            text_starts = np.concatenate([[0], np.cumsum(np.bincount(text_codes[text_codes >= 0], minlength=len(texts)))])
+            # Expand every (text, term) link to the rows holding that text
+            lengths = text_starts[link_texts + 1] - text_starts[link_texts]
+            pair_rows.append(rows_by_text[csr_gather(text_starts[link_texts], lengths)])
+            pair_terms.append(np.repeat(link_terms, lengths))
+
+        vocabulary = sorted(vocabulary_ids)
+        rank = np.empty(len(vocabulary_ids), dtype=np.int64)
+        rank[[vocabulary_ids[term] for term in vocabulary]] = np.arange(len(vocabulary))
+        n_rows = max(self.n_rows, 1)
+        pairs, term_freqs = np.unique(
+            rank[np.concatenate(pair_terms + [np.empty(0, dtype=np.int64)])] * n_rows +
+            np.concatenate(pair_rows + [np.empty(0, dtype=np.int64)]),
+            return_counts=True,
+        )
+        posting_codes, row_ids = pairs // n_rows, pairs % n_rows
+
+        self.vocabulary = vocabulary
+        self.indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_codes, minlength=len(vocabulary)), out=self.indptr[1:])
+        self.row_ids = row_ids.astype(np.int32)
+
+        doc_lengths = np.bincount(row_ids, weights=term_freqs, minlength=n_rows)
+        relative_length = doc_lengths[row_ids] / max(doc_lengths.mean(), 1.0)
+        doc_freqs = np.diff(self.indptr)
+        idf = np.log(1 + (self.n_rows - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        self.weights = (idf[posting_codes] * term_freqs * (k1 + 1) / (term_freqs + k1 * (1 - b + b * relative_length))).astype(np.float32)
+        self._code_of = {term: code for code, term in enumerate(vocabulary)}
+
+    def known_terms(self, terms):
+        return [term for term in terms if term in self._code_of]
+
+    def scores(self, terms):
+        """Dense BM25 scores, one per catalog row (0 = no query term occurs)."""
+        scores = np.zeros(self.n_rows)
+        for term in set(terms):
+            code = self._code_of.get(term)
+            if code is not None:
+                start, end = self.indptr[code], self.indptr[code + 1]
+                scores[self.row_ids[start:end]] += self.weights[start:end]
+        return scores
+
+# --- Define Mappings for Production Line Logic ---
+machine_stage_mapping = {
+    "Spiral Mixer": "Mixing", "Reinforced Spiral Mixer with Fixed Bowl": "Mixing",
+    "Hydraulic Bowl Lifter": "Mixing", "Spiral Mixer (Fixed Bowl)": "Mixing",
+    "Spiral Mixer with Hydraulic Lifter": "Mixing", "Mixer": "Mixing",
+    "Planetary Mixer": "Mixing", "Dough Mixer": "Mixing",
+
+    "Automatic divider & rounder": "Dividing", "Automatic Divider and Moulder": "Dividing",
+    "Dough Divider": "Dividing", "Dough Rounder": "Dividing",
+
+    "Automatic Cream Roll Forming": "Forming", "Cookie Dropping Machine": "Forming",
+    "Wire Cut Cookie Machine": "Forming", "Rotary Moulder": "Forming",
+    "Dough Moulder": "Forming", "Sheeter": "Forming", "Laminator": "Forming",
+    "Depositor": "Depositing", "Dough Former": "Forming", "Extruder": "Forming",
+
+    "Confectionery depositor": "Depositing", "Automatic Confectionery Depositer": "Depositing",
+    "Inline Depositing & Decorating": "Depositing",
+
+    "Depositing & Icing": "Finishing", "Depositing Injecting & Icing": "Finishing",
+    "Depositing & Injecting": "Filling", "Filling": "Filling", # Corrected typo in key to match value
+
+    "Convection oven": "Baking", "Fryer": "Baking",
+    "Cyclothermic Deck Oven": "Baking", "Rotary Rack Oven": "Baking",
+    "Rotary Convection Oven": "Baking", "Electric Deck Oven": "Baking",
+    "Tunnel Oven": "Baking", "Industrial Oven": "Baking",
+
+    "Vacuum Cooler": "Cooling", "Cooling Conveyor": "Cooling", "Cooling Tunnel": "Cooling",
+
+    "Slicing": "Slicing", "Slicing & Packing Line": "Slicing",
+    "Bread Slicer": "Slicing", "Automatic Commercial Bread Slicer": "Slicing",
+    "Automatic Bread Slicer": "Slicing", "Cake Slicer": "Slicing",
+
+    "Sourdough Fermenter": "Fermentation", "Proofer": "Proofing",
+    "Intermediate Proofer": "Proofing",
+
+    "Packing Machine": "Packing", "Flow Wrap Machine": "Packing",
+    "Vertical Form Fill Seal Machine": "Packing", "Horizontal Flow Wrapper": "Packing",
+    "Packaging Machine": "Packing",
+
+    "Syrup Spraying": "Finishing", "Glazer": "Finishing",
+    "Decorating Machine": "Finishing", "Enrober": "Finishing",
+
+    "Automatic Cake Line": "Complete Line", "Integrated Bread Line": "Complete Line",
+    "Integrated Bun Line": "Complete Line", "Integrated Cookie Line": "Complete Line",
+    "Integrated Donut Line": "Complete Line", "Integrated Pastry Line": "Complete Line",
+    "General Purpose": "General Processing", "Industrial Line": "Complete Line"
+}
+
+
+STAGE_MATCH_THRESHOLD = 85
+
+# Helper function for fuzzy matching categories
+def get_stage_from_category(category_name, mapping=machine_stage_mapping, threshold=STAGE_MATCH_THRESHOLD):
+    if pd.isna(category_name) or not isinstance(category_name, str):
+        return "N/A"
+    best_match = process.extractOne(category_name, mapping.keys(), scorer=fuzz.token_sort_ratio)
+    if best_match and best_match[1] >= threshold:
+        return mapping[best_match[0]]
+    return "N/A"
+
+# --- Persisted Category -> Stage resolution ---
+# Each distinct Category is fuzzy-matched once and the result is cached on disk. The cache is keyed
+# on a hash of machine_stage_mapping and the threshold, so editing the mapping invalidates it.
+STAGE_CACHE_FILE = ".stage_cache.json"
+
+def stage_mapping_hash(mapping=machine_stage_mapping, threshold=STAGE_MATCH_THRESHOLD):
+    payload = json.dumps({"mapping": mapping, "threshold": threshold}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def resolve_category_stages(category_series, cache_path=STAGE_CACHE_FILE):
+    """
+    Returns a categorical Stage series aligned with category_series.
+    Only categories missing from the on-disk cache are fuzzy-matched.
+    """
+    mapping_hash = stage_mapping_hash()
+    cache = read_json_file(cache_path)
+    cached_stages = cache.get("stages", {}) if cache.get("mapping_hash") == mapping_hash else {}
+
+    category_codes, categories = pd.factorize(category_series.astype(str))
+    missing = [category for category in categories if category not in cached_stages]
+    if missing:
+        cached_stages.update({category: get_stage_from_category(category) for category in missing})
+        try:
+            write_json_file({"mapping_hash": mapping_hash, "stages": cached_stages}, cache_path)
+        except OSError as e:
+            print(f"WARNING: Could not write stage cache '{cache_path}': {e}")
+
+    stage_values = np.array([cached_stages[category] for category in categories] + ["N/A"], dtype=object)
+    # factorize marks missing categories with -1, which picks the trailing "N/A"
+    return pd.Series(
+        pd.Categorical(stage_values[category_codes]),
+        index=category_series.index,
+        name="Stage",
+    )
+
+product_to_group_mapping = {
+    "bun": "Bun & Pav Line", "long bun": "Bun & Pav Line", "ladi pav": "Bun & Pav Line",
+    "fruit bun": "Bun & Pav Line", "hamburger bun": "Bun & Pav Line",
+    "dinner roll": "Bun & Pav Line", "hot dog": "Bun & Pav Line",
+    "burger bun": "Bun & Pav Line", "pav": "Bun & Pav Line",
+
+    "bread loaf": "Bread Line", "white bread": "Bread Line",
+    "tin bread": "Bread Line", "brown bread": "Bread Line",
+    "sandwich bread": "Bread Line",
+
+    "atta cookie": "Cookie Line", "butter cookie": "Cookie Line",
+    "choco-filled cookie": "Cookie Line", "checkered cookie": "Cookie Line",
+    "coconut biscuit": "Cookie Line", "danish cookie": "Cookie Line",
+    "drop cookie": "Cookie Line", "date bar cookie": "Cookie Line",
+    "long drop cookie": "Cookie Line", "rotary cookie": "Cookie Line",
+    "shortbread cookie": "Cookie Line", "neapolitan cookie": "Cookie Line",
+    "viennese whirl": "Cookie Line", "wirecut cookie": "Cookie Line",
+    "jeera butter": "Biscuit & Snack Line",
+
+    "banana cake": "Cake Line", "barni cake": "Cake Line",
+    "battenberg cake": "Cake Line", "carrot cake": "Cake Line",
+    "cup cake": "Cake Line", "muffin": "Cake Line",
+    "rainbow muffin": "Cake Line", "plum cake": "Cake Line",
+    "slice cake": "Cake Line", "sponge cake": "Cake Line",
+    "sponge sheet": "Cake Line", "finger cake": "Cake Line",
+    "pound cake": "Cake Line", "bar cake": "Cake Line",
+
+    "cream filled muffin": "Confectionery & Filled Line",
+    "swiss roll": "Confectionery & Filled Line",
+    "swiss roll sheet": "Confectionery & Filled Line",
+    "jam roll": "Confectionery & Filled Line",
+
+    "croissant": "Puff & Croissant Line", "puff pastry": "Puff & Croissant Line",
+    "khari": "Puff & Croissant Line", "danish pastry": "Puff & Croissant Line",
+
+    "fruit rusk": "Rusk & Toast Line", "jeera rusk": "Rusk & Toast Line",
+    "rusk": "Rusk & Toast Line", "toast": "Rusk & Toast Line",
+    "milk rusk": "Rusk & Toast Line",
+
+    "sour dough": "Specialty Bread Line", "sourdough bread": "Specialty Bread Line",
+    "brioche": "Specialty Bread Line", "baguette": "baguette", # Corrected typo "Baguelte"
+    "kulcha": "General Products", # Assigning to General Products as no specific group found
+    "focaccia": "Specialty Bread Line", "ciabatta": "Specialty Bread Line",
+
+    "cream roll": "Confectionery & Filled Line",
+    "eclair": "Confectionery & Filled Line",
+
+    "pizza base": "Pizza Base Line",
+    "macaron": "Macaron Line",
+    "donut": "Donut Line",
+    "doughnut": "Donut Line",
+
+    "biscuit": "Biscuit & Snack Line",
+    "cracker": "Biscuit & Snack Line",
+    "namkeen": "Biscuit & Snack Line",
+    "wafer": "Biscuit & Snack Line",
+    "cookies": "Cookie Line",
+}
+
+group_wise_production_lines = {
+    "Bun & Pav Line": [
+        "Mixing", "Dividing", "Forming", "Proofing", "Baking", "Cooling", "Slicing", "Packing"
+    ],
+    "Bread Line": [
+        "Mixing", "Dividing", "Forming", "Fermentation", "Baking", "Cooling", "Slicing", "Packing"
+    ],
+    "Cookie Line": [
+        "Mixing", "Forming", "Depositing", "Baking", "Cooling", "Packing"
+    ],
+    "Cake Line": [
+        "Mixing", "Depositing", "Baking", "Cooling", "Finishing", "Packing"
+    ],
+    "Puff & Croissant Line": [
+        "Mixing", "Sheeting", "Forming", "Proofing", "Baking", "Cooling", "Packing"
+    ],
+    "Rusk & Toast Line": [
+        "Mixing", "Dividing", "Forming", "Baking", "Cooling", "Slicing", "Re-Baking", "Packing"
+    ],
+    "Specialty Bread Line": [
+        "Mixing", "Fermentation", "Dividing", "Forming", "Proofing", "Baking", "Cooling", "Packing"
+    ],
+    "Confectionery & Filled Line": [
+        "Mixing", "Depositing", "Forming", "Baking", "Cooling", "Filling", "Finishing", "Packing"
+    ],
+    "Pizza Base Line": [
+        "Mixing", "Dividing", "Forming", "Proofing", "Baking", "Cooling", "Packing"
+    ],
+    "Biscuit & Snack Line": [
+        "Mixing", "Forming", "Baking", "Cooling", "Packing"
+    ],
+    "Macaron Line": [
+        "Mixing", "Depositing", "Baking", "Cooling", "Packing"
+    ],
+    "Donut Line": [
+        "Mixing", "Forming", "Proofing", "Baking", "Finishing", "Slicing"
+    ],
+    "General Products": [
+        "Mixing", "General Processing", "Packing"
+    ]
+}
+
+# --- Helper to display values (preserving original strings for non-numeric data) ---
+def get_display_values(values):
+    """
+    Vectorized display formatting for a column of values, handling NaN or empty strings.
+    Truly empty or NaN entries become a dash. Otherwise, the exact (stripped) string is kept.
+    """
+    s_values = values.astype(str).str.strip()
+    return s_values.where(~s_values.str.lower().isin(["nan", "n/a", ""]), "-")
+
+# Display strings are built once at sync time and stored in the snapshot, so result tables only select and number rows
+DISPLAY_SOURCE_COLUMNS = {
+    "_Display Machine Name": "Machine Name",
+    "_Display Company": "Company Name",
+    "_Display Capacity": "Production Capacity (pcs/hr)",
+}
+
+def add_display_columns(df_catalog):
+    def source(col):
+        if col in df_catalog.columns:
+            # Format each distinct value once, then expand through the codes
+            # Missing cells are formatted as the "" the snapshot stores for them
+            codes, uniques = pd.factorize(snapshot_text(df_catalog[col]))
+            formatted = get_display_values(pd.Series(np.asarray(uniques, dtype=object), dtype=object)).to_numpy(dtype=object)
+            return pd.Series(formatted[codes], index=df_catalog.index, dtype=object)
+        return pd.Series("N/A", index=df_catalog.index)
+
+    for display_col, source_col in DISPLAY_SOURCE_COLUMNS.items():
+        df_catalog[display_col] = source(source_col)
+
+    # Display original strings for Dough Min/Max
+    dough_min_str, dough_max_str = source("Dough Min (g)"), source("Dough Max (g)")
+    has_min, has_max = dough_min_str != "-", dough_max_str != "-"
+    dough_info = pd.Series("-", index=df_catalog.index, dtype=object)
+    dough_info = dough_info.mask(has_max, "Max " + dough_max_str + "g")
+    dough_info = dough_info.mask(has_min, "Min " + dough_min_str + "g")
+    dough_info = dough_info.mask(has_min & has_max, dough_min_str + "-" + dough_max_str + "g")
+    df_catalog["_Display Dough"] = dough_info
+
+    # Replace newlines with spaces for better table display
+    df_catalog["_Display Key Features"] = source("Key Features / Notes").str.replace("\n", " ", regex=False).str.strip()
+    return df_catalog
+
+# --- Catalog Memory Report ---
+def is_mapped_column(column):
+    # Arrow-backed columns and numpy views of Arrow buffers read the memory-mapped snapshot; arrays pandas allocated do not
+    if isinstance(column.dtype, pd.ArrowDtype):
+        return True
+    return isinstance(column.dtype, np.dtype) and not column.to_numpy().flags.owndata
+
+def arrow_buffer_bytes(column):
+    # Buffers shared by several chunks (the snapshot's one dictionary per column) are counted once
+    return int(pa.array(column.array).get_total_buffer_size())
+
+def catalog_memory_report(df_catalog):
+    """
+    Bytes per column as held now and as the previous layout held it: snapshot text as plain Arrow
+    strings and the display strings as per-process Python objects. `mapped` marks the columns
+    read from the memory-mapped snapshot, which every process shares. Returns a DataFrame indexed
+    by column, with a Total row.
+    """
+    rows = []
+    for col in df_catalog.columns:
+        column = df_catalog[col]
+        if isinstance(column.dtype, pd.ArrowDtype):
+            bytes_after = arrow_buffer_bytes(column)
+            bytes_before = int(pc.cast(pa.array(column.array), pa.string()).get_total_buffer_size())
+        else:
+            bytes_after = bytes_before = int(column.memory_usage(index=False, deep=True))
+        if col.startswith("_Display"):
+            bytes_before = int(column.astype(object).memory_usage(index=False, deep=True))
+        rows.append({
+            "column": col, "dtype": str(column.dtype), "mapped": is_mapped_column(column),
+            "bytes_before": bytes_before, "bytes_after": bytes_after,
+        })
+    report = pd.DataFrame(rows, columns=["column", "dtype", "mapped", "bytes_before", "bytes_after"]).set_index("column")
+    report.loc["Total"] = ["", bool(report["mapped"].all()), report["bytes_before"].sum(), report["bytes_after"].sum()]
+    report["saved_pct"] = (100 * (1 - report["bytes_after"] / report["bytes_before"].where(report["bytes_before"] > 0))).round(1)
+    return report
+
+# --- Parse user prompt ---
+CAPACITY_PATTERN = re.compile(r"(\d{2,6})\s*(pcs|pieces|per hour|/hr|units)?")
+DOUGH_WEIGHT_PATTERN = re.compile(r"(dough\s*weight\s*(of)?\s*)?(\d{1,4})\s*(g|grams|gram)\b")
+NON_PRODUCT_TERMS = ["line", "per hour", "capacity", "dough", "weight", "needed", "make", "produce", "for", "machine"]
+# Substring match, same as checking `term in phrase` for every term
+NON_PRODUCT_PATTERN = re.compile("|".join(re.escape(term) for term in NON_PRODUCT_TERMS))
+
+# Feature requests follow a marker ("with PLC control, stainless steel bowl") up to "for" or the end
+FEATURE_CLAUSE_PATTERN = re.compile(r"\b(?:with|featuring|having|including|must have|that has)\b(.*?)(?=\bfor\b|$)")
+NON_FEATURE_TERMS = frozenset(["line", "hour", "capacity", "dough", "weight", "need", "needed", "make", "produce", "machine",
+                               "pcs", "piece", "unit", "g", "gram", "we", "i", "want"])
+
+def feature_query_terms(text):
+    # Query-side analysis: catalog terms minus the parser's own vocabulary
+    terms = [term for term in feature_terms(text) if term not in NON_FEATURE_TERMS]
+    return tuple(sorted(set(terms)))
+
+def extract_feature_terms(prompt_text):
+    return feature_query_terms(" ".join(FEATURE_CLAUSE_PATTERN.findall(prompt_text)))
+
+# Shared-line prompts list products with their own capacities: "5000 buns and 2000 bread loaves per hour"
+PRODUCT_SEPARATOR_PATTERN = re.compile(r",|;|\+|&|\band\b|\bplus\b|\bas well as\b")
+
+def split_product_segments(prompt_text):
+    # Feature clauses ("with steel bowl and PLC") are dropped first so their "and" does not split products
+    segments = PRODUCT_SEPARATOR_PATTERN.split(FEATURE_CLAUSE_PATTERN.sub(" ", prompt_text))
+    return [segment.strip() for segment in segments if segment.strip()]
+
+def segment_capacity(segment):
+    # Capacity within one product's segment; "50g" is a dough weight, not a capacity
+    capacity_match = CAPACITY_PATTERN.search(DOUGH_WEIGHT_PATTERN.sub(" ", segment))
+    return int(capacity_match.group(1)) if capacity_match else None
+
+# Words a segment can hold without naming a product ("5000 pcs per hour", "50g dough")
+SPEC_SEGMENT_TERMS = NON_FEATURE_TERMS | frozenset(["pieces", "units", "per", "hr", "grams", "for", "a", "an", "of", "at", "least",
+                                                    "about", "around", "total", "each", "both"])
+
+def is_spec_segment(segment):
+    return all(word in SPEC_SEGMENT_TERMS for word in re.findall(r"[a-z]+", DOUGH_WEIGHT_PATTERN.sub(" ", segment)))
+
+PRODUCT_MATCH_THRESHOLD = 80
+PARSER_MODE = "batched" # "batched": one cdist matrix call; "scan": one extractOne call per candidate phrase
+PARSE_CACHE_MAX_ENTRIES = 1024 # Per MatchEngine (i.e. per catalog version)
+
+def extract_product_candidates(prompt_text):
+    words = prompt_text.split()
+    candidates = []
+    for i in range(len(words)):
+        for j in range(1, 4):
+            phrase = " ".join(words[i:i + j])
+            if len(phrase.split()) == j:
+                candidates.append(phrase)
+    candidates.append(prompt_text)
+
+    filtered_candidates = [c for c in candidates if not NON_PRODUCT_PATTERN.search(c)]
+    return filtered_candidates or candidates
+
+def best_product_match_scan(candidates, choices):
+    best_match = None
+    best_score = 0
+    for phrase in candidates:
+        normalized_phrase = normalize_product(phrase)
+        match_result = process.extractOne(normalized_phrase, choices, scorer=fuzz.token_sort_ratio)
+        if match_result and match_result[1] > best_score:
+            best_match = match_result[0]
+            best_score = match_result[1]
+    return best_match, best_score
+
+def best_product_match_batched(candidates, choices):
+    # Deduplicate while keeping first-occurrence order, so ties resolve exactly like the scan
+    normalized_phrases = list(dict.fromkeys(normalize_product(phrase) for phrase in candidates))
+    if not normalized_phrases or not choices:
+        return None, 0
+    scores = process.cdist(normalized_phrases, choices, scorer=fuzz.token_sort_ratio, dtype=np.float64)
+    # Row-major argmax = first candidate reaching the top score, then its first best choice
+    best_row, best_col = divmod(int(np.argmax(scores)), len(choices))
+    best_score = scores[best_row, best_col]
+    if best_score <= 0:
+        return None, 0
+    return choices[best_col], best_score
+
+# --- Helper to generate DataFrame for display with 1-indexed S. No. ---
+@timed("generate_display_dataframe")
+def generate_display_dataframe(df_machines, min_capacity_provided, first_row=1):
+    # first_row numbers a page of a longer table (S. No. continues across pages)
+    if df_machines.empty:
+        return pd.DataFrame()
+
+    n_rows = len(df_machines)
+    columns = {
+        "S. No.": np.arange(first_row, first_row + n_rows).astype(str),
+        "Machine Name": column_strings(df_machines["_Display Machine Name"]),
+        "Company": column_strings(df_machines["_Display Company"]),
+        "Capacity (pcs/hr)": column_strings(df_machines["_Display Capacity"]),
+        "Dough (g)": column_strings(df_machines["_Display Dough"]),
+        "Key Features": column_strings(df_machines["_Display Key Features"]),
+    }
+
+    table_headers = ["S. No.", "Machine Name", "Company", "Capacity (pcs/hr)", "Dough (g)", "Key Features"]
+    if isinstance(min_capacity_provided, (int, float)):
+        # Adjusting insertion points for "Units Req." and "Total Cap." based on your desired order
+        table_headers.insert(4, "Units Req.") # Insert after "Capacity (pcs/hr)"
+        table_headers.insert(5, "Total Cap.") # Insert after "Units Req."
+
+        units_required = df_machines["Calculated Units Required"].to_numpy(dtype="float64")
+        total_capacity = df_machines["Calculated Total Capacity"].to_numpy(dtype="float64")
+
+        units_req_str = np.full(n_rows, "-", dtype=object)
+        finite_units = np.isfinite(units_required)
+        units_req_str[finite_units] = units_required[finite_units].astype(np.int64).astype(str)
+        units_req_str[np.isinf(units_required)] = "N/A (Cap. 0)"
+
+        total_cap_str = np.full(n_rows, "-", dtype=object)
+        has_total = ~np.isnan(total_capacity)
+        total_cap_str[has_total] = total_capacity[has_total].astype(np.int64).astype(str)
+
+        columns["Units Req."] = units_req_str
+        columns["Total Cap."] = total_cap_str
+
+    if "Spec Distance" in df_machines.columns and (df_machines["Tier"] == 2).all():
+        # Nearest-spec ranking: how far each near-miss machine is from the request (0 = on spec)
+        table_headers.insert(table_headers.index("Key Features"), "Distance")
+        columns["Distance"] = np.char.mod("%.3f", df_machines["Spec Distance"].to_numpy(dtype="float64")).astype(object)
+
+    return pd.DataFrame(columns, columns=table_headers)
+
+
+# --- Vectorized Tiering Engine ---
+TIER2_NEAREST_K = 25 # Near-miss machines shown per stage in "nearest" ranking mode
+
+def nearest_rows(rows, distance, k, tiebreak):
+    # The k rows with the smallest distance by partial selection; ties at the cut go by tiebreak
+    if len(rows) <= k:
+        return rows
+    if k <= 0:
+        return rows[:0]
+    kth = np.partition(distance[rows], k - 1)[k - 1]
+    inside, at_cut = rows[distance[rows] < kth], rows[distance[rows] == kth]
+    return np.concatenate([inside, at_cut[np.argsort(tiebreak[at_cut], kind="stable")[:k - len(inside)]]])
+
+@timed("tier_stage_candidates")
+def tier_stage_candidates(candidates, stages, dough_weight=None, min_capacity=None, dough_fit_rows=None, feature_scores=None,
+                          stage_capacity=None, priority=None, tier2_k=None):
+    """
+    Computes units, total capacity, the dough/capacity fit masks and the tier for every
+    candidate row at once with NumPy, then sorts once by (stage, tier, company).
+    `dough_fit_rows` (catalog row positions, e.g. from DoughRangeIndex.covering) replaces the
+    dough range comparison when given.
+    `feature_scores` (FeatureIndex.scores, indexed by catalog row position) keeps only the
+    matching machines of stages where any machine matches and sorts by score before company.
+    `stage_capacity` (one target per stage, NaN = none) replaces min_capacity for composite lines.
+    `priority` (one value per candidate row) sorts higher values first within a tier, before feature score.
+    `tier2_k` keeps only the k tier-2 rows per stage nearest to the requested specs, nearest first,
+    with their "Spec Distance": grams outside the dough range per requested gram, plus 1 when a capacity
+    is requested and the machine's is unknown (any positive capacity meets it with enough units).
+    Equal distances go by the share of the target one unit falls short of, max(0, target - capacity) / target.
+    Returns {stage: (tier1_df, tier2_df)} for the stages in `stages` that have candidates.
+    """
+    stage_rank = pd.Index(stages).get_indexer(candidates["Stage"].astype(object)) # -1 = not part of this line
+    candidates = candidates[stage_rank >= 0]
+    priority = np.zeros(len(candidates)) if priority is None else np.asarray(priority, dtype="float64")[stage_rank >= 0]
+    stage_rank = stage_rank[stage_rank >= 0]
+
+    feature_score = np.zeros(len(candidates))
+    if feature_scores is not None:
+        feature_score = feature_scores[candidates.index.to_numpy()]
+        # Stages where no machine mentions the features (e.g. ovens for "stainless bowl") stay unfiltered
+        matched = feature_score > 0
+        stage_matched = np.bincount(stage_rank[matched], minlength=len(stages)) > 0
+        keep = matched | ~stage_matched[stage_rank]
+        candidates, stage_rank, feature_score, priority = candidates[keep], stage_rank[keep], feature_score[keep], priority[keep]
+    n_rows = len(candidates)
+    if not n_rows:
+        return {}
+
+    capacity = candidates["_Numeric_Production Capacity (pcs/hr)"].to_numpy(dtype="float64")
+    dough_min = candidates["_Numeric_Dough Min (g)"].to_numpy(dtype="float64")
+    dough_max = candidates["_Numeric_Dough Max (g)"].to_numpy(dtype="float64")
+
+    dough_fit = np.ones(n_rows, dtype=bool)
+    if dough_fit_rows is not None:
+        dough_fit = np.isin(candidates.index.to_numpy(), dough_fit_rows, assume_unique=True)
+    elif isinstance(dough_weight, (int, float)):
+        dough_fit = (np.isnan(dough_min) | (dough_min <= dough_weight)) & \
+                    (np.isnan(dough_max) | (dough_max >= dough_weight))
+
+    capacity_fit = np.ones(n_rows, dtype=bool)
+    units_required = np.full(n_rows, np.nan)
+    total_capacity = np.full(n_rows, np.nan)
+    target = None
+    if stage_capacity is not None:
+        target = np.asarray(stage_capacity, dtype="float64")[stage_rank]
+    elif isinstance(min_capacity, (int, float)):
+        target = np.full(n_rows, float(min_capacity))
+    if target is not None:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Missing or zero capacity -> no units (NaN); negative capacity -> inf units; no target -> NaN
+            units_required = np.where(capacity > 0, np.ceil(target / capacity), np.where(capacity < 0, np.inf, np.nan))
+            units_required[np.isnan(target)] = np.nan
+            total_capacity = np.where(np.isfinite(units_required), units_required * capacity, np.nan)
+        capacity_fit = np.isnan(target) | ((capacity > 0) & (np.nan_to_num(total_capacity, nan=0.0) >= target))
+
+    tier = np.where(dough_fit & capacity_fit, 1, 2)
+    company_rank = pd.factorize(column_strings(candidates["Company Name"]), sort=True)[0]
+
+    spec_distance = np.zeros(n_rows)
+    shortfall = np.zeros(n_rows)
+    keep = None
+    if tier2_k is not None:
+        if isinstance(dough_weight, (int, float)) and dough_weight > 0:
+            # fmax skips a missing (open-ended) bound, like the dough filter and DoughRangeIndex.nearest
+            dough_gap = np.fmax(np.fmax(dough_min - dough_weight, dough_weight - dough_max), 0.0)
+            spec_distance += dough_gap / dough_weight
+        if target is not None:
+            spec_distance += np.where(np.isnan(target) | (capacity > 0), 0.0, 1.0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # Unknown capacity falls short by the whole target; a machine with no target never does
+                shortfall = np.where(capacity > 0, np.maximum(target - capacity, 0.0) / target, 1.0)
+            shortfall[np.isnan(target) | ~(target > 0)] = 0.0
+        spec_distance[tier == 1] = 0.0 # Machines meeting all criteria are on spec
+        shortfall[tier == 1] = 0.0
+        keep = tier == 1
+        # Ties at the cut go by shortfall, then company, as in the sort below
+        tiebreak = np.empty(n_rows, dtype=np.int64)
+        tiebreak[np.lexsort((company_rank, shortfall))] = np.arange(n_rows)
+        for rank in np.unique(stage_rank[tier == 2]):
+            keep[nearest_rows(np.flatnonzero((tier == 2) & (stage_rank == rank)), spec_distance, tier2_k, tiebreak)] = True
+
+    # One stable sort orders every stage's tier1 and tier2 rows (nearest first, then company) at the same time
+    order = np.lexsort((company_rank, -feature_score, -priority, shortfall, spec_distance, tier, stage_rank))
+    if keep is not None:
+        # Dropped near-misses never reach the take() below
+        order = order[keep[order]]
+        n_rows = len(order)
+        if not n_rows:
+            return {}
+    calculated = {
+        "Calculated Units Required": units_required,
+        "Calculated Total Capacity": total_capacity,
+        "Tier": tier,
+    }
+    if tier2_k is not None:
+        calculated["Spec Distance"] = spec_distance.round(3)
+    if feature_scores is not None:
+        calculated["Feature Score"] = feature_score.round(3)
+    tiered = candidates.assign(**calculated).take(order)
+    stage_rank, tier = stage_rank[order], tier[order]
+
+    stage_results = {}
+    # Consecutive runs of equal stage_rank are one stage; tier splits each run in two
+    stage_starts = np.flatnonzero(np.r_[True, stage_rank[1:] != stage_rank[:-1]])
+    stage_ends = np.r_[stage_starts[1:], n_rows]
+    for start, end in zip(stage_starts, stage_ends):
+        split = start + np.searchsorted(tier[start:end], 2)
+        stage_results[stages[stage_rank[start]]] = (tiered.iloc[start:split], tiered.iloc[split:end])
+    return stage_results
+
+# --- Match Results ---
+# Machine fields exported by MatchResult.to_dict (JSON/CSV friendly, NaN -> None)
+MACHINE_RECORD_COLUMNS = {
+    "company": "Company Name",
+    "machine_name": "Machine Name",
+    "category": "Category",
+    "capacity_pcs_hr": "_Numeric_Production Capacity (pcs/hr)",
+    "dough_min_g": "_Numeric_Dough Min (g)",
+    "dough_max_g": "_Numeric_Dough Max (g)",
+    "units_required": "Calculated Units Required",
+    "total_capacity": "Calculated Total Capacity",
+    "key_features": "_Display Key Features",
+    "feature_score": "Feature Score",
+    "shared": "Shared Machine",
+    "spec_distance": "Spec Distance",
+    "source_file": "Source File",
+    "source_sheet": "Source Sheet",
+}
+
+def machine_records(df_machines):
+    records = []
+    # Provenance columns only exist for catalogs synced from a directory, Feature Score for feature queries
+    columns = [df_machines[col].tolist() if col in df_machines.columns else [None] * len(df_machines) for col in MACHINE_RECORD_COLUMNS.values()]
+    for values in zip(*columns):
+        record = {}
+        for key, value in zip(MACHINE_RECORD_COLUMNS, values):
+            if isinstance(value, float) and not np.isfinite(value):
+                value = None if np.isnan(value) else str(value)
+            record[key] = value
+        records.append(record)
+    return records
+
+@dataclass
+class StageResult:
+    stage: str
+    tier1: pd.DataFrame # Machines meeting all criteria, sorted by company
+    tier2: pd.DataFrame # Other relevant machines (numeric criteria not met or missing data)
+    feature_matched: bool = False # Machines here were narrowed to (and ranked by) the requested features
+
+@dataclass
+class MatchResult:
+    product: str
+    product_group: str
+    stages: list # Production line stages, in order
+    dough_weight: float = None
+    capacity: int = None
+    features: tuple = () # Feature query terms (stemmed), e.g. ("plc", "stainless", "steel")
+    tier2_k: int = None # Tier 2 holds only the k nearest-spec machines per stage when set
+    candidate_count: int = 0 # Catalog rows listing the product
+    stage_results: dict = field(default_factory=dict) # stage -> StageResult, only stages with machines
+    catalog_version: str = None
+    from_cache: bool = False
+
+    def to_dict(self):
+        return {
+            "product": self.product,
+            "product_group": self.product_group,
+            "dough_weight": self.dough_weight,
+            "capacity": self.capacity,
+            "features": list(self.features),
+            "tier2_k": self.tier2_k,
+            "catalog_version": self.catalog_version,
+            "candidate_count": self.candidate_count,
+            "from_cache": self.from_cache,
+            "stages": [
+                {
+                    "stage": stage,
+                    "tier1": machine_records(self.stage_results[stage].tier1) if stage in self.stage_results else [],
+                    "tier2": machine_records(self.stage_results[stage].tier2) if stage in self.stage_results else [],
+                    "feature_matched": stage in self.stage_results and self.stage_results[stage].feature_matched,
+                }
+                for stage in self.stages
+            ],
+        }
+
+@dataclass
+class CompositeStageResult(StageResult):
+    products: tuple = () # Requested products whose line includes this stage
+    combined_capacity: float = None # Sum of those products' capacities (pcs/hr), None if none given
+    units_required: float = None # Fewest units of any machine meeting all criteria
+    shared_count: int = 0 # Machines listed for every product in `products`
+
+@dataclass
+class CompositeMatchResult(MatchResult):
+    """A shared line for several products; `stages` is the union of their lines."""
+    products: tuple = () # ((product, capacity or None), ...) in request order
+    product_groups: dict = field(default_factory=dict) # product -> product group
+
+    def to_dict(self):
+        result = super().to_dict()
+        result["products"] = [
+            {"product": product, "capacity": capacity, "product_group": self.product_groups.get(product)}
+            for product, capacity in self.products
+        ]
+        for stage_dict in result["stages"]:
+            stage_result = self.stage_results.get(stage_dict["stage"])
+            stage_dict.update({
+                "products": list(stage_result.products) if stage_result else [],
+                "combined_capacity": stage_result.combined_capacity if stage_result else None,
+                "units_required": stage_result.units_required if stage_result else None,
+                "shared_count": stage_result.shared_count if stage_result else 0,
+            })
+        return result
+
+def merge_stage_lines(lines):
+    # Union of production lines that keeps each line's order: a new stage goes right after its predecessor
+    merged = []
+    for stages in lines:
+        previous = None
+        for stage in stages:
+            if stage not in merged:
+                merged.insert(merged.index(previous) + 1 if previous is not None else 0, stage)
+            previous = stage
+    return merged
+
+def membership_bits(product_rows, machine_rows):
+    """
+    Packed product x machine matrix: bit j of row i is set when machine_rows[j] lists the i-th
+    product. `product_rows` are sorted catalog rows per product, `machine_rows` sorted and unique.
+    """
+    membership = np.zeros((len(product_rows), len(machine_rows)), dtype=bool)
+    for i, rows in enumerate(product_rows):
+        if len(machine_rows) and len(rows):
+            positions = np.searchsorted(machine_rows, rows).clip(max=len(machine_rows) - 1)
+            membership[i, positions[machine_rows[positions] == rows]] = True
+    return np.packbits(membership, axis=1)
+
+# --- Line Configurator ---
+CONFIGURATOR_TOP_K = 5
+
+@dataclass
+class LineConfiguration:
+    total_units: int # Machine units across all stages
+    overshoot: float # Sum over stages of (stage capacity - target), pcs/hr
+    bottleneck_capacity: float # Lowest stage capacity, i.e. the line's output
+    bottleneck_stage: str
+    machines: list # One machine record per stage, with its "stage"
+
+@dataclass
+class LineConfigurationResult:
+    product: str
+    product_group: str
+    stages: list
+    capacity: float
+    dough_weight: float = None
+    features: tuple = ()
+    configurations: list = field(default_factory=list) # LineConfiguration, best first
+    uncovered_stages: list = field(default_factory=list) # Stages without any machine meeting all criteria
+    catalog_version: str = None
+
+    def to_dict(self):
+        return {
+            "product": self.product,
+            "product_group": self.product_group,
+            "stages": self.stages,
+            "capacity": self.capacity,
+            "dough_weight": self.dough_weight,
+            "features": list(self.features),
+            "uncovered_stages": self.uncovered_stages,
+            "catalog_version": self.catalog_version,
+            "configurations": [
+                {
+                    "rank": rank,
+                    "total_units": configuration.total_units,
+                    "overshoot": configuration.overshoot,
+                    "bottleneck_capacity": configuration.bottleneck_capacity,
+                    "bottleneck_stage": configuration.bottleneck_stage,
+                    "machines": configuration.machines,
+                }
+                for rank, configuration in enumerate(self.configurations, start=1)
+            ],
+        }
+
+def top_line_configurations(stage_options, k=CONFIGURATOR_TOP_K):
+    """
+    stage_options: [(units, overshoot)] arrays per stage, one entry per machine option.
+    Returns (choices, units, overshoot) for the k lines with the fewest total units, then the least
+    total overshoot; choices[i, s] is the option picked for stage s in the i-th best line.
+
+    Both costs add up across stages, so keeping the k best partial lines after each stage is exact
+    (k-best dynamic programming over the stages). Within a stage, an option with k better options
+    can never be part of a top-k line, so each stage is pruned to its k best options first.
+    """
+    choices = np.zeros((1, 0), dtype=np.int64)
+    units = np.zeros(1)
+    overshoot = np.zeros(1)
+    for stage_units, stage_overshoot in stage_options:
+        options = np.lexsort((stage_overshoot, stage_units))[:k]
+        line_units = (units[:, None] + stage_units[options]).ravel()
+        line_overshoot = (overshoot[:, None] + stage_overshoot[options]).ravel()
+        # lexsort is stable: ties keep the better partial line, then the better option
+        best = np.lexsort((line_overshoot, line_units))[:k]
+        partial, option = np.divmod(best, len(options))
+        choices = np.column_stack([choices[partial], options[option]])
+        units, overshoot = line_units[best], line_overshoot[best]
+    return choices, units, overshoot
+
+# --- Materialized Line Plans ---
+@dataclass
+class LinePlan:
+    """A product's production line with, per stage, its machines (catalog rows) sorted by company."""
+    product: str
+    product_group: str
+    stages: list
+    rows: np.ndarray # Line machines ordered by stage, then company, then row
+    stage_bounds: np.ndarray # rows[stage_bounds[i]:stage_bounds[i + 1]] belong to stages[i]
+    candidate_count: int # All rows listing the product, including stages outside its line
+
+    def stage_ranks(self):
+        return np.repeat(np.arange(len(self.stages)), np.diff(self.stage_bounds))
+
+class LinePlanner:
+    """
+    Builds LinePlans from a catalog's Stage and Company Name columns. Stage and company are
+    factorized once for the whole catalog, so each plan is a lookup plus one lexsort.
+    """
+    def __init__(self, df_catalog, product_index, line_for):
+        self.product_index = product_index
+        self.line_for = line_for
+        self.stage_codes, self.stage_names = pd.factorize(df_catalog["Stage"].to_numpy(dtype=object))
+        # sort=True: ranks order like the company names themselves
+        self.company_rank = pd.factorize(column_strings(df_catalog["Company Name"]), sort=True)[0]
+        self._machine_hashes = None
+        self._hash_order = None
+        self._df_catalog = df_catalog
+
+    @property
+    def machine_hashes(self):
+        # Content hash per row, stable across catalog versions; computed only for incremental rebuilds
+        if self._machine_hashes is None:
+            key_columns = [col for col in self._df_catalog.columns if not col.startswith("_") and col != "Stage" and col not in PROVENANCE_COLUMNS]
+            self._machine_hashes = pd.util.hash_pandas_object(self._df_catalog[key_columns], index=False).to_numpy()
+        return self._machine_hashes
+
+    def rows_for_hashes(self, hashes):
+        """Catalog rows with the given content hashes, or None if any hash is not in this catalog."""
+        if self._hash_order is None:
+            # Sorted once per planner; every remapped plan is then a searchsorted lookup
+            order = np.argsort(self.machine_hashes, kind="stable")
+            self._hash_order = (order, self.machine_hashes[order])
+        order, sorted_hashes = self._hash_order
+        if not len(order):
+            return None if len(hashes) else np.zeros(0, dtype=np.int64)
+        rows = order[np.searchsorted(sorted_hashes, hashes).clip(max=len(order) - 1)]
+        if (self.machine_hashes[rows] != hashes).any():
+            return None
+        return rows
+
+    def signature(self, product):
+        # Equal signatures = same group, stages and machines (by content), so the same plan
+        product_group, stages = self.line_for(product)
+        digest = hashlib.blake2b(json.dumps([product_group, stages]).encode("utf-8"), digest_size=16)
+        digest.update(np.sort(self.machine_hashes[self.product_index.rows_for(product)]).tobytes())
+        return digest.hexdigest()
+
+    def build(self, product):
+        product_group, stages = self.line_for(product)
+        rows = self.product_index.rows_for(product)
+        # Few distinct stages, so a dict beats building an Index per product
+        rank_of = {stage: i for i, stage in enumerate(stages)}
+        stage_rank = np.array([rank_of.get(name, -1) for name in self.stage_names], dtype=np.int64)[self.stage_codes[rows]]
+        on_line = stage_rank >= 0
+        line_rows, stage_rank = rows[on_line], stage_rank[on_line]
+        order = np.lexsort((line_rows, self.company_rank[line_rows], stage_rank))
+        stage_bounds = np.searchsorted(stage_rank[order], np.arange(len(stages) + 1))
+        return LinePlan(product, product_group, list(stages), line_rows[order], stage_bounds, len(rows))
+
+    def remap(self, plan, previous):
+        """
+        Moves a plan from the previous catalog version onto this one by machine content hash.
+        Returns None when the order no longer holds (e.g. rows were reordered within a company).
+        """
+        rows = self.rows_for_hashes(previous.machine_hashes[plan.rows])
+        if rows is None:
+            return None
+        # Must still be strictly increasing by (stage, company, row), the order build() produces
+        stage_rank, company_rank = plan.stage_ranks(), self.company_rank[rows]
+        increasing = (np.diff(stage_rank) > 0) | ((np.diff(stage_rank) == 0) & (
+            (np.diff(company_rank) > 0) | ((np.diff(company_rank) == 0) & (np.diff(rows) > 0))
+        ))
+        if not increasing.all():
+            return None
+        return replace(plan, rows=rows)
+
+def build_line_plans(planner, products, previous_plans=None, previous_planner=None):
+    """
+    Returns ({product: LinePlan}, rebuilt products). With the previous catalog version's plans and
+    planner, plans whose signature is unchanged are remapped instead of rebuilt.
+    """
+    plans, rebuilt = {}, []
+    for product in products:
+        plan = None
+        previous_plan = (previous_plans or {}).get(product)
+        if previous_plan is not None and previous_planner.signature(product) == planner.signature(product):
+            plan = planner.remap(previous_plan, previous_planner)
+        if plan is None:
+            plan = planner.build(product)
+            rebuilt.append(product)
+        plans[product] = plan
+    return plans, rebuilt
+
+# --- Matching Engine ---
+class MatchEngine:
+    """
+    Holds one catalog version in memory together with its product and dough indexes.
+    Build it with load_engine() (sync + load) or MatchEngine.from_snapshot().
+    Pass the engine of the previous catalog version as `previous` to rebuild only the line
+    plans of products whose machines changed.
+    """
+    def __init__(self, df_catalog, catalog_version=None, product_index=None, previous=None):
+        # df_catalog is the machine table; a row-per-product frame with a Products column also works
+        self.catalog = df_catalog
+        self.catalog_version = catalog_version
+        self.product_index = product_index or ProductIndex(df_catalog["Products"])
+        self.feature_index = FeatureIndex(df_catalog)
+        self.product_set = self.product_index.products()
+
+        self.product_to_group_mapping = dict(product_to_group_mapping)
+        for p in self.product_set:
+            if p not in self.product_to_group_mapping:
+                self.product_to_group_mapping[p] = "General Products"
+
+        # Built once per catalog version, like the other indexes
+        self.product_suggester = ProductSuggester(self.product_set)
+        with span("line_plans"):
+            self.line_planner = LinePlanner(df_catalog, self.product_index, self.line_for)
+            if previous is None:
+                self.line_plans, _ = build_line_plans(self.line_planner, self.product_set)
+            else:
+                self.line_plans, rebuilt = build_line_plans(
+                    self.line_planner, self.product_set, previous.line_plans, previous.line_planner
+                )
+                print(f"♻️ Line plans: {len(self.product_set) - len(rebuilt)} reused, {len(rebuilt)} rebuilt")
+        # Grouped by stage and known capacity, so nearest_candidate_rows can ask for one stage's misses
+        capacity_known = df_catalog["_Numeric_Production Capacity (pcs/hr)"].to_numpy() > 0
+        self.dough_indexes = build_dough_indexes(df_catalog, self.product_index, self.line_planner.stage_codes * 2 + capacity_known)
+
+        # Bounded LRU per catalog version, so a new catalog never reuses old parses
+        self._parse_cached = lru_cache(maxsize=PARSE_CACHE_MAX_ENTRIES)(self._parse_batched)
+        self._parse_products_cached = lru_cache(maxsize=PARSE_CACHE_MAX_ENTRIES)(self._parse_products)
+
+    @classmethod
+    def from_snapshot(cls, snapshot_path=SNAPSHOT_FILE, catalog_version=None, previous=None):
+        with span("catalog_load"):
+            df_catalog, product_index = open_catalog_snapshot(snapshot_path)
+            # Adding columns leaves the memory-mapped columns untouched
+            df_catalog["Stage"] = resolve_category_stages(df_catalog["Category"])
+        if catalog_version is None:
+            catalog_version = df_catalog.attrs.get("catalog_version")
+        return cls(df_catalog, catalog_version, product_index, previous)
+
+    # --- Parsing ---
+    def parse_input(self, prompt_text, mode=PARSER_MODE):
+        with span("parse_input", mode=mode):
+            if mode == "batched":
+                return self._parse_cached(prompt_text.lower())
+            return self._parse_prompt(prompt_text.lower(), best_product_match_scan)
+
+    def _parse_batched(self, prompt_text):
+        return self._parse_prompt(prompt_text, best_product_match_batched)
+
+    def _parse_prompt(self, prompt_text, best_product_match):
+        capacity_match = CAPACITY_PATTERN.search(prompt_text)
+        capacity = int(capacity_match.group(1)) if capacity_match else None
+
+        dough_match = DOUGH_WEIGHT_PATTERN.search(prompt_text)
+        dough_weight = float(dough_match.group(3)) if dough_match else None
+
+        best_match, best_score = best_product_match(extract_product_candidates(prompt_text), self.product_set)
+        product = best_match if best_score >= PRODUCT_MATCH_THRESHOLD else None
+
+        return product, dough_weight, capacity
+
+    def parse_products(self, prompt_text):
+        """
+        Returns ((product, capacity or None), ...) for every product named in the prompt, each with
+        the capacity from its own part of the prompt ("5000 buns and 2000 bread loaves"). A capacity
+        in a part without a product ("buns and bread loaves, 5000 pcs per hour") applies to every
+        product that has none of its own.
+        """
+        with span("parse_products"):
+            return self._parse_products_cached(prompt_text.lower())[0]
+
+    def unresolved_products(self, prompt_text):
+        # Parts of the prompt that name something, but no product in the catalog ("sourdough bread")
+        with span("parse_products"):
+            return self._parse_products_cached(prompt_text.lower())[1]
+
+    def _parse_products(self, prompt_text):
+        line_products, unresolved, line_capacity = {}, [], None
+        for segment in split_product_segments(prompt_text):
+            if is_spec_segment(segment):
+                if line_capacity is None:
+                    line_capacity = segment_capacity(segment)
+                continue
+            best_match, best_score = best_product_match_batched(extract_product_candidates(segment), self.product_set)
+            if best_score < PRODUCT_MATCH_THRESHOLD:
+                unresolved.append(segment)
+            elif best_match not in line_products:
+                line_products[best_match] = segment_capacity(segment)
+        if line_capacity is not None:
+            line_products = {product: line_capacity if capacity is None else capacity for product, capacity in line_products.items()}
+        return tuple(line_products.items()), tuple(unresolved)
+
+    def parse_features(self, prompt_text):
+        # Feature terms from the prompt's "with ..." clauses that occur in the catalog
+        return tuple(self.feature_index.known_terms(extract_feature_terms(prompt_text.lower())))
+
+    def suggest_products(self, query, k=10):
+        # Autocomplete for the product picker: top-k typo-tolerant matches over products and aliases
+        with span("product_suggest"):
+            return self.product_suggester.suggest(query, k)
+
+    def resolve_inputs(self, prompt, selected_product, dough_weight_input, capacity_input, features_input=""):
+        """
+        Turns the app's inputs (prompt, or product + numeric text fields, plus optional feature
+        text) into (product, dough_weight, capacity, features). Raises MatchInputError for invalid input.
+        """
+        product, dough_weight, min_capacity = None, None, None
+        features = feature_query_terms(features_input or "")
+
+        # Determine input source
+        if prompt and prompt.strip():
+            product, dough_weight, min_capacity = self.parse_input(prompt)
+            features = tuple(sorted(set(features) | set(self.parse_features(prompt))))
+        else:
+            product = normalize_product(selected_product) if selected_product else None
+            try:
+                dough_weight = None if dough_weight_input in ("", "-", None) else float(dough_weight_input)
+            except ValueError:
+                raise MatchInputError("Invalid Dough Weight. Please enter a number or '-'") from None
+            try:
+                min_capacity = None if capacity_input in ("", "-", None) else int(capacity_input)
+            except ValueError:
+                raise MatchInputError("Invalid Capacity. Please enter a whole number or '-'") from None
+
+        if not product:
+            raise MatchInputError("❌ Couldn't identify a valid product from your input or selection. Please refine your input.")
+        return product, dough_weight, min_capacity, features
+
+    def resolve_line_products(self, prompt, product, capacity, shared_products_input=""):
+        """
+        Products of the requested line as ((product, capacity), ...): from the prompt when it names
+        several products, else the resolved product plus any in `shared_products_input`
+        (e.g. "bread loaf 2000, rusk 1500"). One entry means a plain single-product match.
+        Parts naming no known product are left out (see unresolved_products).
+        """
+        if prompt and prompt.strip():
+            if len(split_product_segments(prompt.lower())) < 2:
+                return ((product, capacity),)
+            # Only a prompt naming two products is a shared line; "a bun line, fully automatic" is not
+            line_products = self.parse_products(prompt)
+            return line_products if len(line_products) > 1 else ((product, capacity),)
+        line_products = {product: capacity}
+        for shared_product, shared_capacity in self.parse_products(shared_products_input or ""):
+            line_products.setdefault(shared_product, shared_capacity)
+        return tuple(line_products.items())
+
+    # --- Matching ---
+    def line_for(self, product):
+        product_group = self.product_to_group_mapping.get(product, "General Products")
+        return product_group, group_wise_production_lines.get(product_group, ["General Processing"])
+
+    def match(self, product, dough_weight=None, capacity=None, features=(), use_cache=True, tier2_k=None):
+        product = normalize_product(product)
+        features = tuple(sorted(set(features)))
+        cache_key = (product, dough_weight, capacity, features, tier2_k) # 50 == 50.0 hash alike, so int/float inputs share entries
+        if use_cache:
+            with span("result_cache_lookup"):
+                cached = result_cache.get(cache_key, self.catalog_version)
+            if cached is not None:
+                return replace(cached, from_cache=True)
+
+        with span("match"):
+            result = self._match(product, dough_weight, capacity, features, tier2_k)
+        if use_cache:
+            result_cache.put(cache_key, self.catalog_version, result)
+        return result
+
+    def _match(self, product, dough_weight, capacity, features=(), tier2_k=None):
+        product_group, production_line_stages = self.line_for(product)
+        result = MatchResult(
+            product=product, product_group=product_group, stages=production_line_stages,
+            dough_weight=dough_weight, capacity=capacity, features=features, tier2_k=tier2_k, catalog_version=self.catalog_version,
+        )
+
+        plan = self.line_plans.get(product)
+        if plan is None:
+            return result
+        result.candidate_count = plan.candidate_count
+        if not isinstance(dough_weight, (int, float)) and not isinstance(capacity, (int, float)) and not features:
+            # Product-only query: every line machine is tier 1, already in stage/company order
+            with span("line_plan_lookup"):
+                planned = self.catalog.take(plan.rows).assign(**{
+                    "Calculated Units Required": np.nan, "Calculated Total Capacity": np.nan, "Tier": 1,
+                })
+                for stage, start, end in zip(plan.stages, plan.stage_bounds[:-1], plan.stage_bounds[1:]):
+                    if end > start:
+                        result.stage_results[stage] = StageResult(stage, planned.iloc[start:end], planned.iloc[end:end])
+            return result
+
+        dough_fit_rows = None
+        if isinstance(dough_weight, (int, float)) and product in self.dough_indexes:
+            dough_fit_rows = self.dough_indexes[product].covering(dough_weight)
+
+        feature_scores = None
+        if features:
+            with span("feature_lookup"):
+                feature_scores = self.feature_index.scores(features)
+
+        with span("product_filter"):
+            rows = self.nearest_candidate_rows(product, production_line_stages, dough_weight, capacity, dough_fit_rows, features, tier2_k)
+            eligible_df_product_filtered = self.catalog.take(plan.rows if rows is None else rows)
+        if eligible_df_product_filtered.empty:
+            return result
+
+        # Every stage is tiered in a single vectorized pass over the product's rows
+
+        stage_tiers = tier_stage_candidates(
+            eligible_df_product_filtered, production_line_stages, dough_weight, capacity, dough_fit_rows, feature_scores, tier2_k=tier2_k
+        )
+        for stage, (tier1, tier2) in stage_tiers.items():
+            feature_matched = bool(features) and bool((tier1["Feature Score"] > 0).any() or (tier2["Feature Score"] > 0).any())
+            result.stage_results[stage] = StageResult(stage, tier1, tier2, feature_matched)
+        return result
+
+    def nearest_candidate_rows(self, product, stages, dough_weight, capacity, dough_fit_rows, features=(), tier2_k=None):
+        """
+        Catalog rows of the product on `stages` that can make the nearest-k tiers: every machine
+        accepting the dough weight, plus each stage's k nearest misses from the DoughRangeIndex.
+        Misses with and without a known capacity are looked up separately, since the latter are one
+        unit of spec distance further out. None when the whole line must be tiered: no tier-2 cut,
+        no dough weight to measure misses by, or a feature filter that may drop near misses.
+        """
+        if tier2_k is None or features or dough_fit_rows is None or not dough_weight > 0:
+            return None
+        planner = self.line_planner
+        code_of = {name: code for code, name in enumerate(planner.stage_names)}
+        stage_codes = [code_of[stage] for stage in stages if stage in code_of]
+        on_stages = np.zeros(len(planner.stage_names) + 1, dtype=bool) # Last slot: code -1 (no stage)
+        on_stages[stage_codes] = True
+        parts = [dough_fit_rows[on_stages[planner.stage_codes[dough_fit_rows]]]]
+        # Index groups are stage code * 2 + known capacity; without a capacity target both count alike
+        classes = [(0,), (1,)] if isinstance(capacity, (int, float)) else [(0, 1)]
+        for code in stage_codes:
+            for known in classes:
+                parts.append(self.dough_indexes[product].nearest(dough_weight, tier2_k, [code * 2 + c for c in known])[0])
+        # Misses never cover the weight and each sits in one group, so the parts are disjoint
+        return np.sort(np.concatenate(parts), kind="stable")
+
+    def iter_match(self, product, dough_weight=None, capacity=None, features=(), use_cache=True, tier2_k=None):
+        """
+        Streaming match(): yields the MatchResult first (stage_results still empty), then
+        (stage, StageResult or None) for every line stage in order. Each stage is tiered from its own
+        slice of the product's line plan when it is reached, so the first stage is ready without
+        waiting for the rest. The result fills up as stages are yielded and is cached once complete.
+        """
+        product = normalize_product(product)
+        features = tuple(sorted(set(features)))
+        cache_key = (product, dough_weight, capacity, features, tier2_k) # Same entries as match()
+        cached = None
+        if use_cache:
+            with span("result_cache_lookup"):
+                cached = result_cache.get(cache_key, self.catalog_version)
+        if cached is not None:
+            yield replace(cached, from_cache=True)
+            for stage in cached.stages:
+                yield stage, cached.stage_results.get(stage)
+            return
+
+        product_group, production_line_stages = self.line_for(product)
+        result = MatchResult(
+            product=product, product_group=product_group, stages=production_line_stages,
+            dough_weight=dough_weight, capacity=capacity, features=features, tier2_k=tier2_k, catalog_version=self.catalog_version,
+        )
+        plan = self.line_plans.get(product)
+        if plan is not None:
+            result.candidate_count = plan.candidate_count
+        yield result
+
+        dough_fit_rows = None
+        if isinstance(dough_weight, (int, float)) and product in self.dough_indexes:
+            dough_fit_rows = self.dough_indexes[product].covering(dough_weight)
+        feature_scores = None
+        if features:
+            with span("feature_lookup"):
+                feature_scores = self.feature_index.scores(features)
+
+        product_only = not isinstance(dough_weight, (int, float)) and not isinstance(capacity, (int, float)) and not features
+        bounds = dict(zip(plan.stages, zip(plan.stage_bounds[:-1], plan.stage_bounds[1:]))) if plan is not None else {}
+        for stage in production_line_stages:
+            start, end = bounds.get(stage, (0, 0))
+            stage_result = None
+            if end > start and product_only:
+                # Same rows and columns as the line-plan fast path in _match()
+                planned = self.catalog.take(plan.rows[start:end]).assign(**{
+                    "Calculated Units Required": np.nan, "Calculated Total Capacity": np.nan, "Tier": 1,
+                })
+                stage_result = result.stage_results[stage] = StageResult(stage, planned, planned.iloc[0:0])
+            elif end > start:
+                with span("stage_match", stage=stage):
+                    rows = self.nearest_candidate_rows(product, [stage], dough_weight, capacity, dough_fit_rows, features, tier2_k)
+                    stage_tiers = tier_stage_candidates(
+                        self.catalog.take(plan.rows[start:end] if rows is None else rows), [stage], dough_weight, capacity, dough_fit_rows,
+                        feature_scores, tier2_k=tier2_k
+                    )
+                if stage in stage_tiers:
+                    tier1, tier2 = stage_tiers[stage]
+                    feature_matched = bool(features) and bool((tier1["Feature Score"] > 0).any() or (tier2["Feature Score"] > 0).any())
+                    stage_result = result.stage_results[stage] = StageResult(stage, tier1, tier2, feature_matched)
+            yield stage, stage_result
+        if use_cache:
+            result_cache.put(cache_key, self.catalog_version, result)
+
+    def match_from_inputs(self, prompt, selected_product, dough_weight_input, capacity_input, features_input="", shared_products_input="",
+                          tier2_k=None):
+        product, dough_weight, capacity, features = self.resolve_inputs(
+            prompt, selected_product, dough_weight_input, capacity_input, features_input
+        )
+        line_products = self.resolve_line_products(prompt, product, capacity, shared_products_input)
+        if len(line_products) > 1:
+            return self.match_composite(line_products, dough_weight, features, tier2_k=tier2_k)
+        return self.match(product, dough_weight, capacity, features, tier2_k=tier2_k)
+
+    # --- Composite (shared) Lines ---
+    def match_composite(self, line_products, dough_weight=None, features=(), use_cache=True, tier2_k=None):
+        """
+        Matches one shared line for several products: line_products is ((product, capacity), ...).
+        The union of their lines is tiered in a single pass, each stage against the combined
+        capacity of the products that need it.
+        """
+        deduplicated = {}
+        for product, capacity in line_products:
+            deduplicated.setdefault(normalize_product(product), capacity)
+        line_products = tuple(deduplicated.items())
+        features = tuple(sorted(set(features)))
+        cache_key = ("composite", line_products, dough_weight, features, tier2_k)
+        if use_cache:
+            with span("result_cache_lookup"):
+                cached = result_cache.get(cache_key, self.catalog_version)
+            if cached is not None:
+                return replace(cached, from_cache=True)
+
+        with span("match_composite"):
+            result = self._match_composite(line_products, dough_weight, features, tier2_k)
+        if use_cache:
+            result_cache.put(cache_key, self.catalog_version, result)
+        return result
+
+    def _match_composite(self, line_products, dough_weight, features=(), tier2_k=None):
+        products = [product for product, _ in line_products]
+        lines = {product: self.line_for(product) for product in products}
+        stages = merge_stage_lines([line for _, line in lines.values()])
+        result = CompositeMatchResult(
+            product=" + ".join(products), product_group=" + ".join(dict.fromkeys(group for group, _ in lines.values())),
+            stages=stages, dough_weight=dough_weight, features=features, tier2_k=tier2_k, catalog_version=self.catalog_version,
+            products=line_products, product_groups={product: group for product, (group, _) in lines.items()},
+        )
+
+        product_rows = [self.product_index.rows_for(product) for product in products]
+        result.candidate_count = len(np.unique(np.concatenate(product_rows)))
+        # Line plans already hold each product's machines on its own line; their union is every candidate
+        plan_rows = [self.line_plans[product].rows for product in products if product in self.line_plans]
+        machine_rows = np.unique(np.concatenate(plan_rows)) if plan_rows else np.empty(0, dtype=np.int64)
+        if not len(machine_rows):
+            return result
+
+        # needs[i, j]: product i's line includes stage j; each stage's target is the sum of those capacities
+        needs = np.array([[stage in lines[product][1] for stage in stages] for product in products])
+        capacities = np.array([np.nan if capacity is None else capacity for _, capacity in line_products], dtype="float64")
+        given = needs & ~np.isnan(capacities)[:, None]
+        stage_capacity = np.where(given.any(axis=0), np.where(given, capacities[:, None], 0.0).sum(axis=0), np.nan)
+
+        feature_scores = None
+        if features:
+            with span("feature_lookup"):
+                feature_scores = self.feature_index.scores(features)
+
+        candidates = self.catalog.take(machine_rows)
+        with span("shared_machines"):
+            # Each machine sits in one stage: shared = listed for every product that needs its stage
+            bits = membership_bits(product_rows, machine_rows)
+            rank_of = {stage: j for j, stage in enumerate(stages)}
+            planner = self.line_planner
+            stage_rank = np.array([rank_of.get(name, -1) for name in planner.stage_names], dtype=np.int64)[planner.stage_codes[machine_rows]]
+            shared = np.zeros(len(machine_rows), dtype=bool)
+            for j in np.flatnonzero(needs.sum(axis=0) > 1):
+                in_stage = stage_rank == j
+                shared[in_stage] = np.unpackbits(np.bitwise_and.reduce(bits[needs[:, j]], axis=0), count=len(machine_rows)).astype(bool)[in_stage]
+
+        # Shared machines sort first within each tier
+        stage_tiers = tier_stage_candidates(
+            candidates.assign(**{"Shared Machine": shared}), stages, dough_weight, None, None, feature_scores, stage_capacity, shared, tier2_k
+        )
+        for stage, (tier1, tier2) in stage_tiers.items():
+            j = rank_of[stage]
+            units = tier1["Calculated Units Required"].to_numpy(dtype="float64")
+            units = units[np.isfinite(units)]
+            result.stage_results[stage] = CompositeStageResult(
+                stage, tier1, tier2,
+                feature_matched=bool(features) and bool((tier1["Feature Score"] > 0).any() or (tier2["Feature Score"] > 0).any()),
+                products=tuple(product for product, need in zip(products, needs[:, j]) if need),
+                combined_capacity=None if np.isnan(stage_capacity[j]) else float(stage_capacity[j]),
+                units_required=float(units.min()) if len(units) else None,
+                shared_count=int(tier1["Shared Machine"].sum() + tier2["Shared Machine"].sum()),
+            )
+        return result
+
+    # --- Line Configurator ---
+    def configure_line(self, product, capacity, dough_weight=None, features=(), k=CONFIGURATOR_TOP_K):
+        """
+        Picks one machine per stage (from the stage's machines meeting all criteria) and returns the
+        top-k lines by fewest total units, then least capacity overshoot over the target.
+        """
+        if not isinstance(capacity, (int, float)) or capacity <= 0:
+            raise ValueError("A positive target capacity (pcs/hr) is needed to configure a line.")
+        match = self.match(product, dough_weight, capacity, features)
+        result = LineConfigurationResult(
+            product=match.product, product_group=match.product_group, stages=match.stages, capacity=capacity,
+            dough_weight=dough_weight, features=match.features, catalog_version=self.catalog_version,
+        )
+
+        stage_frames, stage_options = [], []
+        for stage in match.stages:
+            tier1 = match.stage_results[stage].tier1 if stage in match.stage_results else None
+            units = tier1["Calculated Units Required"].to_numpy(dtype="float64") if tier1 is not None else np.empty(0)
+            if not np.isfinite(units).any():
+                result.uncovered_stages.append(stage)
+                continue
+            tier1 = tier1[np.isfinite(units)]
+            total_capacity = tier1["Calculated Total Capacity"].to_numpy(dtype="float64")
+            stage_frames.append((stage, tier1))
+            stage_options.append((tier1["Calculated Units Required"].to_numpy(dtype="float64"), total_capacity - capacity))
+        if not stage_frames:
+            return result
+
+        with span("configure_line"):
+            choices, units, overshoot = top_line_configurations(stage_options, max(int(k), 1))
+        # Records for every chosen machine come from one catalog take, not one slice per stage
+        chosen = [np.unique(stage_choices) for stage_choices in choices.T]
+        calculated = {}
+        for column in ("Calculated Units Required", "Calculated Total Capacity", "Feature Score"):
+            if column in stage_frames[0][1].columns:
+                calculated[column] = np.concatenate([frame[column].to_numpy()[options] for (_, frame), options in zip(stage_frames, chosen)])
+        rows = np.concatenate([frame.index.to_numpy()[options] for (_, frame), options in zip(stage_frames, chosen)])
+        records = iter(machine_records(self.catalog.take(rows).assign(**calculated)))
+        stage_records = [
+            {option: {"stage": stage, **next(records)} for option in options} for (stage, _), options in zip(stage_frames, chosen)
+        ]
+        for line_choices, line_units, line_overshoot in zip(choices, units, overshoot):
+            machines = [dict(records_by_option[option]) for records_by_option, option in zip(stage_records, line_choices)]
+            bottleneck = min(machines, key=lambda machine: machine["total_capacity"])
+            result.configurations.append(LineConfiguration(
+                total_units=int(line_units), overshoot=float(line_overshoot),
+                bottleneck_capacity=bottleneck["total_capacity"], bottleneck_stage=bottleneck["stage"], machines=machines,
+            ))
+        return result
+
+    # --- Capacity What-If Sweep ---
+    def sweep_capacity(self, product, capacities, dough_weight=None):
+        """
+        Computes Units Required and Total Capacity for every (capacity target, machine) pair of the
+        product's production line in one broadcast (targets x machines).
+        Returns a tidy frame sorted by target, stage order and company, ready for charting.
+        """
+        product = normalize_product(product)
+        targets = np.unique(np.asarray(list(capacities), dtype="float64"))
+        if targets.size == 0 or np.any(targets <= 0):
+            raise ValueError("Capacities must be a non-empty list of positive numbers.")
+
+        _, production_line_stages = self.line_for(product)
+        plan = self.line_plans.get(product)
+        # Plan rows are already in stage order, then company
+        rows = plan.rows if plan is not None else np.empty(0, dtype=np.int64)
+        stage_rank = plan.stage_ranks() if plan is not None else np.empty(0, dtype=np.int64)
+        candidates = self.catalog.take(rows)
+
+        capacity = candidates["_Numeric_Production Capacity (pcs/hr)"].to_numpy(dtype="float64")
+        dough_fit = np.ones(len(candidates), dtype=bool)
+        if isinstance(dough_weight, (int, float)) and product in self.dough_indexes:
+            dough_fit = np.isin(candidates.index.to_numpy(), self.dough_indexes[product].covering(dough_weight))
+
+        # Same rules as tier_stage_candidates, broadcast over all targets at once
+        target_grid = targets[:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            units_required = np.where(capacity > 0, np.ceil(target_grid / capacity), np.where(capacity < 0, np.inf, np.nan))
+            total_capacity = np.where(np.isfinite(units_required), units_required * capacity, np.nan)
+        capacity_fit = (capacity > 0) & (np.nan_to_num(total_capacity, nan=0.0) >= target_grid)
+        tier = np.where(dough_fit & capacity_fit, 1, 2)
+
+        n_targets = len(targets)
+        return pd.DataFrame({
+            "Capacity Target (pcs/hr)": np.repeat(targets, len(candidates)),
+            "Stage": np.tile(np.asarray(production_line_stages, dtype=object)[stage_rank], n_targets),
+            "Company Name": np.tile(column_strings(candidates["Company Name"]), n_targets),
+            "Machine Name": np.tile(column_strings(candidates["Machine Name"]), n_targets),
+            "Production Capacity (pcs/hr)": np.tile(capacity, n_targets),
+            "Units Required": units_required.ravel(),
+            "Total Capacity": total_capacity.ravel(),
+            "Dough Fit": np.tile(dough_fit, n_targets),
+            "Tier": tier.ravel(),
+        })
+
+def summarize_capacity_sweep(sweep_df):
+    # Fewest units of any machine meeting all criteria, per target and stage (one column per stage)
+    tier1 = sweep_df[sweep_df["Tier"] == 1]
+    stage_order = list(dict.fromkeys(sweep_df["Stage"]))
+    summary = tier1.pivot_table(
+        index="Capacity Target (pcs/hr)", columns="Stage", values="Units Required", aggfunc="min"
+    )
+    return summary.reindex(columns=[stage for stage in stage_order if stage in summary.columns])
+
+# --- Data Sync and Loading ---
+def load_engine(excel_file_path=None, csv_file_path=CSV_FILE, snapshot_path=SNAPSHOT_FILE):
+    # Syncs only if the workbook (or catalog directory) changed, then memory-maps the snapshot
+    excel_file_path = excel_file_path or catalog_source()
+    catalog_version = sync_catalog_if_changed(excel_file_path, csv_file_path, snapshot_path)
+    return MatchEngine.from_snapshot(snapshot_path, catalog_version)
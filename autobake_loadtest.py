@@ -0,0 +1,129 @@
+"""
+Load test for autobake_service.py (stdlib only).
+
+Opens `--concurrency` keep-alive connections, sends a mix of /match and /parse requests and
+reports throughput and latency percentiles.
+
+    python autobake_service.py --port 8600 &
+    python autobake_loadtest.py --port 8600 --concurrency 32 --requests 5000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+QUERY_MIX = [
+    ("/match", {"prompt": "I need a line for 5000 buns per hour with 50g dough weight"}),
+    ("/match", {"product": "bun", "dough_weight": 50, "capacity": 5000}),
+    ("/match", {"product": "bread loaf", "dough_weight": 500, "capacity": 2000}),
+    ("/match", {"product": "donut", "dough_weight": 40}),
+    ("/match", {"product": "cup cake", "capacity": 3000}),
+    ("/match", {"product": "croissant", "dough_weight": 60, "capacity": 12000}),
+    ("/match", {"product": "ladi pav"}),
+    ("/parse", {"prompt": "croissants 80 grams 4000 pcs per hour"}),
+    ("/parse", {"prompt": "we want to produce rusk and toast, 10000 pieces"}),
+]
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return float("nan")
+    rank = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by server")
+    status = int(status_line.split()[1])
+    content_length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            content_length = int(value)
+    await reader.readexactly(content_length)
+    return status
+
+async def client(host, port, queue, latencies, statuses, unique_queries):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            path, payload = random.choice(QUERY_MIX)
+            if unique_queries:
+                # Defeat coalescing/caching by making every capacity distinct
+                payload = {**payload, "capacity": random.randint(1000, 50000)} if path == "/match" else payload
+            body = json.dumps(payload).encode("utf-8")
+            request = (
+                f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n"
+            ).encode("latin-1") + body
+
+            started = time.perf_counter()
+            try:
+                writer.write(request)
+                await writer.drain()
+                status = await read_response(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                statuses["connection error"] += 1
+                reader, writer = await asyncio.open_connection(host, port)
+                continue
+            latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+    finally:
+        writer.close()
+
+async def run_load_test(host, port, concurrency, total_requests, unique_queries):
+    queue = asyncio.Queue()
+    for _ in range(total_requests):
+        queue.put_nowait(None)
+    latencies, statuses = [], Counter()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        client(host, port, queue, latencies, statuses, unique_queries) for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+        "status_counts": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the Autobake matching service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent keep-alive connections")
+    parser.add_argument("--requests", type=int, default=2000, help="Total requests to send")
+    parser.add_argument("--unique", action="store_true", help="Randomize capacities so identical-query coalescing rarely applies")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_load_test(args.host, args.port, args.concurrency, args.requests, args.unique))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"Requests:    {report['requests']} over {report['elapsed_s']} s ({report['concurrency']} connections)")
+    print(f"Throughput:  {report['throughput_rps']} req/s")
+    print(f"Latency:     p50 {report['p50_ms']} ms | p90 {report['p90_ms']} ms | p99 {report['p99_ms']} ms | max {report['max_ms']} ms")
+    print(f"Statuses:    {report['status_counts']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Lightweight timing spans for the Autobake hot paths (stdlib only).
+
+Wrap code in `span("name")` (or decorate a function with `@timed("name")`) and every duration
+is added to a per-process histogram. Histograms export as Prometheus text or JSON, and
+`profile_call` captures a cProfile (or pyinstrument, if installed) report for a single call.
+
+    with span("tier_stage", stage="Mixing"):
+        ...
+    print(metrics.to_prometheus())
+"""
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:  # Optional; cProfile is always available
+    PyinstrumentProfiler = None
+
+METRIC_PREFIX = "autobake"
+# Upper bounds in seconds; spans range from microsecond lookups to multi-second Excel syncs
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        slot = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                slot = i
+                break
+        self.counts[slot] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation (capped at the observed max)
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum_s": round(self.total, 6),
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else None,
+            "p50_ms": round(self.quantile(0.5) * 1000, 3) if self.count else None,
+            "p95_ms": round(self.quantile(0.95) * 1000, 3) if self.count else None,
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+class MetricsRegistry:
+    """Thread-safe map of (span name, labels) -> Histogram."""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.enabled = True
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, labels=()):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self):
+        # [(name, labels dict, summary)] sorted by name, for tables and JSON
+        with self._lock:
+            items = sorted(self._histograms.items(), key=lambda item: (item[0][0], item[0][1]))
+            return [(name, dict(labels), histogram.summary()) for (name, labels), histogram in items]
+
+    def to_json(self, indent=None):
+        return json.dumps(
+            [{"span": name, "labels": labels, **summary} for name, labels, summary in self.snapshot()],
+            indent=indent,
+        )
+
+    def to_prometheus(self):
+        metric = f"{METRIC_PREFIX}_span_seconds"
+        lines = [f"# HELP {metric} Duration of instrumented Autobake code paths.", f"# TYPE {metric} histogram"]
+        with self._lock:
+            items = sorted(self._histograms.items(), key=lambda item: (item[0][0], item[0][1]))
+            for (name, labels), histogram in items:
+                label_text = ",".join([f'span="{_escape_label(name)}"'] + [f'{k}="{_escape_label(v)}"' for k, v in labels])
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'{metric}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label_text},le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum{{{label_text}}} {histogram.total:.6f}")
+                lines.append(f"{metric}_count{{{label_text}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# One registry per process, shared by the app, the batch workers and the service
+metrics = MetricsRegistry()
+
+@contextmanager
+def span(name, **labels):
+    if not metrics.enabled:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(name, time.perf_counter() - started, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+def timed(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- Single-request profiling ---
+PROFILE_LINES = 40
+
+def profile_call(func, *args, profiler="cprofile", **kwargs):
+    """
+    Runs func(*args, **kwargs) under a profiler and returns (result, report text).
+    profiler="pyinstrument" uses pyinstrument when installed and falls back to cProfile.
+    Exceptions propagate; the report is discarded in that case.
+    """
+    if profiler == "pyinstrument" and PyinstrumentProfiler is not None:
+        profiler_instance = PyinstrumentProfiler()
+        profiler_instance.start()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            profiler_instance.stop()
+        return result, profiler_instance.output_text(unicode=True, color=False)
+
+    profiler_instance = cProfile.Profile()
+    result = profiler_instance.runcall(func, *args, **kwargs)
+    report = io.StringIO()
+    stats = pstats.Stats(profiler_instance, stream=report)
+    stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+    return result, report.getvalue()
@@ -0,0 +1,266 @@
+"""
+Local HTTP/JSON matching service (stdlib asyncio, no web framework).
+
+Keeps one preloaded MatchEngine in memory and runs CPU-bound parsing/matching in a bounded
+thread pool. Identical queries that arrive while one is already running share its result.
+
+    python autobake_service.py --port 8600 --workers 4
+
+Endpoints (JSON in, JSON out):
+    GET  /health                              catalog version, service and result cache counters
+    GET  /metrics[?format=json]               span latency histograms (Prometheus text by default)
+    GET  /products                            product choices
+    GET  /suggest?q=crosant[&k=10]            typo-tolerant product autocomplete
+    GET  /stages[?product=bun]                all production lines, or one product's line
+    POST /parse   {"prompt": "..."}           -> product, dough_weight, capacity, features, products
+    POST /match   {"prompt": "..."} or {"product": "bun", "dough_weight": 50, "capacity": 5000, "features": "stainless steel"}
+                  "shared_products": "bread loaf 2000" (or a prompt naming several products) -> one shared line
+                  "tier2_k": 25 -> only the 25 near-miss machines per stage closest to the specs
+    GET  /match?product=bun&dough_weight=50&capacity=5000
+    POST /configure {"product": "bun", "capacity": 5000, "dough_weight": 50, "k": 5}  -> top-k balanced lines
+"""
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+from autobake_engine import (
+    CONFIGURATOR_TOP_K, CSV_FILE, SNAPSHOT_FILE, MatchEngine, MatchInputError, catalog_source, feature_query_terms,
+    group_wise_production_lines, load_engine, normalize_product, result_cache, sync_catalog_if_changed,
+)
+from autobake_metrics import metrics
+
+MAX_BODY_BYTES = 1024 * 1024
+HTTP_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+    422: "Unprocessable Entity", 500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _numeric_text(value):
+    # The engine's numeric inputs are text fields where "" / "-" / None mean "not given"
+    return "-" if value in (None, "") else str(value).strip()
+
+class MatchService:
+    def __init__(self, engine, workers=4, max_pending=256, excel_file_path=None,
+                 csv_file_path=CSV_FILE, snapshot_path=SNAPSHOT_FILE):
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="autobake-match")
+        self.max_pending = max_pending
+        self.paths = (excel_file_path or catalog_source(), csv_file_path, snapshot_path)
+        self._in_flight = {} # (kind, query, catalog version) -> future shared by identical requests
+        self.stats = {"requests": 0, "executed": 0, "coalesced": 0, "rejected": 0, "errors": 0}
+
+    # --- CPU-bound work (runs in the executor) ---
+    def _parse(self, engine, prompt):
+        product, dough_weight, capacity = engine.parse_input(prompt)
+        return {
+            "product": product, "dough_weight": dough_weight, "capacity": capacity, "features": list(engine.parse_features(prompt)),
+            "products": [{"product": p, "capacity": c} for p, c in engine.parse_products(prompt)],
+            "unresolved_products": list(engine.unresolved_products(prompt)),
+        }
+
+    def _match(self, engine, query):
+        prompt, product, dough_weight, capacity, features, shared_products, tier2_k = query
+        return engine.match_from_inputs(prompt, product, dough_weight, capacity, features, shared_products, tier2_k).to_dict()
+
+    def _configure(self, engine, query):
+        product, capacity, dough_weight, features, k = query
+        return engine.configure_line(product, capacity, dough_weight, feature_query_terms(features), k).to_dict()
+
+    async def run_coalesced(self, kind, func, query):
+        engine = self.engine
+        key = (kind, query, engine.catalog_version)
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        if len(self._in_flight) >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise HTTPError(503, "Server busy, retry shortly.")
+
+        future = asyncio.get_running_loop().run_in_executor(self.executor, func, engine, query)
+        self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        self.stats["executed"] += 1
+        # shield: a disconnecting client must not cancel work other requests are waiting on
+        return await asyncio.shield(future)
+
+    # --- Catalog reload ---
+    async def watch_catalog(self, interval):
+        # Picks up workbook changes without a restart; requests keep using the old engine until the swap
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                catalog_version = await loop.run_in_executor(self.executor, sync_catalog_if_changed, *self.paths)
+                if catalog_version != self.engine.catalog_version:
+                    self.engine = await loop.run_in_executor(
+                        self.executor, MatchEngine.from_snapshot, self.paths[2], catalog_version, self.engine
+                    )
+                    print(f"🔄 Catalog reloaded: version {catalog_version[:12]}")
+            except Exception as e:
+                print(f"❌ ERROR while checking for catalog changes: {e}")
+
+    # --- Routing ---
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        if method == "POST":
+            try:
+                params.update(json.loads(body or b"{}"))
+            except (ValueError, TypeError):
+                raise HTTPError(400, "Request body must be a JSON object.")
+        elif method != "GET":
+            raise HTTPError(405, f"Method {method} not allowed.")
+
+        if url.path == "/health":
+            return {"status": "ok", "catalog_version": self.engine.catalog_version, "in_flight": len(self._in_flight),
+                    **self.stats, "result_cache": result_cache.stats()}
+        if url.path == "/metrics":
+            # Plain-text payloads are sent as-is (Prometheus exposition format)
+            return json.loads(metrics.to_json()) if params.get("format") == "json" else metrics.to_prometheus()
+        if url.path == "/products":
+            return {"products": self.engine.product_set}
+        if url.path == "/suggest":
+            try:
+                k = int(params.get("k") or 10)
+            except (TypeError, ValueError):
+                raise HTTPError(400, "'k' must be a whole number.")
+            # Sub-millisecond index lookup, cheap enough to answer on the event loop
+            return {"query": str(params.get("q") or ""), "suggestions": self.engine.suggest_products(str(params.get("q") or ""), max(k, 1))}
+        if url.path == "/stages":
+            if params.get("product"):
+                product_group, stages = self.engine.line_for(normalize_product(params["product"]))
+                return {"product": params["product"], "product_group": product_group, "stages": stages}
+            return {"lines": group_wise_production_lines}
+        if url.path == "/parse":
+            prompt = str(params.get("prompt") or "").strip()
+            if not prompt:
+                raise HTTPError(400, "'prompt' is required.")
+            return await self.run_coalesced("parse", self._parse, prompt.lower())
+        if url.path == "/match":
+            try:
+                tier2_k = None if params.get("tier2_k") in (None, "") else max(int(params["tier2_k"]), 0)
+            except (TypeError, ValueError):
+                raise HTTPError(400, "'tier2_k' must be a whole number.")
+            query = (
+                str(params.get("prompt") or "").strip().lower(),
+                str(params.get("product") or "").strip().lower(),
+                _numeric_text(params.get("dough_weight")),
+                _numeric_text(params.get("capacity")),
+                str(params.get("features") or "").strip().lower(),
+                str(params.get("shared_products") or "").strip().lower(),
+                tier2_k,
+            )
+            return await self.run_coalesced("match", self._match, query)
+        if url.path == "/configure":
+            if not params.get("product"):
+                raise HTTPError(400, "'product' is required.")
+            try:
+                query = (
+                    normalize_product(str(params["product"])),
+                    float(params.get("capacity") or 0),
+                    None if params.get("dough_weight") in (None, "", "-") else float(params["dough_weight"]),
+                    str(params.get("features") or "").strip().lower(),
+                    int(params.get("k") or CONFIGURATOR_TOP_K),
+                )
+            except (TypeError, ValueError):
+                raise HTTPError(400, "'capacity', 'dough_weight' and 'k' must be numbers.")
+            return await self.run_coalesced("configure", self._configure, query)
+        raise HTTPError(404, f"No route for {url.path}.")
+
+    # --- HTTP/1.1 plumbing (keep-alive, Content-Length bodies only) ---
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                self.stats["requests"] += 1
+                try:
+                    content_length = int(headers.get("content-length") or 0)
+                    if content_length > MAX_BODY_BYTES:
+                        keep_alive = False
+                        raise HTTPError(413, "Request body too large.")
+                    body = await reader.readexactly(content_length) if content_length else b""
+                    status, payload = 200, await self.dispatch(method.upper(), target, body)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except MatchInputError as e:
+                    status, payload = 422, {"error": str(e)}
+                except ValueError as e:
+                    status, payload = 400, {"error": str(e)}
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    status, payload = 500, {"error": f"Internal error: {e}"}
+
+                if isinstance(payload, str):
+                    response_body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+                else:
+                    response_body, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json"
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'Error')}\r\n"
+                    f"Content-Type: {content_type}; charset=utf-8\r\n"
+                    f"Content-Length: {len(response_body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + response_body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(host, port, workers, max_pending, reload_interval):
+    loop = asyncio.get_running_loop()
+    engine = await loop.run_in_executor(None, load_engine)
+    service = MatchService(engine, workers=workers, max_pending=max_pending)
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"✅ Autobake matching service on http://{host}:{port} (catalog {engine.catalog_version[:12]}, {workers} workers)")
+    if reload_interval > 0:
+        watcher = asyncio.create_task(service.watch_catalog(reload_interval))
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            if reload_interval > 0:
+                watcher.cancel()
+            service.executor.shutdown(wait=False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Autobake machine matching over local HTTP/JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--workers", type=int, default=4, help="Threads running parse/match work")
+    parser.add_argument("--max-pending", type=int, default=256, help="Distinct in-flight queries before answering 503")
+    parser.add_argument("--reload-interval", type=float, default=30.0, help="Seconds between workbook change checks (0 disables)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_pending, args.reload_interval))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Synthetic Autobake catalogs for benchmarking (same schema as the "Raw Data" sheet).
+
+Rows mix real categories with spelling variants (case, "&"/"and", typos, word order), leave
+numeric fields blank at roughly the real catalog's rates and sometimes list several products.
+
+    python benchmarks/generate_catalog.py --rows 10000 100000 1000000
+    python benchmarks/generate_catalog.py --rows 10000 --format csv --out /tmp/catalogs
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from autobake_engine import CATALOG_COLUMNS, machine_stage_mapping, product_to_group_mapping  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+SHEET_NAME = "Raw Data"
+
+# Blank rates observed in Raw_Data.csv
+MISSING_CAPACITY_RATE = 0.17
+MISSING_DOUGH_MIN_RATE = 0.27
+MISSING_DOUGH_MAX_RATE = 0.17
+MISSING_FEATURES_RATE = 0.03
+MULTI_PRODUCT_RATE = 0.3 # Rows listing 2-3 comma-joined products
+CATEGORY_VARIANT_RATE = 0.25
+UNKNOWN_CATEGORY_RATE = 0.02
+
+COMPANY_STEMS = ["Koenig", "Gasparin", "Jac", "Lynx", "VIS", "Ares", "Thor", "Rondo", "Fritsch", "Sinmag",
+                 "Mecnosud", "Tecnopast", "Esmach", "Mono", "Daub", "Rademaker", "Kaak", "Bertrand"]
+MACHINE_STEMS = ["Rex", "Futura", "Paniform", "Compact", "Titan", "Nova", "Evo", "Max", "Pro", "Duo"]
+UNKNOWN_CATEGORIES = ["Tray Washer", "Flour Silo", "Crate Stacker", "Ingredient Weigher"]
+FEATURE_PHRASES = [
+    "2 speeds on spiral tool", "Bowl inversion in 1st speed", "Stainless steel bowl", "Electronic control panel",
+    "Servo drivers for accuracy", "Non-stick cutting surface", "Automatic tray feeder", "Hydraulic unit 1.5 kW",
+    "Suitable for 10-12 hrs/day", "Low maintenance", "Touch screen recipes", "Energy saving burners",
+    "Steam injection", "Gentle dough handling", "Quick changeover", "Semi-industrial use",
+]
+
+def category_variant(category, rng):
+    # Variants the fuzzy Category -> Stage matching has to absorb
+    kind = rng.integers(5)
+    if kind == 0:
+        return category.lower()
+    if kind == 1:
+        return category.replace("&", "and") if "&" in category else category.upper()
+    if kind == 2 and len(category) > 6:
+        # One dropped letter
+        position = int(rng.integers(1, len(category) - 1))
+        return category[:position] + category[position + 1:]
+    if kind == 3 and " " in category:
+        words = category.split()
+        return " ".join(words[1:] + words[:1])
+    return f" {category}  "
+
+def generate_catalog(n_rows, seed=0):
+    """Returns a DataFrame of n_rows string cells (blank = missing), like the synced CSV."""
+    rng = np.random.default_rng(seed)
+    categories = list(machine_stage_mapping)
+    products = sorted(set(product_to_group_mapping))
+
+    # A pool of machines (company, name, category, specs), each listed for one or more products
+    n_machines = max(n_rows // 20, 1)
+    companies = np.array([
+        f"{stem} {suffix}".strip()
+        for stem, suffix in zip(rng.choice(COMPANY_STEMS, n_machines), rng.choice(["", "Mixers", "Ovens", "Group", "Srl"], n_machines))
+    ], dtype=object)
+    machine_names = np.array([f"{rng.choice(MACHINE_STEMS)} {int(model)}" for model in rng.integers(10, 5000, n_machines)], dtype=object)
+
+    machine_categories = np.array(categories, dtype=object)[rng.integers(len(categories), size=n_machines)]
+    variant = rng.random(n_machines) < CATEGORY_VARIANT_RATE
+    machine_categories[variant] = [category_variant(c, rng) for c in machine_categories[variant]]
+    unknown = rng.random(n_machines) < UNKNOWN_CATEGORY_RATE
+    machine_categories[unknown] = rng.choice(UNKNOWN_CATEGORIES, int(unknown.sum()))
+
+    capacity = np.round(rng.lognormal(7.5, 1.0, n_machines), -1)
+    dough_min = np.round(rng.lognormal(3.5, 1.2, n_machines))
+    dough_max = np.round(dough_min * rng.uniform(1.5, 40, n_machines))
+    features = np.array([
+        " | ".join(rng.choice(FEATURE_PHRASES, int(rng.integers(1, 5)), replace=False)) for _ in range(n_machines)
+    ], dtype=object)
+
+    machine_of_row = rng.integers(n_machines, size=n_rows)
+    n_products = np.where(rng.random(n_rows) < MULTI_PRODUCT_RATE, rng.integers(2, 4, n_rows), 1)
+    product_ids = rng.integers(len(products), size=(n_rows, 3))
+    product_lists = [", ".join(products[j] for j in row[:k]) for row, k in zip(product_ids, n_products)]
+
+    def numeric_text(values, missing_rate):
+        text = np.array([str(int(v)) for v in values[machine_of_row]], dtype=object)
+        text[rng.random(n_rows) < missing_rate] = ""
+        return text
+
+    feature_text = features[machine_of_row].copy()
+    feature_text[rng.random(n_rows) < MISSING_FEATURES_RATE] = ""
+
+    return pd.DataFrame({
+        "Company Name": companies[machine_of_row],
+        "Machine Name": machine_names[machine_of_row],
+        "Category": machine_categories[machine_of_row],
+        "Production Capacity (pcs/hr)": numeric_text(capacity, MISSING_CAPACITY_RATE),
+        "Dough Min (g)": numeric_text(dough_min, MISSING_DOUGH_MIN_RATE),
+        "Dough Max (g)": numeric_text(dough_max, MISSING_DOUGH_MAX_RATE),
+        "Products": product_lists,
+        "Key Features / Notes": feature_text,
+    }, columns=CATALOG_COLUMNS)
+
+def write_catalog_xlsx(df_catalog, xlsx_path):
+    # write_only streams rows, which keeps 1M-row workbooks within reasonable memory/time
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(SHEET_NAME)
+    sheet.append(CATALOG_COLUMNS)
+    for row in df_catalog.itertuples(index=False, name=None):
+        sheet.append([None if cell == "" else cell for cell in row])
+    tmp_path = f"{xlsx_path}.tmp"
+    workbook.save(tmp_path)
+    os.replace(tmp_path, xlsx_path)
+
+def catalog_label(n_rows):
+    return f"{n_rows // 1_000_000}m" if n_rows % 1_000_000 == 0 else f"{n_rows // 1000}k" if n_rows % 1000 == 0 else str(n_rows)
+
+def catalog_path(n_rows, file_format="xlsx", out_dir=DATA_DIR, seed=0):
+    return os.path.join(out_dir, f"catalog_{catalog_label(n_rows)}_s{seed}.{file_format}")
+
+def ensure_catalog(n_rows, file_format="xlsx", out_dir=DATA_DIR, seed=0):
+    # Generated files are reused across runs; delete them to regenerate
+    path = catalog_path(n_rows, file_format, out_dir, seed)
+    if not os.path.exists(path):
+        os.makedirs(out_dir, exist_ok=True)
+        df_catalog = generate_catalog(n_rows, seed)
+        if file_format == "csv":
+            df_catalog.to_csv(path, index=False, encoding="utf-8")
+        else:
+            write_catalog_xlsx(df_catalog, path)
+        print(f"✅ Generated {n_rows} rows -> '{path}'")
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic Autobake catalogs for benchmarks.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--format", choices=["xlsx", "csv"], default="xlsx")
+    parser.add_argument("--out", default=DATA_DIR, help="Output directory")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    for n_rows in args.rows:
+        ensure_catalog(n_rows, args.format, args.out, args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Benchmark harness for the Autobake engine on synthetic catalogs.
+
+Times the UI-free hot paths on each catalog size and compares the medians with the stored
+baselines (benchmarks/baselines.json). Everything runs in a scratch directory, so the repo's
+own CSV, snapshot, manifest and stage cache are never touched.
+
+    python benchmarks/run_benchmarks.py                      # 10k rows, compare with baselines
+    python benchmarks/run_benchmarks.py --rows 10000 100000 1000000
+    python benchmarks/run_benchmarks.py --save-baseline      # record the current numbers
+    python benchmarks/run_benchmarks.py --fail-on-regression # exit 1 if anything got slower
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+from autobake_engine import (  # noqa: E402
+    TIER2_NEAREST_K, MatchEngine, MatchInputError, catalog_memory_report, generate_display_dataframe, result_cache, sync_catalog_if_changed,
+)
+from generate_catalog import catalog_label, ensure_catalog  # noqa: E402
+
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, "baselines.json")
+REGRESSION_TOLERANCE = 0.20 # Median slower than baseline by more than this = regression
+PROMPT_TEMPLATES = [
+    "I need a line for {capacity} {product}s per hour with {weight}g dough weight",
+    "{product} {weight} grams {capacity} pcs per hour",
+    "we want to produce {product}, about {capacity} pieces",
+    "{product} line",
+]
+
+def time_calls(func, args_list, setup=None):
+    # One timing per call; setup (e.g. clearing caches) runs outside the timed region
+    timings = []
+    for args in args_list:
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+def summarize(timings):
+    ordered = sorted(timings)
+    return {
+        "n": len(ordered),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)] * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+    }
+
+def sample_queries(engine, n_queries, seed=0):
+    rng = np.random.default_rng(seed)
+    products = engine.product_set
+    queries = []
+    for i in range(n_queries):
+        product = products[int(rng.integers(len(products)))]
+        weight, capacity = int(rng.integers(20, 800)), int(rng.integers(500, 20000))
+        prompt = PROMPT_TEMPLATES[i % len(PROMPT_TEMPLATES)].format(product=product, weight=weight, capacity=capacity)
+        queries.append((prompt, product, weight, capacity))
+    return queries
+
+def run_size(n_rows, repeat, n_queries, seed):
+    """Returns {benchmark: summary} for one catalog size."""
+    excel_path = ensure_catalog(n_rows, "xlsx", seed=seed)
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix=f"autobake_bench_{catalog_label(n_rows)}_")
+    cwd = os.getcwd()
+    os.chdir(work_dir) # Stage cache and sync files land in the scratch directory
+    try:
+        paths = ("catalog.xlsx", "Raw_Data.csv", "Raw_Data.arrow", "manifest.json")
+        shutil.copyfile(excel_path, paths[0])
+
+        def clean_sync_outputs():
+            for path in paths[1:] + (".stage_cache.json",):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        with redirect_stdout(sys.stderr):
+            # Cold sync = Excel -> CSV -> snapshot; warm sync = unchanged workbook (stat + manifest)
+            sync_repeat = 1 if n_rows >= 1_000_000 else min(repeat, 3)
+            results["sync_cold"] = summarize(time_calls(sync_catalog_if_changed, [paths] * sync_repeat, setup=clean_sync_outputs))
+            catalog_version = sync_catalog_if_changed(*paths)
+            results["sync_warm"] = summarize(time_calls(sync_catalog_if_changed, [paths] * repeat))
+
+            # First load also fuzzy-matches every distinct Category; later loads hit the stage cache
+            results["load_cold"] = summarize(time_calls(MatchEngine.from_snapshot, [(paths[2], catalog_version)]))
+            results["load_warm"] = summarize(time_calls(MatchEngine.from_snapshot, [(paths[2], catalog_version)] * repeat))
+        engine = MatchEngine.from_snapshot(paths[2], catalog_version)
+
+        queries = sample_queries(engine, n_queries, seed)
+        # Prompts are unique, so every parse misses the per-engine parse cache
+        results["parse_input"] = summarize(time_calls(engine.parse_input, [(prompt,) for prompt, *_ in queries]))
+
+        # Two or three catalog terms per query, like "stainless steel" or "servo driver accuracy"
+        rng = np.random.default_rng(seed)
+        vocabulary = engine.feature_index.vocabulary
+        feature_queries = [(tuple(vocabulary[i] for i in rng.integers(len(vocabulary), size=int(rng.integers(2, 4)))),) for _ in range(n_queries)]
+        results["feature_lookup"] = summarize(time_calls(engine.feature_index.scores, feature_queries))
+
+        # Autocomplete on prefixes and one-typo variants of real product names
+        suggest_queries = []
+        for _, product, *_ in queries:
+            cut = int(rng.integers(len(product)))
+            suggest_queries.append((product[:max(cut, 3)] if rng.random() < 0.5 else product[:cut] + product[cut + 1:],))
+        results["product_suggest"] = summarize(time_calls(engine.suggest_products, suggest_queries))
+
+        # Product-only queries are answered from the materialized line plans
+        results["match_product_only"] = summarize(time_calls(
+            lambda product: engine.match(product, use_cache=False), [(product,) for _, product, *_ in queries]
+        ))
+
+        # Shared lines for two or three products, each with its own capacity
+        composite_queries = []
+        for _ in range(n_queries):
+            picks = rng.choice(len(engine.product_set), size=int(rng.integers(2, 4)), replace=False)
+            composite_queries.append((tuple((engine.product_set[i], int(rng.integers(500, 20000))) for i in picks), int(rng.integers(20, 800))))
+        results["match_composite"] = summarize(time_calls(
+            lambda line_products, weight: engine.match_composite(line_products, weight, use_cache=False), composite_queries
+        ))
+
+        # Top-5 balanced lines for each sampled target, including the underlying match
+        results["configure_line"] = summarize(time_calls(
+            lambda product, weight, capacity: engine.configure_line(product, capacity, weight), [(product, weight, capacity) for _, product, weight, capacity in queries]
+        ))
+
+        def match_from_inputs(prompt, product, weight, capacity):
+            try:
+                engine.match_from_inputs(prompt, product, str(weight), str(capacity))
+            except MatchInputError:
+                pass
+        # Cleared per call so every match does the full work
+        results["match_from_inputs"] = summarize(time_calls(match_from_inputs, queries, setup=result_cache.clear))
+        # Tier 2 cut to the nearest-spec machines, as the app requests by default
+        results["match_nearest_tier2"] = summarize(time_calls(
+            lambda product, weight, capacity: engine.match(product, weight, capacity, use_cache=False, tier2_k=TIER2_NEAREST_K),
+            [(product, weight, capacity) for _, product, weight, capacity in queries]
+        ))
+
+        # Time until the app can render the first stage of a streamed match (header + one stage tiered)
+        def match_first_stage(product, weight, capacity):
+            stream = engine.iter_match(product, weight, capacity, use_cache=False, tier2_k=TIER2_NEAREST_K)
+            next(stream)
+            next(stream, None)
+        results["match_first_stage"] = summarize(time_calls(
+            match_first_stage, [(product, weight, capacity) for _, product, weight, capacity in queries]
+        ))
+
+        tier_frames = []
+        for _, product, weight, capacity in queries:
+            match = engine.match(product, weight, capacity, use_cache=False)
+            tier_frames += [(frame, capacity) for stage in match.stage_results.values() for frame in (stage.tier1, stage.tier2) if not frame.empty]
+        results["generate_display_dataframe"] = summarize(time_calls(generate_display_dataframe, tier_frames))
+        results["_catalog"] = {
+            "source_rows": n_rows, "machines": len(engine.catalog),
+            "product_links": len(engine.product_index.row_ids), "products": len(engine.product_set),
+            "catalog_bytes": int(catalog_memory_report(engine.catalog).loc["Total", "bytes_after"]),
+        }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def compare(results, baselines, tolerance=REGRESSION_TOLERANCE):
+    """Prints a table against the baselines and returns the list of regressions."""
+    regressions = []
+    print(f"{'size':>6}  {'benchmark':<28} {'median ms':>11} {'baseline':>11} {'change':>8}")
+    for label, size_results in results.items():
+        for name, summary in size_results.items():
+            if name.startswith("_"):
+                continue
+            baseline = baselines.get("sizes", {}).get(label, {}).get(name)
+            change_text, baseline_text = "", "-"
+            if baseline:
+                change = summary["median_ms"] / baseline["median_ms"] - 1 if baseline["median_ms"] else 0.0
+                baseline_text = f"{baseline['median_ms']:.3f}"
+                change_text = f"{change:+.0%}"
+                if change > tolerance:
+                    change_text += " ⚠️"
+                    regressions.append((label, name, change))
+            print(f"{label:>6}  {name:<28} {summary['median_ms']:>11.3f} {baseline_text:>11} {change_text:>8}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Autobake engine on synthetic catalogs.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000], help="Catalog sizes (e.g. 10000 100000 1000000)")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions for sync/load benchmarks")
+    parser.add_argument("--queries", type=int, default=200, help="Queries for parse/match/display benchmarks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline for the sizes run")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE, help="Allowed median slowdown (0.2 = 20%%)")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--json", help="Also write the raw results to this file")
+    args = parser.parse_args(argv)
+
+    results = {catalog_label(n_rows): run_size(n_rows, args.repeat, args.queries, args.seed) for n_rows in args.rows}
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baselines = json.load(f)
+    regressions = compare(results, baselines, args.tolerance)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        baselines.setdefault("sizes", {}).update(results)
+        baselines["machine"] = {
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "recorded": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2)
+            f.write("\n")
+        print(f"✅ Baseline saved to '{args.baseline}'.")
+    elif regressions:
+        print(f"⚠️ {len(regressions)} benchmark(s) slower than baseline by more than {args.tolerance:.0%}.")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
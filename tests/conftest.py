@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The engine is a flat module in the repo root (like benchmarks/, tests import it by path)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,50 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from autobake_engine import MatchEngine, prepare_catalog_chunk
+
+STAGES = ["Mixing", "Dividing", "Baking", "Packing"] # Part of the bun line
+
+def small_catalog(rng, machines_per_stage=4):
+    rows = []
+    for stage in STAGES:
+        for i in range(machines_per_stage):
+            capacity = rng.choice([np.nan, 0, 700, 1200, 1500, 2500, 4000, 6000])
+            rows.append({
+                "Company Name": rng.choice(["Alpha", "Beta", "Gamma"]), "Machine Name": f"{stage} {i}", "Category": stage,
+                "Production Capacity (pcs/hr)": "" if np.isnan(capacity) else str(int(capacity)),
+                "Dough Min (g)": str(rng.choice([20, 40, 80])), "Dough Max (g)": str(rng.choice([60, 120, 500])),
+                "Products": "bun", "Key Features / Notes": "",
+            })
+    df_catalog = prepare_catalog_chunk(pd.DataFrame(rows))
+    df_catalog["Stage"] = df_catalog["Category"] # Categories already are stage names
+    return df_catalog
+
+def brute_force(df_catalog, capacity, dough_weight, k):
+    # Every combination of one fitting machine per stage, ranked by total units, then total overshoot
+    stage_options = []
+    for stage in STAGES:
+        machines = df_catalog[df_catalog["Stage"] == stage]
+        machine_capacity = machines["_Numeric_Production Capacity (pcs/hr)"].to_numpy(dtype="float64")
+        fits = (machine_capacity > 0) & (machines["_Numeric_Dough Min (g)"] <= dough_weight) & (machines["_Numeric_Dough Max (g)"] >= dough_weight)
+        units = np.ceil(capacity / machine_capacity[fits])
+        if len(units):
+            stage_options.append(list(zip(units, units * machine_capacity[fits] - capacity)))
+    lines = [
+        (sum(units for units, _ in line), sum(overshoot for _, overshoot in line)) for line in itertools.product(*stage_options)
+    ]
+    return sorted(lines)[:k]
+
+def test_top_k_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for seed in range(20):
+        engine = MatchEngine(small_catalog(rng), catalog_version=f"configurator-test-{seed}")
+        capacity, dough_weight = int(rng.choice([500, 3000, 9000])), float(rng.choice([30, 50, 100]))
+        for k in (1, 5, 300):
+            result = engine.configure_line("bun", capacity, dough_weight, k=k)
+            lines = [(configuration.total_units, configuration.overshoot) for configuration in result.configurations]
+            assert lines == brute_force(engine.catalog, capacity, dough_weight, k)
+            for configuration in result.configurations:
+                assert sum(machine["units_required"] for machine in configuration.machines) == configuration.total_units
@@ -0,0 +1,76 @@
+import numpy as np
+
+from autobake_engine import DoughRangeIndex
+
+def linear_scan(row_ids, dough_min, dough_max, weight):
+    # The dough filter in tier_stage_candidates: a NaN bound is open-ended
+    fits = (np.isnan(dough_min) | (dough_min <= weight)) & (np.isnan(dough_max) | (dough_max >= weight))
+    return np.sort(row_ids[fits])
+
+def random_ranges(rng, n_rows):
+    dough_min = np.round(rng.lognormal(3.5, 1.2, n_rows))
+    dough_max = np.round(dough_min * rng.uniform(0.5, 20, n_rows)) # Some below min, i.e. inverted
+    dough_min[rng.random(n_rows) < 0.2] = np.nan
+    dough_max[rng.random(n_rows) < 0.2] = np.nan
+    return dough_min, dough_max
+
+def test_covering_matches_linear_scan():
+    rng = np.random.default_rng(0)
+    for n_rows in (0, 1, 7, 500):
+        dough_min, dough_max = random_ranges(rng, n_rows)
+        row_ids = np.sort(rng.choice(10 * n_rows + 1, n_rows, replace=False))
+        index = DoughRangeIndex(row_ids, dough_min, dough_max)
+        for weight in np.r_[rng.uniform(0, 2000, 50), dough_min[:20], dough_max[:20], 0.0]:
+            if np.isnan(weight):
+                continue
+            np.testing.assert_array_equal(index.covering(weight), linear_scan(row_ids, dough_min, dough_max, weight))
+
+def test_inverted_range_matches_nothing():
+    # A single Dough Min > Dough Max row used to recurse until RecursionError
+    index = DoughRangeIndex(np.array([3, 5]), np.array([500.0, 10.0]), np.array([100.0, 50.0]))
+    assert index.covering(300).tolist() == []
+    assert index.covering(100).tolist() == []
+    assert index.covering(20).tolist() == [5]
+
+def test_nan_bounds_are_open_ended():
+    index = DoughRangeIndex(np.arange(3), np.array([np.nan, 40.0, np.nan]), np.array([60.0, np.nan, np.nan]))
+    assert index.covering(10).tolist() == [0, 2]
+    assert index.covering(50).tolist() == [0, 1, 2]
+    assert index.covering(1000).tolist() == [1, 2]
+
+def brute_force_nearest(row_ids, dough_min, dough_max, groups, weight, k, wanted):
+    # Grams outside the range for every miss in the wanted groups, then the k smallest plus ties
+    lows, highs = np.nan_to_num(dough_min, nan=-np.inf), np.nan_to_num(dough_max, nan=np.inf)
+    gaps = np.maximum(lows - weight, weight - highs)
+    misses = (gaps > 0) | (lows > highs)
+    misses &= np.isin(groups, wanted)
+    rows, gaps = row_ids[misses], gaps[misses]
+    if k < len(gaps):
+        keep = gaps <= np.sort(gaps)[k - 1]
+        rows, gaps = rows[keep], gaps[keep]
+    order = np.lexsort((rows, gaps))
+    return rows[order], gaps[order]
+
+def test_nearest_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for n_rows in (0, 1, 7, 500):
+        dough_min, dough_max = random_ranges(rng, n_rows)
+        row_ids = np.sort(rng.choice(10 * n_rows + 1, n_rows, replace=False))
+        groups = rng.integers(0, 4, n_rows)
+        index = DoughRangeIndex(row_ids, dough_min, dough_max, groups)
+        for weight in np.r_[rng.uniform(0, 2000, 20), dough_min[:10], dough_max[:10]]:
+            if np.isnan(weight):
+                continue
+            for k, wanted in ((1, [0, 1, 2, 3]), (5, [2]), (5, [1, 3, 9]), (n_rows + 1, [0, 1, 2, 3])):
+                rows, gaps = index.nearest(weight, k, wanted)
+                expected_rows, expected_gaps = brute_force_nearest(row_ids, dough_min, dough_max, groups, weight, k, wanted)
+                np.testing.assert_array_equal(rows, expected_rows)
+                np.testing.assert_array_equal(gaps, expected_gaps)
+
+def test_nearest_keeps_ties_with_kth():
+    index = DoughRangeIndex(np.arange(4), np.array([55.0, np.nan, 40.0, 20.0]), np.array([80.0, 40.0, 45.0, 30.0]))
+    rows, gaps = index.nearest(50, 1)
+    assert rows.tolist() == [0, 2] and gaps.tolist() == [5, 5]
+    assert index.nearest(50, 3)[0].tolist() == [0, 2, 1]
+    assert index.nearest(50, 0)[0].tolist() == []
+    assert index.nearest(45, 2)[0].tolist() == [1, 0] # Open-ended min still misses above its max
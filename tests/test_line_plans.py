@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+from autobake_engine import LinePlanner, ProductIndex, build_line_plans
+
+STAGES = ["Mixing", "Dividing", "Baking"]
+PRODUCTS = ["bun", "bread", "baguette", "roll"]
+
+def line_for(product):
+    return "Test Group", STAGES
+
+def random_catalog(rng, n_rows):
+    return pd.DataFrame({
+        "Company Name": rng.choice(["Alpha", "Beta", "Gamma"], n_rows),
+        "Machine Name": [f"M{i}" for i in range(n_rows)],
+        "Stage": rng.choice(STAGES + ["Packing"], n_rows),
+        "Products": [", ".join(rng.choice(PRODUCTS[:3], rng.integers(1, 3), replace=False)) for _ in range(n_rows)],
+    })
+
+def planner_for(df_catalog):
+    return LinePlanner(df_catalog, ProductIndex(df_catalog["Products"]), line_for)
+
+def assert_plans_equal(plans, expected):
+    assert plans.keys() == expected.keys()
+    for product, plan in expected.items():
+        assert plans[product].stages == plan.stages
+        np.testing.assert_array_equal(plans[product].rows, plan.rows)
+        np.testing.assert_array_equal(plans[product].stage_bounds, plan.stage_bounds)
+        assert plans[product].candidate_count == plan.candidate_count
+
+def check_remap(old_catalog, new_catalog):
+    old_planner = planner_for(old_catalog)
+    old_plans, _ = build_line_plans(old_planner, PRODUCTS)
+    new_planner = planner_for(new_catalog)
+    plans, rebuilt = build_line_plans(new_planner, PRODUCTS, old_plans, old_planner)
+    assert_plans_equal(plans, build_line_plans(planner_for(new_catalog), PRODUCTS)[0])
+    return rebuilt
+
+def test_remap_matches_fresh_build():
+    rng = np.random.default_rng(0)
+    old_catalog = random_catalog(rng, 60)
+    assert check_remap(old_catalog, old_catalog) == []
+    # A new first machine moves every row; plans not listing it are remapped, not rebuilt
+    new_machine = pd.DataFrame({"Company Name": ["Alpha"], "Machine Name": ["R1"], "Stage": ["Baking"], "Products": ["roll"]})
+    assert check_remap(old_catalog, pd.concat([new_machine, old_catalog], ignore_index=True)) == ["roll"]
+    # Same machines in a new order: remapped or rebuilt, the plans must come out the same
+    check_remap(old_catalog, old_catalog.sample(frac=1, random_state=1).reset_index(drop=True))
+    # A dropped machine and an edited one only rebuild the products they list
+    edited = old_catalog.drop(index=3).reset_index(drop=True)
+    edited.loc[10, "Machine Name"] = "M10 Mk II"
+    changed = set(old_catalog.loc[3, "Products"].split(", ")) | set(edited.loc[10, "Products"].split(", "))
+    assert set(check_remap(old_catalog, edited)) == changed
+
+def test_remap_rebuilds_when_order_within_company_changes():
+    old_catalog = pd.DataFrame({
+        "Company Name": ["Alpha", "Alpha", "Beta"],
+        "Machine Name": ["A1", "A2", "B1"],
+        "Stage": ["Mixing", "Mixing", "Mixing"],
+        "Products": ["bun", "bun", "bun"],
+    })
+    swapped = old_catalog.iloc[[1, 0, 2]].reset_index(drop=True)
+    assert check_remap(old_catalog, swapped) == ["bun"]
+
+def test_remap_of_empty_catalog():
+    empty = random_catalog(np.random.default_rng(0), 0)
+    assert check_remap(empty, empty) == []
@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+from autobake_engine import MatchEngine, prepare_catalog_chunk
+
+@pytest.fixture(scope="module")
+def engine():
+    df_catalog = prepare_catalog_chunk(pd.DataFrame([
+        {"Company Name": "Alpha", "Machine Name": f"Machine {i}", "Category": "Mixing", "Production Capacity (pcs/hr)": "2000",
+         "Dough Min (g)": "20", "Dough Max (g)": "200", "Products": products, "Key Features / Notes": ""}
+        for i, products in enumerate(["bun, bread loaf", "baguette", "rusk, bun"])
+    ]))
+    df_catalog["Stage"] = df_catalog["Category"]
+    return MatchEngine(df_catalog, catalog_version="line-products-test")
+
+def line_products(engine, prompt):
+    product, _, capacity, _ = engine.resolve_inputs(prompt, "", "", "")
+    return engine.resolve_line_products(prompt, product, capacity)
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("I need a bun line, fully automatic", (("bun", None),)),
+    ("Looking for buns and also a cheap option", (("bun", None),)),
+    ("bun line for 3000 pcs; low maintenance & easy cleaning", (("bun", 3000),)),
+    ("rusk plus a spare parts kit", (("rusk", None),)),
+])
+def test_qualified_single_product_prompt(engine, prompt, expected):
+    assert line_products(engine, prompt) == expected
+
+def test_two_products_make_a_shared_line(engine):
+    assert line_products(engine, "5000 buns and 2000 bread loaves") == (("bun", 5000), ("bread loaf", 2000))
+    # A capacity in its own part applies to every product without one
+    assert line_products(engine, "buns and bread loaves, 5000 pcs per hour, 50g dough") == (("bun", 5000), ("bread loaf", 5000))
+
+def test_unknown_parts_are_left_out(engine):
+    prompt = "buns, sourdough bread and baguettes 2000 pcs"
+    assert line_products(engine, prompt) == (("bun", None), ("baguette", 2000))
+    assert engine.unresolved_products(prompt) == ("sourdough bread",)
+    assert engine.resolve_line_products("", "bun", 100, "bread loaf 2000, sourdough") == (("bun", 100), ("bread loaf", 2000))
@@ -0,0 +1,27 @@
+import pandas as pd
+
+from autobake_engine import MatchEngine, prepare_catalog_chunk
+
+def mixers(machines):
+    # (company, machine, capacity, dough min, dough max), all bun mixers
+    df_catalog = prepare_catalog_chunk(pd.DataFrame([{
+        "Company Name": company, "Machine Name": machine, "Category": "Mixing", "Production Capacity (pcs/hr)": capacity,
+        "Dough Min (g)": dough_min, "Dough Max (g)": dough_max, "Products": "bun", "Key Features / Notes": "",
+    } for company, machine, capacity, dough_min, dough_max in machines]))
+    df_catalog["Stage"] = df_catalog["Category"]
+    return df_catalog
+
+def test_equal_dough_gap_goes_by_capacity_shortfall():
+    engine = MatchEngine(mixers([
+        ("Alpha", "Small Mixer", "1000", "60", "200"), # 10 g short, one unit covers 1/3 of 3000
+        ("Beta", "Large Mixer", "2500", "20", "40"),   # 10 g over, one unit covers 5/6
+        ("Gamma", "Far Mixer", "3000", "80", "200"),   # 30 g short
+        ("Delta", "Fitting Mixer", "500", "20", "200"),
+    ]), catalog_version="nearest-tiers-test")
+    for _ in range(2):
+        tier2 = engine.match("bun", 50, 3000, use_cache=False, tier2_k=3).stage_results["Mixing"].tier2
+        assert tier2["Machine Name"].tolist() == ["Large Mixer", "Small Mixer", "Far Mixer"]
+        assert tier2["Spec Distance"].tolist() == [0.2, 0.2, 0.6]
+        tier2 = engine.match("bun", 50, 3000, use_cache=False, tier2_k=1).stage_results["Mixing"].tier2
+        assert tier2["Machine Name"].tolist() == ["Large Mixer"] # Not Alpha, which only wins on company
+        engine.dough_indexes = {} # Again without the index: the scanning path must rank the same
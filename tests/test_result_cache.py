@@ -0,0 +1,41 @@
+import pandas as pd
+
+from autobake_engine import MatchEngine, ResultCache, prepare_catalog_chunk, result_cache
+
+def mixer_catalog(capacity):
+    df_catalog = prepare_catalog_chunk(pd.DataFrame([{
+        "Company Name": "Alpha", "Machine Name": "Spiral Mixer", "Category": "Mixing", "Production Capacity (pcs/hr)": str(capacity),
+        "Dough Min (g)": "20", "Dough Max (g)": "200", "Products": "bun", "Key Features / Notes": "",
+    }]))
+    df_catalog["Stage"] = df_catalog["Category"]
+    return df_catalog
+
+def test_new_catalog_version_drops_entries():
+    cache = ResultCache()
+    cache.put("key", "v1", "result v1")
+    assert cache.get("key", "v1") == "result v1"
+    assert cache.get("key", "v2") is None
+    assert cache.get("key", "v1") is None # The v1 entry went with the switch, it does not come back
+    assert cache.stats()["invalidations"] == 1
+
+def test_sync_version_drops_entries():
+    cache = ResultCache()
+    cache.put("key", "v1", "result v1")
+    cache.set_catalog_version("v1")
+    assert cache.get("key", "v1") == "result v1"
+    cache.set_catalog_version("v2")
+    assert cache.stats()["entries"] == 0
+
+def test_engine_for_new_catalog_is_not_served_old_results():
+    result_cache.clear()
+    old_engine = MatchEngine(mixer_catalog(1000), catalog_version="cache-test-v1")
+    assert not old_engine.match("bun", 50, 3000).from_cache
+    assert old_engine.match("bun", 50, 3000).from_cache
+
+    new_engine = MatchEngine(mixer_catalog(500), catalog_version="cache-test-v2")
+    result = new_engine.match("bun", 50, 3000)
+    assert not result.from_cache
+    assert result.catalog_version == "cache-test-v2"
+    assert result.stage_results["Mixing"].tier1["Calculated Units Required"].tolist() == [6]
+    # The old engine's entries were dropped too, so it recomputes rather than serving a stale hit
+    assert not old_engine.match("bun", 50, 3000).from_cache